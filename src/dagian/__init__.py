@@ -1,8 +1,10 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 import pkg_resources
 
-__all__ = ['tools', 'bundling', 'data_generator', 'data_handlers', 'decorators', 'dag']
+__all__ = ['tools', 'bundling', 'bundle_reader', 'data_generator', 'data_handlers',
+           'decorators', 'dag']
 __version__ = pkg_resources.get_distribution("dagian").version
 
 from .data_generator import DataGenerator, FeatureGenerator  # noqa: F401
 from .data_definition import Argument  # noqa: F401
+from .bundle_reader import BundleReader  # noqa: F401
@@ -0,0 +1,172 @@
+"""Write the bundles as directories of files instead of a single HDF5 file.
+
+In the ``'npy'`` and ``'arrow'`` formats, each dataset in the bundle structure is written as a
+file at the same path in the bundle directory. The dense arrays are ``.npy`` files that can
+be loaded with ``numpy.load(path, mmap_mode='r')``, and the sparse matrices are uncompressed
+``.npz`` files that can be loaded with ``scipy.sparse.load_npz()``. The DataFrames are
+``.npy`` files of record arrays in the ``'npy'`` format, or Arrow IPC files (``.arrow``) in
+the ``'arrow'`` format, which requires pyarrow. The object data (e.g., strings in pandas) are
+only supported as Arrow columns, since the ``.npy`` files would pickle them.
+"""
+from __future__ import print_function, division, absolute_import, unicode_literals
+import io
+import json
+import os
+
+import h5py
+import h5sparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import six
+from pathlib2 import Path
+
+from .data_wrappers import ArrowDataset, PandasHDFDataset
+from .data_wrappers.arrow import write_arrow_batches
+
+
+BUNDLE_FORMATS = ('hdf5', 'npy', 'arrow')
+BUNDLE_FILE_SUFFIXES = ('.npy', '.npz', '.arrow')
+FINGERPRINTS_FILE_NAME = 'fingerprints.json'
+
+
+def check_bundle_format(bundle_format):
+    if bundle_format not in BUNDLE_FORMATS:
+        raise ValueError("format should be one of {}, but got {!r}."
+                         .format(BUNDLE_FORMATS, bundle_format))
+
+
+def get_bundle_file_path(bundle_dir, dset_name, suffix):
+    path = Path(bundle_dir) / (dset_name.lstrip("/") + suffix)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def open_npy_memmap(bundle_dir, dset_name, shape, dtype):
+    """Create a ``.npy`` file to be filled through a memmap."""
+    path = get_bundle_file_path(bundle_dir, dset_name, '.npy')
+    return np.lib.format.open_memmap(str(path), mode='w+', dtype=dtype, shape=shape)
+
+
+def _select_rows(data, start, stop):
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        rows = data.iloc[start: stop]
+    else:
+        rows = data.select(start=start, stop=stop)
+    if isinstance(rows, pd.Series):
+        rows = rows.to_frame()
+    return rows
+
+
+def _iter_table_batches(data, buffer_size):
+    """Read a DataFrame, a Series or a lazy table (e.g., ``PandasHDFDataset``) in batches of
+    at most ``buffer_size`` bytes."""
+    if data.shape is None:
+        # the shape of some fixed-format pandas HDF data is unknown
+        data = data.value
+    n_rows = data.shape[0]
+    first_rows = _select_rows(data, 0, 1)
+    row_bytes = max(1, int(first_rows.memory_usage(index=False, deep=True).sum()))
+    batch_size = max(1, buffer_size // row_bytes)
+    # an empty table still has a batch for the columns
+    for batch_start in range(0, max(1, n_rows), batch_size):
+        yield _select_rows(data, batch_start, batch_start + batch_size)
+
+
+def _write_npy_records(data, bundle_dir, dset_name, buffer_size):
+    memmap = None
+    batch_start = 0
+    for batch in _iter_table_batches(data, buffer_size):
+        records = batch.to_records(index=False)
+        if records.dtype.hasobject:
+            raise ValueError("The object columns of {} can't be written in the 'npy' format "
+                             "without pickling. Use the 'arrow' format or convert the columns."
+                             .format(dset_name))
+        if memmap is None:
+            memmap = open_npy_memmap(bundle_dir, dset_name, (data.shape[0],), records.dtype)
+        memmap[batch_start: batch_start + len(records)] = records
+        batch_start += len(records)
+    memmap.flush()
+
+
+def write_directory_bundle_data(data, bundle_dir, dset_name, bundle_format,
+                                buffer_size=int(1e+9)):
+    """Write the data into a bundle directory.
+
+    The data can be loaded by ``DataHandler.prepare_bundle_data()``, or be the lazy dense or
+    table datasets returned by ``DataHandler.get()`` (e.g., ``h5py.Dataset``,
+    ``PandasHDFDataset`` or ``ArrowDataset``). The dense data and the tables are read and
+    written in batches of at most ``buffer_size`` bytes, and the sparse data are loaded
+    whole.
+    """
+    if isinstance(data, (pd.DataFrame, pd.Series, PandasHDFDataset, ArrowDataset)):
+        if bundle_format == 'arrow':
+            write_arrow_batches(_iter_table_batches(data, buffer_size),
+                                get_bundle_file_path(bundle_dir, dset_name, '.arrow'),
+                                preserve_index=False)
+        else:
+            _write_npy_records(data, bundle_dir, dset_name, buffer_size)
+        return
+    if isinstance(data, h5sparse.Dataset):
+        data = data[()]
+    if sp.issparse(data):
+        sp.save_npz(str(get_bundle_file_path(bundle_dir, dset_name, '.npz')), data,
+                    compressed=False)
+        return
+    if not isinstance(data, (np.ndarray, h5py.Dataset)):
+        data = np.asanyarray(data)
+    if data.dtype.hasobject:
+        raise ValueError("The object data {} can't be written in a bundle directory without "
+                         "pickling.".format(dset_name))
+    if len(data.shape) == 0:
+        np.save(str(get_bundle_file_path(bundle_dir, dset_name, '.npy')), data[()])
+        return
+    memmap = open_npy_memmap(bundle_dir, dset_name, data.shape, data.dtype)
+    batch_size = max(1, buffer_size // max(1, data[:1].nbytes))
+    for batch_start in range(0, data.shape[0], batch_size):
+        batch_end = batch_start + batch_size
+        memmap[batch_start: batch_end] = data[batch_start: batch_end]
+    memmap.flush()
+
+
+def _iter_bundle_files(bundle_dir):
+    for root, _, file_names in os.walk(str(bundle_dir)):
+        for file_name in file_names:
+            for suffix in BUNDLE_FILE_SUFFIXES:
+                if file_name.endswith(suffix):
+                    path = os.path.join(root, file_name)
+                    dset_name = "/" + os.path.relpath(path, str(bundle_dir))[:-len(suffix)]
+                    yield dset_name.replace(os.sep, "/"), path
+
+
+def read_fingerprints(bundle_dir):
+    path = Path(bundle_dir) / FINGERPRINTS_FILE_NAME
+    if not path.exists():
+        return {}
+    with io.open(str(path), encoding='utf-8') as fp:
+        return json.load(fp)
+
+
+def write_fingerprints(bundle_dir, fingerprints):
+    with io.open(str(Path(bundle_dir) / FINGERPRINTS_FILE_NAME), 'w', encoding='utf-8') as fp:
+        fp.write(six.text_type(json.dumps(fingerprints, sort_keys=True)))
+
+
+def remove_outdated_directory_entries(bundle_dir, entries, fingerprints):
+    """Directory version of ``bundling.remove_outdated_bundle_entries()``.
+
+    The fingerprints of the written datasets are recorded in ``fingerprints.json``.
+    """
+    bundle_dir = Path(bundle_dir)
+    bundle_dir.mkdir(parents=True, exist_ok=True)
+    old_fingerprints = read_fingerprints(bundle_dir)
+    existing_dset_names = set()
+    for dset_name, path in list(_iter_bundle_files(bundle_dir)):
+        fingerprint = fingerprints.get(dset_name)
+        if fingerprint is not None and old_fingerprints.get(dset_name) == fingerprint:
+            existing_dset_names.add(dset_name)
+        else:
+            os.remove(path)
+    write_fingerprints(bundle_dir, {dset_name: old_fingerprints[dset_name]
+                                    for dset_name in existing_dset_names})
+    return [entry for entry in entries if entry.dset_name not in existing_dset_names]
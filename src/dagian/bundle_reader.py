@@ -0,0 +1,206 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import h5py
+import h5sparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import six
+
+from .data_handlers import TARGET_CHUNK_BYTES, get_row_chunks
+from .data_wrappers import get_h5py_dataset_memmap
+from .utils.prefetch import iter_prefetched
+
+
+def _is_pandas_group(obj):
+    return isinstance(obj, h5py.Group) and 'pandas_type' in obj.attrs
+
+
+def _is_sparse_group(obj):
+    return isinstance(obj, h5py.Group) and 'h5sparse_format' in obj.attrs
+
+
+def _concat_rows(parts):
+    if len(parts) == 1:
+        return parts[0]
+    if sp.issparse(parts[0]):
+        return sp.vstack(parts, format='csr')
+    return np.concatenate(parts)
+
+
+class BundleReader(object):
+    """Read the bundle written by ``DataBundlerMixin.bundle()``.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+        The path of the bundle file.
+    mmap : bool
+        If True, ``get()`` returns a read-only ``numpy.memmap`` for the contiguous and
+        uncompressed dense datasets, so the processes reading the same bundle share the page
+        cache.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = str(path)
+        self.mmap = mmap
+        self._h5f = h5sparse.File(self.path, 'r')
+
+    def close(self):
+        self._h5f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _get_structure(self, group):
+        structure = {}
+        for name in group:
+            obj = group[name]
+            if _is_pandas_group(obj):
+                structure[name] = None
+            elif _is_sparse_group(obj):
+                structure[name] = tuple(obj.attrs['h5sparse_shape'])
+            elif isinstance(obj, h5py.Group):
+                structure[name] = self._get_structure(obj)
+            else:
+                structure[name] = obj.shape
+        return structure
+
+    @property
+    def structure(self):
+        """The nested dictionary of the dataset shapes (None for the DataFrames)."""
+        return self._get_structure(self._h5f)
+
+    def get(self, dset_name):
+        """Get a dataset in the bundle.
+
+        Returns
+        -------
+        data : Union[numpy.memmap, h5py.Dataset, h5sparse.Dataset, pandas.DataFrame]
+            The DataFrames are loaded into memory, and the other datasets are read lazily.
+        """
+        dataset = self._h5f[dset_name]
+        if _is_pandas_group(dataset):
+            return pd.read_hdf(self.path, dset_name)
+        if self.mmap:
+            memmap = get_h5py_dataset_memmap(dataset)
+            if memmap is not None:
+                return memmap
+        return dataset
+
+    def __getitem__(self, dset_name):
+        return self.get(dset_name)
+
+    def _get_block_rows(self, datasets):
+        """Get the number of rows read at once, which covers whole chunks of the datasets."""
+        block_rows = 1
+        for dataset in datasets:
+            if isinstance(dataset, h5sparse.Dataset):
+                chunks = dataset.h5py_group['indptr'].chunks
+                if chunks is None:
+                    # the average number of the stored values in a row
+                    nnz = dataset.h5py_group['data'].shape[0]
+                    row_nnz = max(1, -(-nnz // max(1, dataset.shape[0])))
+                    chunks = get_row_chunks((dataset.shape[0], row_nnz), dataset.dtype,
+                                            TARGET_CHUNK_BYTES)
+            elif isinstance(dataset, h5py.Dataset) and dataset.chunks is not None:
+                chunks = dataset.chunks
+            else:
+                chunks = get_row_chunks(dataset.shape, dataset.dtype, TARGET_CHUNK_BYTES)
+            if chunks is not None:
+                block_rows = max(block_rows, chunks[0])
+        return block_rows
+
+    @staticmethod
+    def _read_buffer(datasets, block_ranges, permutation):
+        buffer = []
+        for dataset in datasets:
+            rows = _concat_rows([dataset[block_start: block_end]
+                                 for block_start, block_end in block_ranges])
+            if permutation is not None:
+                rows = rows[permutation]
+            elif isinstance(rows, np.memmap):
+                rows = np.array(rows)
+            buffer.append(rows)
+        return buffer
+
+    def iter_batches(self, dset_names, batch_size, shuffle=False, shuffle_buffer_size=None,
+                     random_state=None, drop_last=False, prefetch=2):
+        """Iterate over the minibatches of the rows in some datasets.
+
+        The rows are read block by block, where a block covers whole chunks of the datasets.
+        When shuffling, the blocks are permuted, and the rows are shuffled in a buffer of
+        consecutive blocks in the permuted order. A background thread reads and shuffles the
+        next buffers while the batches are consumed.
+
+        Parameters
+        ----------
+        dset_names : Union[str, Sequence[str]]
+            The dense or sparse datasets having the same number of rows.
+        batch_size : int
+        shuffle : bool
+        shuffle_buffer_size : Optional[int]
+            The number of rows shuffled together. Default to 16 blocks.
+        random_state : Optional[Union[int, numpy.random.RandomState]]
+        drop_last : bool
+            Whether to drop the last batch if it is smaller than ``batch_size``.
+        prefetch : int
+            The number of buffers read in advance.
+
+        Yields
+        ------
+        batch : Union[numpy.ndarray, scipy.sparse.csr_matrix, Dict[str, ...]]
+            A dictionary from the dataset names to the rows if ``dset_names`` is a list.
+        """
+        single = isinstance(dset_names, six.string_types)
+        if single:
+            dset_names = [dset_names]
+        datasets = [self.get(dset_name) for dset_name in dset_names]
+        for dataset in datasets:
+            if isinstance(dataset, pd.DataFrame):
+                raise TypeError("DataFrame is not supported by iter_batches(). Use get() "
+                                "instead.")
+        n_rows = datasets[0].shape[0]
+        for dset_name, dataset in zip(dset_names, datasets):
+            if dataset.shape[0] != n_rows:
+                raise ValueError("different number of rows: {} and {} in {}."
+                                 .format(n_rows, dataset.shape[0], dset_name))
+
+        block_rows = self._get_block_rows(datasets)
+        block_ranges = [(block_start, min(n_rows, block_start + block_rows))
+                        for block_start in range(0, n_rows, block_rows)]
+        if shuffle_buffer_size is None:
+            n_buffer_blocks = 16
+        else:
+            n_buffer_blocks = max(1, shuffle_buffer_size // block_rows)
+        if shuffle:
+            if not isinstance(random_state, np.random.RandomState):
+                random_state = np.random.RandomState(random_state)
+            block_ranges = [block_ranges[i] for i in random_state.permutation(len(block_ranges))]
+
+        read_args_list = []
+        for i in range(0, len(block_ranges), n_buffer_blocks):
+            buffer_block_ranges = block_ranges[i: i + n_buffer_blocks]
+            permutation = None
+            if shuffle:
+                permutation = random_state.permutation(
+                    sum(block_end - block_start for block_start, block_end in buffer_block_ranges))
+            read_args_list.append((datasets, buffer_block_ranges, permutation))
+
+        leftover = None
+        for buffer in iter_prefetched(self._read_buffer, read_args_list, 1,
+                                      max_pending=max(1, prefetch)):
+            if leftover is not None:
+                buffer = [_concat_rows([left_rows, rows])
+                          for left_rows, rows in zip(leftover, buffer)]
+            n_buffer_rows = buffer[0].shape[0]
+            n_batch_rows = n_buffer_rows - n_buffer_rows % batch_size
+            for batch_start in range(0, n_batch_rows, batch_size):
+                batch = [rows[batch_start: batch_start + batch_size] for rows in buffer]
+                yield batch[0] if single else dict(zip(dset_names, batch))
+            leftover = [rows[n_batch_rows:] for rows in buffer]
+        if leftover is not None and leftover[0].shape[0] > 0 and not drop_last:
+            yield leftover[0] if single else dict(zip(dset_names, leftover))
@@ -1,16 +1,56 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import Counter, OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import partial
+import hashlib
+import io
+import json
 import os
+import shutil
+from tempfile import mkdtemp
 from past.builtins import basestring
 
 import numpy as np
 import pandas as pd
 import scipy.sparse as sp
 import h5py
+import h5sparse
 import six
 from bistiming import SimpleTimer
-from tqdm import trange
+from tqdm import tqdm
 
+from .bundle_formats import (
+    check_bundle_format,
+    open_npy_memmap,
+    read_fingerprints,
+    remove_outdated_directory_entries,
+    write_directory_bundle_data,
+    write_fingerprints,
+)
 from .data_definition import DataDefinition
+from .data_handlers import TARGET_CHUNK_BYTES, get_row_chunks
+from .data_wrappers import ArrowDataset, PandasHDFDataset
+from .utils.prefetch import iter_prefetched
+
+
+# the attribute storing the fingerprint of the source data in each bundled dataset
+FINGERPRINT_ATTR = 'dagian_fingerprint'
+
+
+def is_sparse_data(data):
+    return isinstance(data, (sp.spmatrix, h5sparse.Dataset))
+
+
+def get_sparse_data_nnz(data):
+    if isinstance(data, h5sparse.Dataset):
+        return data.h5py_group['data'].shape[0]
+    return data.nnz
+
+
+def get_concat_dtype(data_list, dtype):
+    if dtype == 'promote':
+        return np.result_type(*[data.dtype for data in data_list])
+    return np.dtype(dtype)
 
 
 def get_data_definitions_from_raw_data_definition(raw_data_def):
@@ -66,116 +106,692 @@ def get_data_definitions_from_structure(structure):
     return data_definitions
 
 
+class BundleEntry(namedtuple('BundleEntry', ['dset_name', 'data_definitions',
+                                             'concat_options', 'row_definitions'])):
+    """A dataset in the bundle.
+
+    ``concat_options`` is the keyword arguments of ``fill_concat_data()`` if the data are
+    concatenated, or None for a single data. ``row_definitions`` is the data definitions of
+    ``(row_selector, row_permutation)`` in the structure config, or None if all the rows are
+    bundled in order.
+    """
+
+
+def _get_data_definition_from_config(raw_data_def):
+    if raw_data_def is None:
+        return None
+    if isinstance(raw_data_def, basestring):
+        return DataDefinition(raw_data_def)
+    return get_data_definitions_from_raw_data_definition(raw_data_def)[0]
+
+
+def get_bundle_entries(structure, structure_config, dset_name="", row_definitions=None):
+    """Get the datasets written by ``DataBundlerMixin.bundle()``.
+
+    The ``row_selector`` and ``row_permutation`` in ``structure_config`` apply to all the
+    datasets under the structure unless they are set again in the config of a child.
+
+    Returns
+    -------
+    entries : List[BundleEntry]
+    """
+    if 'row_selector' in structure_config or 'row_permutation' in structure_config:
+        row_definitions = (
+            _get_data_definition_from_config(structure_config.get('row_selector')),
+            _get_data_definition_from_config(structure_config.get('row_permutation')))
+        if row_definitions == (None, None):
+            row_definitions = None
+    if isinstance(structure, basestring) and dset_name != "":
+        return [BundleEntry(dset_name, (DataDefinition(structure),), None, row_definitions)]
+    if isinstance(structure, list):
+        data_definitions = get_data_definitions_from_list_in_structure(structure)
+        if structure_config.get('concat', False):
+            concat_options = {
+                'sparse': structure_config.get('sparse', False),
+                'dtype': structure_config.get('dtype', 'float32'),
+            }
+            return [BundleEntry(dset_name, tuple(data_definitions), concat_options,
+                                row_definitions)]
+        key_set = set()
+        for data_definition in data_definitions:
+            if data_definition.key in key_set:
+                raise ValueError("Duplicated key {} in a list structure. Use concat mode or "
+                                 "dict structure to distinguish them instead."
+                                 .format(data_definition.key))
+            key_set.add(data_definition.key)
+        return [BundleEntry(dset_name + "/" + data_definition.key, (data_definition,), None,
+                            row_definitions)
+                for data_definition in data_definitions]
+    if isinstance(structure, dict):
+        if 'key' in structure:
+            if 'loop' in structure:
+                raise ValueError("Cannot use 'loop' in a dict structure. Use list structure with "
+                                 "concat mode instead.")
+            data_definition = get_data_definitions_from_raw_data_definition(structure)[0]
+            return [BundleEntry(dset_name, (data_definition,), None, row_definitions)]
+        entries = []
+        for key, val in six.viewitems(structure):
+            entries.extend(get_bundle_entries(
+                val, structure_config.get(key, {}), dset_name=dset_name + "/" + key,
+                row_definitions=row_definitions))
+        return entries
+    raise TypeError("The bundle structure only support "
+                    "dict, list and str (except the first layer).")
+
+
+def get_bundle_data_definitions(structure, structure_config):
+    """Get all the data definitions required by bundling, including the row selectors."""
+    data_definitions = []
+    for entry in get_bundle_entries(structure, structure_config):
+        data_definitions.extend(entry.data_definitions)
+        if entry.row_definitions is not None:
+            data_definitions.extend(data_definition
+                                    for data_definition in entry.row_definitions
+                                    if data_definition is not None)
+    # remove the duplicates and keep the order
+    return list(OrderedDict.fromkeys(data_definitions))
+
+
+def _take_rows_in_block(rows, indices):
+    if isinstance(rows, (pd.DataFrame, pd.Series)):
+        return rows.iloc[indices]
+    return rows[indices]
+
+
+def _concat_rows(parts):
+    if isinstance(parts[0], (pd.DataFrame, pd.Series)):
+        return pd.concat(parts)
+    if isinstance(parts[0], sp.spmatrix):
+        return sp.vstack(parts, format=parts[0].format)
+    return np.concatenate(parts)
+
+
+def take_rows(data, row_indices, max_span):
+    """Read some rows of the data in the given order with bounded memory.
+
+    The rows are read in ascending order by slices covering at most ``max_span`` rows, so
+    the data that only support slicing (e.g., h5py, h5sparse and pandas HDF datasets) are read
+    sequentially, and then the rows are rearranged in memory.
+
+    Parameters
+    ----------
+    data : Union[h5py.Dataset, h5sparse.Dataset, PandasHDFDataset, numpy.ndarray, ...]
+    row_indices : numpy.ndarray
+    max_span : int
+    """
+    row_indices = np.asarray(row_indices, dtype=np.int64)
+    if len(row_indices) == 0:
+        return _take_rows_in_block(data[0: 1], row_indices)
+    order = np.argsort(row_indices, kind='mergesort')
+    sorted_indices = row_indices[order]
+    buckets = (sorted_indices - sorted_indices[0]) // max(1, max_span)
+    run_bounds = np.concatenate([[0], np.flatnonzero(np.diff(buckets)) + 1,
+                                 [len(sorted_indices)]])
+    parts = []
+    for run_start, run_end in zip(run_bounds[:-1], run_bounds[1:]):
+        read_start = int(sorted_indices[run_start])
+        rows = data[read_start: int(sorted_indices[run_end - 1]) + 1]
+        parts.append(_take_rows_in_block(rows, sorted_indices[run_start: run_end] - read_start))
+    rows = _concat_rows(parts)
+    if (np.diff(order) == 1).all():
+        return rows
+    inverse_order = np.empty_like(order)
+    inverse_order[order] = np.arange(len(order))
+    return _take_rows_in_block(rows, inverse_order)
+
+
+def get_row_read_order(row_indices):
+    """Get the order reading the rows in ascending order, or None if they are already sorted.
+
+    The ``i``-th smallest row index is at ``row_indices[order[i]]``.
+    """
+    if row_indices is None or (np.diff(row_indices) >= 0).all():
+        return None
+    return np.argsort(row_indices, kind='mergesort')
+
+
+def take_csr_rows(data, indices, indptr, rows, n_cols):
+    """Take some rows of a CSR matrix stored as separate (e.g., memory-mapped) arrays."""
+    starts = indptr[rows]
+    lengths = indptr[np.asarray(rows) + 1] - starts
+    block_indptr = np.concatenate([[0], np.cumsum(lengths)])
+    positions = np.repeat(starts - block_indptr[:-1], lengths) + np.arange(block_indptr[-1])
+    return sp.csr_matrix((data[positions], indices[positions], block_indptr),
+                         shape=(len(rows), n_cols))
+
+
+@contextmanager
+def temporary_bundle_dir(data_bundle_hdf_path):
+    """Create a temporary directory next to the bundle."""
+    temp_dir = mkdtemp(prefix=".dagian_",
+                       dir=os.path.dirname(os.path.abspath(data_bundle_hdf_path)))
+    try:
+        yield temp_dir
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def get_row_nbytes(data):
+    """Estimate the number of bytes of a row of the data."""
+    shape = tuple(getattr(data, 'shape', (1,)))
+    if len(shape) == 0:
+        return 1
+    if is_sparse_data(data):
+        return max(1, int(get_sparse_data_nnz(data) / max(1, shape[0])
+                          * (data.dtype.itemsize + 4)))
+    itemsize = data.dtype.itemsize if hasattr(data, 'dtype') else 8
+    return max(1, itemsize * int(np.prod(shape[1:])))
+
+
+def _load_1d_array(data):
+    if isinstance(data, (h5py.Dataset, PandasHDFDataset, ArrowDataset)):
+        data = data[()]
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        data = data.values
+    return np.asarray(data).reshape(-1)
+
+
+def _remove_stale_bundle_objects(group, dset_names):
+    for name in list(group):
+        path = group[name].name
+        if path in dset_names:
+            continue
+        if (isinstance(group[name], h5py.Group)
+                and any(dset_name.startswith(path + "/") for dset_name in dset_names)):
+            _remove_stale_bundle_objects(group[name], dset_names)
+        else:
+            del group[name]
+
+
+def remove_outdated_bundle_entries(data_bundle_hdf_path, entries, fingerprints):
+    """Remove the datasets that need to be rewritten from an existing bundle file.
+
+    Parameters
+    ----------
+    entries : List[BundleEntry]
+    fingerprints : Dict[str, Optional[str]]
+        The current fingerprints of the entries.
+
+    Returns
+    -------
+    outdated_entries : List[BundleEntry]
+        The entries that need to be written.
+    """
+    if not os.path.isfile(data_bundle_hdf_path):
+        return list(entries)
+    outdated_entries = []
+    with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+        for entry in entries:
+            fingerprint = fingerprints[entry.dset_name]
+            obj = h5f.get(entry.dset_name)
+            if obj is None:
+                outdated_entries.append(entry)
+                continue
+            if fingerprint is not None and obj.attrs.get(FINGERPRINT_ATTR) == fingerprint:
+                continue
+            del h5f[entry.dset_name]
+            outdated_entries.append(entry)
+        _remove_stale_bundle_objects(h5f, set(entry.dset_name for entry in entries))
+    return outdated_entries
+
+
 class DataBundlerMixin(object):
 
-    def fill_concat_data(self, data_bundle_hdf_path, dset_name, data_definitions,
-                         buffer_size=int(1e+9)):
+    @staticmethod
+    def _read_rows(data, batch_start, batch_end, row_indices, max_span):
+        if row_indices is None:
+            return data[batch_start: batch_end]
+        return take_rows(data, row_indices[batch_start: batch_end], max_span)
+
+    def _read_concat_batch(self, data, batch_start, batch_end, row_indices=None, max_span=1):
+        data_buffer = self._read_rows(data, batch_start, batch_end, row_indices, max_span)
+        if isinstance(data_buffer, (pd.DataFrame, pd.Series)):
+            data_buffer = data_buffer.values
+        elif isinstance(data_buffer, sp.spmatrix):
+            data_buffer = data_buffer.toarray()
+        if len(data_buffer.shape) == 1:
+            data_buffer = data_buffer[:, np.newaxis]
+        return data_buffer
+
+    def _read_concat_block(self, data_list, col_ranges, block_shape, dtype, row_indices,
+                           max_span, block_start, block_end):
+        block = np.empty((block_end - block_start,) + block_shape, dtype=dtype)
+        for data, (col_start, col_end) in zip(data_list, col_ranges):
+            block[..., col_start: col_end] = self._read_concat_batch(
+                data, block_start, block_end, row_indices, max_span)
+        return block
+
+    def _read_sparse_concat_block(self, data_list, dtype, row_indices, max_span,
+                                  block_start, block_end):
+        batches = []
+        for data in data_list:
+            batch = self._read_rows(data, block_start, block_end, row_indices, max_span)
+            if isinstance(batch, (pd.DataFrame, pd.Series)):
+                batch = batch.values
+            if not isinstance(batch, sp.spmatrix):
+                if len(batch.shape) == 1:
+                    batch = batch[:, np.newaxis]
+                batch = sp.csr_matrix(batch)
+            batches.append(batch)
+        return sp.hstack(batches, format='csr', dtype=dtype)
+
+    def _get_concat_inputs(self, data_definitions):
+        data_list = []
         data_shapes = []
         for data_definition in data_definitions:
-            data_shape = self.get(data_definition).shape
+            # the reader threads of other entries may be using the same handler
+            with self.get_handler(data_definition.key).io_lock:
+                data = self.get(data_definition)
+                data_shape = tuple(data.shape)
             if len(data_shape) == 1:
                 data_shape += (1,)
+            data_list.append(data)
             data_shapes.append(data_shape)
-        max_shape_length = max(map(len, data_shapes))
-        if max_shape_length > 2:
-            raise NotImplementedError("tensor data is not supported yet")
 
-        n_rows = data_shapes[0][0]
         for data_shape in data_shapes:
-            if data_shape[0] != n_rows:
+            if data_shape[0] != data_shapes[0][0]:
                 raise ValueError("different number of instances: {} and {}."
                                  .format(data_shapes[0], data_shape))
-        n_cols = sum(shape[1] for shape in data_shapes)
-        concat_shape = (n_rows, n_cols)
+            if data_shape[:-1] != data_shapes[0][:-1]:
+                raise ValueError("the shapes should be the same except the last axis: {} and "
+                                 "{}.".format(data_shapes[0], data_shape))
+        return data_list, data_shapes
+
+    @staticmethod
+    def _get_block_size(row_bytes, buffer_size, n_readers):
+        # the blocks being read, waiting in the queue, and being written
+        n_buffers = 1 if n_readers <= 0 else 2 * n_readers + 2
+        block_size = buffer_size // n_buffers // max(1, row_bytes)
+        if block_size == 0:
+            print("Warning! buffer_size not enough to fitted by an "
+                  "instance. Trying to use more memory.")
+            block_size = 1
+        return block_size
+
+    def _write_blocks(self, dset_name, read_block, block_size, n_rows, n_readers, write_block):
+        block_ranges = [(block_start, min(n_rows, block_start + block_size))
+                        for block_start in range(0, n_rows, block_size)]
+        blocks = iter_prefetched(read_block, block_ranges, n_readers)
+        for (block_start, block_end), block in tqdm(
+                six.moves.zip(block_ranges, blocks), total=len(block_ranges),
+                desc="Filling {}".format(dset_name)):
+            write_block(block_start, block_end, block)
+
+    def _fill_memmap(self, memmap, dset_name, read_block, block_size, n_readers, order):
+        """Write the blocks into a memmap, scattering the rows if they are read in ``order``."""
+        def write_block(block_start, block_end, block):
+            if order is None:
+                memmap[block_start: block_end] = block
+            else:
+                memmap[order[block_start: block_end]] = block
+
+        self._write_blocks(dset_name, read_block, block_size, len(memmap), n_readers,
+                           write_block)
+
+    def fill_concat_data(self, data_bundle_hdf_path, dset_name, data_definitions,
+                         buffer_size=int(1e+9), n_readers=0, sparse=False, dtype='float32',
+                         bundle_format='hdf5', row_indices=None):
+        """Concatenate the data along the last axis into a dataset.
+
+        The 1-d data are treated as a single column, and the other axes of the data should
+        have the same size. The dataset is filled block by block. Each block contains whole
+        rows and a multiple of the rows in a chunk of the dataset, so it is written
+        sequentially at once.
+
+        Parameters
+        ----------
+        buffer_size : int
+            The maximum number of bytes read at once. It is shared by all the blocks being
+            read or waiting to be written.
+        n_readers : int
+            If positive, the blocks are read and converted in this number of threads while
+            the current thread writes the previous blocks, and at most ``2 * n_readers``
+            blocks wait to be written.
+        sparse : Union[bool, str]
+            If True, write a CSR matrix with h5sparse instead of a dense dataset. The blocks
+            are stacked as sparse matrices and appended, so the dense matrix is never built.
+            If ``'auto'``, write a CSR matrix only if any of the data is sparse.
+        dtype : Union[str, numpy.dtype]
+            The type of the dataset. If ``'promote'``, use the smallest type that all the data
+            can be safely cast to, e.g., ``int64`` for ``bool`` and ``int64``.
+        bundle_format : str
+            If not ``'hdf5'``, ``data_bundle_hdf_path`` is a bundle directory, and the dense
+            data are written into a ``.npy`` file through a memmap. See ``bundle_formats``.
+        row_indices : Optional[numpy.ndarray]
+            If not None, only these rows are written in this order. The rows are read in
+            ascending order block by block (see ``take_rows()``). If they are not sorted, the
+            rows are scattered into a temporary file next to the bundle, which is then
+            written in order, so each row is read once.
+        """
+        data_list, data_shapes = self._get_concat_inputs(data_definitions)
+        n_rows = data_shapes[0][0]
+        if row_indices is not None:
+            if len(row_indices) > 0 and (np.min(row_indices) < 0
+                                         or np.max(row_indices) >= n_rows):
+                raise IndexError("row_indices out of range [0, {}).".format(n_rows))
+            n_rows = len(row_indices)
+        dtype = get_concat_dtype(data_list, dtype)
+        if sparse == 'auto':
+            sparse = any(is_sparse_data(data) for data in data_list)
+        if sparse:
+            if len(data_shapes[0]) > 2:
+                raise ValueError("the sparse concatenation only supports 2-d data, but got {}."
+                                 .format(data_shapes[0]))
+            self._fill_sparse_concat_data(data_bundle_hdf_path, dset_name, data_list,
+                                          data_shapes, dtype, buffer_size, n_readers,
+                                          bundle_format, row_indices)
+            return
+
+        col_ranges = []
+        n_cols = 0
+        for data_shape in data_shapes:
+            col_ranges.append((n_cols, n_cols + data_shape[-1]))
+            n_cols += data_shape[-1]
+        block_shape = data_shapes[0][1:-1] + (n_cols,)
+        concat_shape = (n_rows,) + block_shape
+
+        # a block and the batch of the data being converted into it
+        n_row_cells = int(np.prod(data_shapes[0][1:-1]))
+        row_bytes = n_row_cells * sum(
+            max(data.dtype.itemsize, dtype.itemsize) * data_shape[-1]
+            for data, data_shape in zip(data_list, data_shapes))
+        block_size = self._get_block_size(row_bytes, buffer_size, n_readers)
+        chunks = get_row_chunks(
+            concat_shape, dtype,
+            min(TARGET_CHUNK_BYTES, block_size * n_row_cells * n_cols * dtype.itemsize))
+        if chunks is not None:
+            block_size -= block_size % chunks[0]
+
+        # the permuted rows are read in ascending order and scattered into a memmap
+        order = get_row_read_order(row_indices)
+        read_block = partial(self._read_concat_block, data_list, col_ranges, block_shape, dtype,
+                             row_indices if order is None else row_indices[order], block_size)
+        if bundle_format != 'hdf5':
+            memmap = open_npy_memmap(data_bundle_hdf_path, dset_name, concat_shape, dtype)
+            self._fill_memmap(memmap, dset_name, read_block, block_size, n_readers, order)
+            memmap.flush()
+            return
+
+        with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+            dset = h5f.create_dataset(dset_name, shape=concat_shape, dtype=dtype, chunks=chunks)
+
+            def write_block(block_start, block_end, block):
+                dset[block_start: block_end] = block
+
+            if order is None:
+                self._write_blocks(dset_name, read_block, block_size, n_rows, n_readers,
+                                   write_block)
+                return
+            with temporary_bundle_dir(data_bundle_hdf_path) as temp_dir:
+                memmap = np.lib.format.open_memmap(os.path.join(temp_dir, 'rows.npy'),
+                                                   mode='w+', dtype=dtype, shape=concat_shape)
+                self._fill_memmap(memmap, dset_name, read_block, block_size, n_readers, order)
+                self._write_blocks(dset_name, lambda block_start, block_end:
+                                   memmap[block_start: block_end],
+                                   block_size, n_rows, 0, write_block)
+
+    def _fill_sparse_concat_data(self, data_bundle_hdf_path, dset_name, data_list, data_shapes,
+                                 dtype, buffer_size, n_readers, bundle_format, row_indices):
+        n_rows = data_shapes[0][0] if row_indices is None else len(row_indices)
+        n_cols = sum(data_shape[1] for data_shape in data_shapes)
+        # the nonzero values with their indices in a batch and in the stacked block
+        row_bytes = 0
+        for data, data_shape in zip(data_list, data_shapes):
+            itemsize = max(data.dtype.itemsize, dtype.itemsize)
+            if is_sparse_data(data):
+                nnz_per_row = get_sparse_data_nnz(data) / max(1, data_shape[0])
+                row_bytes += 2 * nnz_per_row * (itemsize + 4)
+            else:
+                row_bytes += data_shape[1] * (itemsize + 8)
+        block_size = self._get_block_size(int(np.ceil(row_bytes)), buffer_size, n_readers)
+
+        order = get_row_read_order(row_indices)
+        if order is None:
+            read_block = partial(self._read_sparse_concat_block, data_list, dtype, row_indices,
+                                 block_size)
+            self._write_sparse_blocks(data_bundle_hdf_path, dset_name, read_block, block_size,
+                                      n_rows, n_cols, dtype, n_readers, bundle_format)
+            return
 
-        h5f = h5py.File(data_bundle_hdf_path, 'a')
-        dset = h5f.create_dataset(dset_name, shape=concat_shape,
-                                  dtype=np.float32)
+        # read the rows in ascending order into a temporary CSR matrix, and then write its rows
+        # in the order of row_indices
+        read_block = partial(self._read_sparse_concat_block, data_list, dtype,
+                             row_indices[order], block_size)
+        inverse_order = np.empty_like(order)
+        inverse_order[order] = np.arange(len(order))
+        with temporary_bundle_dir(data_bundle_hdf_path) as temp_dir:
+            data_path = os.path.join(temp_dir, 'data')
+            indices_path = os.path.join(temp_dir, 'indices')
+            indptr_parts = [np.zeros(1, dtype=np.int64)]
+            with io.open(data_path, 'wb') as data_fp, io.open(indices_path, 'wb') as indices_fp:
+                def write_sorted_block(block_start, block_end, block):
+                    block.data.astype(dtype, copy=False).tofile(data_fp)
+                    block.indices.astype(np.int64).tofile(indices_fp)
+                    indptr_parts.append(block.indptr[1:] + indptr_parts[-1][-1])
 
-        data_d = 0
-        for data_i, (data_definition, data_shape) in enumerate(zip(data_definitions, data_shapes)):
+                self._write_blocks(dset_name, read_block, block_size, n_rows, n_readers,
+                                   write_sorted_block)
+            indptr = np.concatenate(indptr_parts)
+            if indptr[-1] > 0:
+                data = np.memmap(data_path, dtype=dtype, mode='r')
+                indices = np.memmap(indices_path, dtype=np.int64, mode='r')
+            else:
+                data = np.empty(0, dtype=dtype)
+                indices = np.empty(0, dtype=np.int64)
+
+            def read_permuted_block(block_start, block_end):
+                return take_csr_rows(data, indices, indptr,
+                                     inverse_order[block_start: block_end], n_cols)
+
+            self._write_sparse_blocks(data_bundle_hdf_path, dset_name, read_permuted_block,
+                                      block_size, n_rows, n_cols, dtype, 0, bundle_format)
+
+    def _write_sparse_blocks(self, data_bundle_hdf_path, dset_name, read_block, block_size,
+                             n_rows, n_cols, dtype, n_readers, bundle_format):
+        if bundle_format != 'hdf5':
+            # the sparse blocks are stacked in memory, since .npz can't be appended
+            blocks = [sp.csr_matrix((0, n_cols), dtype=dtype)]
+            self._write_blocks(dset_name, read_block, block_size, n_rows, n_readers,
+                               lambda block_start, block_end, block: blocks.append(block))
+            write_directory_bundle_data(sp.vstack(blocks, format='csr'), data_bundle_hdf_path,
+                                        dset_name, bundle_format)
+            return
+
+        with h5sparse.File(data_bundle_hdf_path, 'a') as h5f:
+            dset = h5f.create_dataset(
+                dset_name, data=sp.csr_matrix((0, n_cols), dtype=dtype),
+                chunks=True, maxshape=(None,))
+
+            def write_block(block_start, block_end, block):
+                dset.append(block)
+
+            self._write_blocks(dset_name, read_block, block_size, n_rows, n_readers,
+                               write_block)
+
+    def _get_bundle_entry_fingerprint(self, entry, bundle_format='hdf5'):
+        """Get the hash of the data versions and options of a bundle entry.
+
+        Returns None if the version of some data is unknown, so the entry is always rewritten.
+        The directory formats are also hashed because they share the bundle directory.
+        """
+        row_definitions = entry.row_definitions or ()
+        versions = []
+        for data_definition in entry.data_definitions + row_definitions:
+            if data_definition is None:
+                versions.append(None)
+                continue
+            data_definition = self.check_data_definition(data_definition)
+            version = self.get_handler(data_definition.key).get_version(data_definition)
+            if version is None:
+                return None
+            versions.append([data_definition.to_json(), version])
+        fingerprint_items = [versions, entry.concat_options, len(row_definitions)]
+        if bundle_format != 'hdf5':
+            fingerprint_items.append(bundle_format)
+        fingerprint_json = json.dumps(fingerprint_items, sort_keys=True, default=str)
+        return hashlib.sha1(fingerprint_json.encode('utf-8')).hexdigest()
+
+    def get_bundle_row_indices(self, row_definitions):
+        """Get the rows selected by the ``(row_selector, row_permutation)`` data.
+
+        The row selector is a boolean mask or integer indices of the rows, and the selected
+        rows are in ascending order. The row permutation is the order of the selected rows (or
+        all the rows if there is no row selector) in the bundle.
+
+        Returns
+        -------
+        row_indices : numpy.ndarray
+        """
+        selector_definition, permutation_definition = row_definitions
+        row_indices = None
+        if selector_definition is not None:
+            row_selector = _load_1d_array(self.get(selector_definition))
+            if row_selector.dtype.kind == 'b':
+                row_indices = np.flatnonzero(row_selector)
+            else:
+                row_indices = np.unique(row_selector.astype(np.int64))
+        if permutation_definition is not None:
+            permutation = _load_1d_array(self.get(permutation_definition)).astype(np.int64)
+            if row_indices is None:
+                row_indices = permutation
+            else:
+                if len(permutation) != len(row_indices):
+                    raise ValueError("row_permutation {} has {} rows, but {} rows are selected."
+                                     .format(permutation_definition, len(permutation),
+                                             len(row_indices)))
+                row_indices = row_indices[permutation]
+        return row_indices
+
+    def _load_bundle_entry(self, entry, row_indices=None, buffer_size=int(1e+9),
+                           bundle_format='hdf5'):
+        if entry.concat_options is not None:
+            # the concatenated data are read block by block when writing
+            return None
+        data_definition = entry.data_definitions[0]
+        handler = self.get_handler(data_definition.key)
+        # only opening the file needs the lock, the datasets are thread-safe
+        with handler.io_lock:
             data = self.get(data_definition)
-            if isinstance(data, (pd.DataFrame, pd.Series)):
-                data = data.values
-            batch_size = buffer_size // (data.dtype.itemsize * data_shape[1])
-            if batch_size == 0:
-                print("Warning! buffer_size not enough to fitted by an "
-                      "instance. Trying to use more memory.")
-                batch_size = 1
-            desc = "({}/{}) Filling {}".format(data_i + 1, len(data_definitions), data_definition)
-            for batch_start in trange(0, data_shape[0], batch_size, desc=desc):
-                batch_end = min(data_shape[0], batch_start + batch_size)
-                data_buffer = data[batch_start: batch_end]
-                if isinstance(data_buffer, sp.spmatrix):
-                    data_buffer = data_buffer.toarray()
-                elif len(data_buffer.shape) == 1:
-                    data_buffer = data_buffer[:, np.newaxis]
-                dset[batch_start: batch_end,
-                     data_d: data_d + data_shape[1]] = data_buffer
-
-            data_d += data_shape[1]
-
-        h5f.close()
-
-    def _bundle_list_in_structure(
-            self, structure, data_bundle_hdf_path, buffer_size, structure_config, dset_name):
-        data_definitions = get_data_definitions_from_list_in_structure(structure)
-        if structure_config.get('concat', False):
+        if row_indices is not None:
+            return take_rows(data, row_indices, buffer_size // get_row_nbytes(data))
+        if bundle_format == 'hdf5' or is_sparse_data(data):
+            return handler.prepare_bundle_data(data)
+        # the directory formats read the dense data and the tables batch by batch
+        return data
+
+    def _write_bundle_entry(self, entry, data, data_bundle_hdf_path, buffer_size, n_readers,
+                            bundle_format='hdf5', row_indices=None):
+        if entry.concat_options is not None:
             # write into single dataset
-            self.fill_concat_data(data_bundle_hdf_path, dset_name, data_definitions, buffer_size)
+            self.fill_concat_data(data_bundle_hdf_path, entry.dset_name, entry.data_definitions,
+                                  buffer_size, n_readers=n_readers, bundle_format=bundle_format,
+                                  row_indices=row_indices, **entry.concat_options)
+            return
+        if bundle_format == 'hdf5':
+            handler = self.get_handler(entry.data_definitions[0].key)
+            handler.write_bundle_data(data, data_bundle_hdf_path, entry.dset_name)
         else:
-            key_set = set()
-            for data_definition in data_definitions:
-                if data_definition.key in key_set:
-                    raise ValueError("Duplicated key {} in a list structure. Use concat mode or "
-                                     "dict structure to distinguish them instead."
-                                     .format(data_definition.key))
-                key_set.add(data_definition.key)
-                data = self.get(data_definition)
-                self.get_handler(data_definition.key).bundle(
-                    data, data_bundle_hdf_path, dset_name + "/" + data_definition.key)
+            write_directory_bundle_data(data, data_bundle_hdf_path, entry.dset_name,
+                                        bundle_format, buffer_size)
 
-    def _bundle_dict_in_structure(
-            self, structure, data_bundle_hdf_path, buffer_size, structure_config, dset_name):
-        if 'key' in structure:
-            if 'loop' in structure:
-                raise ValueError("Cannot use 'loop' in a dict structure. Use list structure with "
-                                 "concat mode instead.")
-            data_definition = get_data_definitions_from_raw_data_definition(structure)[0]
-            data = self.get(data_definition)
-            self.get_handler(data_definition.key).bundle(
-                data, data_bundle_hdf_path, dset_name)
-        else:
-            for key, val in six.viewitems(structure):
-                self._bundle(
-                    val, data_bundle_hdf_path, buffer_size,
-                    structure_config=structure_config.get(key, {}),
-                    dset_name=dset_name + "/" + key)
-
-    def _bundle(
-            self, structure, data_bundle_hdf_path, buffer_size, structure_config, dset_name=""):
-        if isinstance(structure, basestring) and dset_name != "":
-            data = self.get(DataDefinition(structure))
-            self.get_handler(structure).bundle(
-                data, data_bundle_hdf_path, dset_name)
-        elif isinstance(structure, list):
-            self._bundle_list_in_structure(
-                structure, data_bundle_hdf_path, buffer_size, structure_config, dset_name)
-        elif isinstance(structure, dict):
-            self._bundle_dict_in_structure(
-                structure, data_bundle_hdf_path, buffer_size, structure_config, dset_name)
+    def _close_bundled_data(self, data_definition, n_remaining_entries):
+        data_definition = self.check_data_definition(data_definition)
+        n_remaining_entries[data_definition] -= 1
+        if n_remaining_entries[data_definition] > 0:
+            return
+        # don't keep a file open for each bundled data
+        handler = self.get_handler(data_definition.key)
+        with handler.io_lock:
+            handler.close_data(data_definition)
+
+    def _record_fingerprint(self, data_bundle_hdf_path, dset_name, fingerprint, bundle_format):
+        if bundle_format == 'hdf5':
+            with h5py.File(data_bundle_hdf_path, 'a') as h5f:
+                h5f[dset_name].attrs[FINGERPRINT_ATTR] = fingerprint
         else:
-            raise TypeError("The bundle structure only support "
-                            "dict, list and str (except the first layer).")
+            fingerprints = read_fingerprints(data_bundle_hdf_path)
+            fingerprints[dset_name] = fingerprint
+            write_fingerprints(data_bundle_hdf_path, fingerprints)
 
     def bundle(self, structure, data_bundle_hdf_path, buffer_size=int(1e+9),
-               structure_config=None):
+               structure_config=None, n_readers=0, incremental=True, bundle_format='hdf5'):
+        """Bundle the data into an HDF5 file.
+
+        Each dataset records the fingerprint of its data definitions, the versions of the
+        stored data (e.g., the modification time of the files) and the concat options. When
+        the bundle file exists, only the datasets whose fingerprints changed are rewritten, and
+        the datasets not in the structure are removed. The data whose versions are unknown
+        (e.g., in memory) are always rewritten. HDF5 doesn't reuse the space of the removed
+        datasets, so use ``h5repack`` or ``incremental=False`` to shrink the file.
+
+        Parameters
+        ----------
+        n_readers : int
+            The number of threads loading the data while the current thread writes the
+            bundle. The data of the next datasets are loaded while writing a dataset, and the
+            blocks of the concatenated datasets are read in parallel (see
+            ``fill_concat_data()``). At most ``2 * n_readers`` loaded datasets wait to be
+            written.
+        incremental : bool
+            If False, remove the existing bundle and rewrite all the datasets.
+        structure_config : Optional[dict]
+            The options of the datasets in the same nested structure as ``structure``. For a
+            list, ``concat``, ``sparse`` and ``dtype`` control the concatenation (see
+            ``fill_concat_data()``). ``row_selector`` and ``row_permutation`` are data keys
+            (or data definitions) that select and reorder the rows of all the datasets under
+            the structure (see ``get_bundle_row_indices()``), e.g., to write a bundle per
+            train/test split. The selected rows are read in ascending order block by block.
+        bundle_format : str
+            ``'hdf5'``, or ``'npy'`` or ``'arrow'`` to write the datasets as files in the
+            directory ``data_bundle_hdf_path`` (see ``bundle_formats``).
+        """
+        check_bundle_format(bundle_format)
         if structure_config is None:
             structure_config = {}
 
         data_bundle_hdf_path = str(data_bundle_hdf_path)
-        if os.path.isfile(data_bundle_hdf_path):
-            os.remove(data_bundle_hdf_path)
+        entries = get_bundle_entries(structure, structure_config)
         with SimpleTimer("Bundling data"):
-            self._bundle(structure, data_bundle_hdf_path, buffer_size, structure_config)
+            fingerprints = {entry.dset_name: self._get_bundle_entry_fingerprint(entry,
+                                                                                bundle_format)
+                            for entry in entries}
+            if bundle_format == 'hdf5':
+                if not incremental and os.path.isfile(data_bundle_hdf_path):
+                    os.remove(data_bundle_hdf_path)
+                outdated_entries = remove_outdated_bundle_entries(
+                    data_bundle_hdf_path, entries, fingerprints)
+            else:
+                outdated_entries = remove_outdated_directory_entries(
+                    data_bundle_hdf_path, entries, fingerprints if incremental else {})
+            if len(outdated_entries) < len(entries):
+                print("Reusing {} up-to-date datasets in {}".format(
+                    len(entries) - len(outdated_entries), data_bundle_hdf_path))
+            row_indices_dict = {}
+            for entry in outdated_entries:
+                if (entry.row_definitions is not None
+                        and entry.row_definitions not in row_indices_dict):
+                    row_indices_dict[entry.row_definitions] = self.get_bundle_row_indices(
+                        entry.row_definitions)
+            entry_row_indices = [row_indices_dict.get(entry.row_definitions)
+                                 for entry in outdated_entries]
+            # the reader threads may still be reading the data of the later entries
+            n_remaining_entries = Counter(self.check_data_definition(entry.data_definitions[0])
+                                          for entry in outdated_entries
+                                          if entry.concat_options is None)
+            # the data are loaded in the reader threads, and written in this thread only
+            entry_data = iter_prefetched(
+                self._load_bundle_entry,
+                [(entry, row_indices, buffer_size, bundle_format)
+                 for entry, row_indices in zip(outdated_entries, entry_row_indices)],
+                n_readers)
+            for entry, row_indices, data in six.moves.zip(outdated_entries, entry_row_indices,
+                                                          entry_data):
+                self._write_bundle_entry(entry, data, data_bundle_hdf_path, buffer_size,
+                                         n_readers, bundle_format, row_indices)
+                if entry.concat_options is None:
+                    self._close_bundled_data(entry.data_definitions[0], n_remaining_entries)
+                fingerprint = fingerprints[entry.dset_name]
+                if fingerprint is not None:
+                    self._record_fingerprint(data_bundle_hdf_path, entry.dset_name, fingerprint,
+                                             bundle_format)
         self.close()
@@ -0,0 +1,53 @@
+"""Support of the generator methods defined with ``async def`` (Python 3.5+ only)."""
+import asyncio
+from functools import partial
+import threading
+
+from bistiming import SimpleTimer
+
+
+async def generate_one_async(data_generator, dag, data_definitions, func_name, output_configs):
+    """Coroutine version of ``DataGenerator._generate_one()``.
+
+    The handler I/O is run in the default executor of the event loop, so only the generator
+    method itself is run on the event loop.
+    """
+    # pylint: disable=protected-access
+    loop = asyncio.get_event_loop()
+    function_kwargs = await loop.run_in_executor(None, partial(
+        data_generator._prepare_function_kwargs, dag, data_definitions, output_configs))
+    function = getattr(data_generator, func_name)
+    with SimpleTimer("Generating {} using {}".format(data_definitions, function.__name__),
+                     end_in_new_line=False):
+        result_dict = await function(**function_kwargs)
+    await loop.run_in_executor(None, partial(
+        data_generator._write_result_dict, data_definitions, func_name, output_configs,
+        result_dict, close_all=False))
+
+
+class EventLoopThread(object):
+    """Run an event loop in a background thread."""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="dagian-event-loop")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coroutine):
+        """Schedule a coroutine on the event loop.
+
+        Returns
+        -------
+        future : concurrent.futures.Future
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
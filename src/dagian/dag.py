@@ -38,11 +38,14 @@ class DataGraph(object):
         self._key_output_config_dict = {}
         self._key_node_attrs_dict = {}
 
-    def add_node(self, name, parameters, requirements, output_configs):
+    def add_node(self, name, parameters, requirements, output_configs, resources=None,
+                 is_coroutine=False):
         # pylint: disable=protected-access
         # format better data structure
         parameters = tuple(parameters)
         requirements = tuple(requirements)
+        if resources is None:
+            resources = {}
         output_config_dict = {
             config['key']: {
                 'handler': config['handler'],
@@ -65,6 +68,8 @@ class DataGraph(object):
             'parameters': parameters,
             'requirements': requirements,
             'output_configs': output_config_dict,
+            'resources': dict(resources),
+            'is_coroutine': is_coroutine,
         }
 
         for key in output_config_dict.keys():
@@ -1,21 +1,32 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 import inspect
-from collections import Counter
+from collections import Counter, defaultdict
 from copy import deepcopy
+from functools import partial
 try:
     from inspect import signature
 except ImportError:
     from funcsigs import signature
 
+try:
+    from inspect import iscoroutinefunction
+except ImportError:
+    def iscoroutinefunction(function):  # pylint: disable=unused-argument
+        return False
+
 import six
 import networkx as nx
 from bistiming import SimpleTimer
 
 from .dag import DataGraph, draw_dag
 from .bundling import DataBundlerMixin
+from .scheduling import ConcurrentScheduler, DataReleaser
 from .data_handlers import (
+    ArrowDataHandler,
+    CachedDataHandler,
     MemoryDataHandler,
     H5pyDataHandler,
+    NpyDataHandler,
     PandasHDFDataHandler,
     PickleDataHandler,
 )
@@ -86,11 +97,21 @@ class DataGeneratorType(type):
                 parameters=parameters,
                 requirements=requirements,
                 output_configs=function._dagian_output_configs,
+                resources=getattr(function, '_dagian_resources', None),
+                is_coroutine=iscoroutinefunction(function),
             )
 
         cls._dag = dag
         cls._handler_set = handler_set
 
+    def __call__(cls, *args, **kwargs):
+        # pylint: disable=protected-access
+        data_generator = super(DataGeneratorType, cls).__call__(*args, **kwargs)
+        # keep the constructor arguments so the generator can be rebuilt in other processes
+        data_generator._init_args = args
+        data_generator._init_kwargs = kwargs
+        return data_generator
+
 
 def _run_function(function, data_definitions, kwargs):
     with SimpleTimer("Generating {} using {}"
@@ -185,11 +206,28 @@ class DataGenerator(six.with_metaclass(DataGeneratorType, DataBundlerMixin)):
         data = handler.get(data_definition)
         return data
 
+    def _check_can_skip(self, nx_digraph, generation_order):
+        """Check ``can_skip()`` for all the required data using a bulk query per handler.
+
+        Returns
+        -------
+        can_skip_dict : Dict[DataDefinition, bool]
+        """
+        handler_data_defs = defaultdict(set)
+        for node in generation_order:
+            output_configs = nx_digraph.nodes[node]['output_configs']
+            for edge_attr in six.viewvalues(nx_digraph.succ[node]):
+                for data_def in edge_attr['data_definitions']:
+                    handler_data_defs[output_configs[data_def.key]['handler']].add(data_def)
+        can_skip_dict = {}
+        for handler_name, data_defs in six.viewitems(handler_data_defs):
+            can_skip_dict.update(self._handlers[handler_name].can_skip_many(data_defs))
+        return can_skip_dict
+
     def _dag_prune_can_skip(self, nx_digraph, generation_order):
+        can_skip_dict = self._check_can_skip(nx_digraph, generation_order)
         for node in reversed(generation_order):
             node_attrs = nx_digraph.node[node]
-            key_info_dict = {key: {'handler': self._handlers[config['handler']]}
-                             for key, config in six.viewitems(node_attrs['output_configs'])}
             node_attrs['skipped'] = True
             for target_node, edge_attr in nx_digraph.succ[node].items():
                 if nx_digraph.node[target_node]['skipped']:
@@ -200,10 +238,7 @@ class DataGenerator(six.with_metaclass(DataGeneratorType, DataBundlerMixin)):
                     edge_attr['skipped_data'] = set()
                     edge_attr['nonskipped_data'] = set()
                     for required_data_def in required_data_defs:
-                        key_info = key_info_dict[required_data_def.key]
-                        if 'can_skip' not in key_info:
-                            key_info['can_skip'] = key_info['handler'].can_skip(required_data_def)
-                        if key_info['can_skip']:
+                        if can_skip_dict[required_data_def]:
                             edge_attr['skipped_data'].add(required_data_def)
                         else:
                             edge_attr['nonskipped_data'].add(required_data_def)
@@ -223,15 +258,29 @@ class DataGenerator(six.with_metaclass(DataGeneratorType, DataBundlerMixin)):
         involved_dag, _ = self.build_involved_dag(data_definitions)
         draw_dag(involved_dag, path)
 
-    def _get_upstream_data(self, dag, data_definitions):
+    def _get_upstream_data(self, dag, data_definitions, shipped_data=None):
+        """Get the data required by a node.
+
+        Parameters
+        ----------
+        shipped_data : Optional[Mapping[DataDefinition, object]]
+            The upstream data that has been loaded in another process. It is used instead of
+            getting the data from the handler.
+        """
+        if shipped_data is None:
+            shipped_data = {}
         data = {}
         name_counter = Counter()
         for source_node, edge_attrs in dag.pred[data_definitions].items():
             source_output_configs = dag.nodes[source_node]['output_configs']
             for pred_def in edge_attrs['data_definitions']:
-                source_handler_str = source_output_configs[pred_def.key]['handler']
-                source_handler = self._handlers[source_handler_str]
-                source_data = source_handler.get(pred_def)
+                if pred_def in shipped_data:
+                    source_data = shipped_data[pred_def]
+                else:
+                    source_handler_str = source_output_configs[pred_def.key]['handler']
+                    source_handler = self._handlers[source_handler_str]
+                    with source_handler.io_lock:
+                        source_data = source_handler.get(pred_def)
                 if name_counter[pred_def.name] == 0:
                     data[pred_def.name] = source_data
                 elif name_counter[pred_def.name] == 1:
@@ -241,9 +290,16 @@ class DataGenerator(six.with_metaclass(DataGeneratorType, DataBundlerMixin)):
                 name_counter[pred_def.name] += 1
         return data
 
-    def _generate_one(self, dag, data_definitions, func_name, output_configs):
-        # prepare kwargs for function
-        data = self._get_upstream_data(dag, data_definitions)
+    def _prepare_function_kwargs(self, dag, data_definitions, output_configs,
+                                 shipped_data=None):
+        """Prepare the keyword arguments for the generator method of a node in ``dag``.
+
+        Parameters
+        ----------
+        shipped_data : Optional[Mapping[DataDefinition, object]]
+            See ``_get_upstream_data()``.
+        """
+        data = self._get_upstream_data(dag, data_definitions, shipped_data)
         if data:
             context = {'upstream_data': data}
         else:
@@ -256,12 +312,27 @@ class DataGenerator(six.with_metaclass(DataGeneratorType, DataBundlerMixin)):
         for key, config in six.viewitems(output_configs):
             handler = self._handlers[config['handler']]
             data_definition = data_definitions.replace(key=key)
-            handler.update_context(context, data_definition, **config['handler_kwargs'])
+            with handler.io_lock:
+                handler.update_context(context, data_definition, **config['handler_kwargs'])
+        return function_kwargs
 
-        # run function
-        function = getattr(self, func_name)
-        result_dict = _run_function(function, data_definitions, function_kwargs)
-        self.close()
+    def _write_result_dict(self, data_definitions, func_name, output_configs, result_dict,
+                           close_all=True):
+        """Check and write the return value of the generator method of a node.
+
+        Parameters
+        ----------
+        close_all : bool
+            If True, close all the handlers before writing. Otherwise, only close the resources
+            of the output data, so the nodes generated concurrently are not affected.
+        """
+        if close_all:
+            self.close()
+        else:
+            for key, config in six.viewitems(output_configs):
+                handler = self._handlers[config['handler']]
+                with handler.io_lock:
+                    handler.close_data(data_definitions.replace(key=key))
 
         if result_dict is None:
             result_dict = {}
@@ -277,34 +348,114 @@ class DataGenerator(six.with_metaclass(DataGeneratorType, DataBundlerMixin)):
         # write data
         for key in sorted(expected_keys):
             config = output_configs[key]
+            handler = self._handlers[config['handler']]
             data_definition = data_definitions.replace(key=key)
-            self._handlers[config['handler']].write_data(
-                data_definition, result_dict[key], **config['handler_kwargs'])
+            with handler.io_lock:
+                handler.write_data(data_definition, result_dict[key], **config['handler_kwargs'])
+
+    def _generate_one(self, dag, data_definitions, func_name, output_configs, close_all=True,
+                      shipped_data=None):
+        """Generate the data of a node in ``dag``.
+
+        See ``_prepare_function_kwargs()`` and ``_write_result_dict()`` for the parameters.
+        """
+        function_kwargs = self._prepare_function_kwargs(
+            dag, data_definitions, output_configs, shipped_data)
+        function = getattr(self, func_name)
+        result_dict = _run_function(function, data_definitions, function_kwargs)
+        self._write_result_dict(data_definitions, func_name, output_configs, result_dict,
+                                close_all)
 
-    def generate(self, data_definitions, dag_output_path=None):
+    def generate(self, data_definitions, dag_output_path=None, executor=None, max_workers=None,
+                 resources=None, release_memory=False, pinned=None):
         """
         Parameters
         ----------
         data_definitions: Sequence[DataDefinition]
+        executor: Optional[str]
+            If None, generate the nodes one by one. If ``'thread'``, dispatch every non-skipped
+            node to a thread pool as soon as its predecessors finish. The I/O of the handlers
+            that are not thread-safe (e.g., HDF5) is serialized by their ``io_lock``. If
+            ``'process'``, the nodes are generated in worker processes, which rebuild the
+            generator from its constructor arguments once. The non-persistent handlers in the
+            arguments are replaced by empty ones. The nodes writing to non-persistent
+            handlers (e.g., ``memory``) are pinned to this process, and the non-persistent
+            upstream data are shipped to the workers.
+        max_workers: Optional[int]
+            The maximum number of nodes generated concurrently. If None, it depends on the
+            number of CPUs.
+        resources: Optional[Mapping[str, float]]
+            The budgets of the resources declared by ``will_generate(resources=...)`` when
+            generating concurrently. Among the nodes whose resources fit the budgets, the ones
+            on the longest remaining path to the requested data are started first.
+        release_memory: bool
+            If True, the data of the non-persistent handlers (e.g., ``memory``) generated in
+            this run are released as soon as all the nodes consuming them finish, except the
+            requested data and ``pinned`` (see ``DataReleaser``).
+        pinned: Optional[Sequence[DataDefinition]]
+            The intermediate data kept in memory when ``release_memory`` is True.
+
+        If ``max_workers`` or ``resources`` is given without ``executor``, ``'thread'`` will be
+        used.
+
+        The generator methods defined with ``async def`` are always run concurrently on an
+        event loop, and they are not limited by ``max_workers``. If there are such methods and
+        ``executor`` is None, the other methods are run one by one in a thread.
         """
+        if executor is None and (max_workers is not None or resources is not None):
+            executor = 'thread'
         involved_dag, generation_order = self.build_involved_dag(data_definitions)
+        if executor is None and any(
+                node_attrs['is_coroutine'] and not node_attrs['skipped']
+                for node_attrs in (involved_dag.nodes[node] for node in generation_order)):
+            executor = 'thread'
+            max_workers = 1
         if dag_output_path is not None:
             draw_dag(involved_dag, dag_output_path)
+        data_releaser = DataReleaser(self, involved_dag, generation_order,
+                                     release_memory=release_memory,
+                                     keep=self.check_data_definitions(pinned or ()))
 
         # generate data
-        for data_definitions in generation_order:
-            node_attrs = involved_dag.nodes[data_definitions]
-            if node_attrs['skipped']:
-                continue
-            self._generate_one(
-                involved_dag, data_definitions, node_attrs['func_name'],
-                node_attrs['output_configs'])
-
+        if executor is not None:
+            scheduler = ConcurrentScheduler(
+                self, involved_dag, generation_order, executor=executor,
+                max_workers=max_workers, resources=resources, data_releaser=data_releaser)
+            try:
+                scheduler.run()
+            finally:
+                self.close()
+            return involved_dag
+
+        try:
+            for data_definitions in generation_order:
+                node_attrs = involved_dag.nodes[data_definitions]
+                if node_attrs['skipped']:
+                    continue
+                # the read-only files are kept open for the following nodes
+                self._generate_one(
+                    involved_dag, data_definitions, node_attrs['func_name'],
+                    node_attrs['output_configs'], close_all=False)
+                data_releaser.finish(data_definitions)
+                self.limit_open_files()
+        finally:
+            self.close()
         return involved_dag
 
+    def limit_open_files(self, in_use=()):
+        """Close the least recently used read-only files beyond the limits of the handlers.
+
+        The data returned by ``get()`` should not be in use, except the data definitions in
+        ``in_use``.
+        """
+        for handler in six.viewvalues(self._handlers):
+            with handler.io_lock:
+                handler.limit_open_files(in_use)
+
     def close(self):
         for handler in six.viewvalues(self._handlers):
-            handler.close()
+            with handler.io_lock:
+                handler.close()
 
     @classmethod
     def draw_dag(cls, path, data_definitions):
@@ -315,27 +466,72 @@ class DataGenerator(six.with_metaclass(DataGeneratorType, DataBundlerMixin)):
             print("Warning! The graph is not acyclic!")
 
 
+def add_handler_caches(handlers, cache_bytes):
+    """Wrap the handlers with ``CachedDataHandler``.
+
+    Parameters
+    ----------
+    handlers : Mapping[str, DataHandler]
+    cache_bytes : Union[int, Mapping[str, int]]
+        The cache budget of each handler, or of all the persistent handlers.
+    """
+    handlers = dict(handlers)
+    if isinstance(cache_bytes, six.integer_types + (float,)):
+        cache_bytes = {handler_name: cache_bytes
+                       for handler_name, handler in six.viewitems(handlers)
+                       if handler.persistent}
+    for handler_name, max_bytes in six.viewitems(cache_bytes):
+        if handler_name not in handlers:
+            raise ValueError("cache_bytes has unknown handler {!r}.".format(handler_name))
+        handlers[handler_name] = CachedDataHandler(handlers[handler_name], max_bytes)
+    return handlers
+
+
 class FeatureGenerator(DataGenerator):
 
     def __init__(self, handlers=None, h5py_hdf_dir=None, pandas_hdf_dir=None,
-                 pickle_dir=None):
+                 pickle_dir=None, file_layout='json', h5py_mmap=False, cache_bytes=None,
+                 memory_max_bytes=None, spill_dir=None, npy_dir=None, arrow_dir=None):
+        """
+        Parameters
+        ----------
+        file_layout: str
+            The file layout of the built-in file handlers. ``'json'`` uses the JSON of the data
+            definition as the file name. ``'hashed'`` uses the hash of the data definition in
+            prefix subdirectories and keeps a manifest (see ``dagian.file_layouts``).
+        h5py_mmap: bool
+            Whether the h5py handler returns memory-mapped arrays for the contiguous dense data.
+        cache_bytes: Optional[Union[int, Mapping[str, int]]]
+            The budget of the LRU cache of the loaded data for each handler, or for all the
+            persistent handlers if it is an integer (see ``CachedDataHandler``). The counters
+            of the cache are ``get_handler(key).hits`` and ``get_handler(key).misses``.
+        memory_max_bytes: Optional[int]
+            The memory budget of the memory handler. The least recently used data beyond it
+            are spilled to ``spill_dir`` (see ``MemoryDataHandler``).
+        """
         if handlers is None:
             handlers = {}
+        else:
+            handlers = dict(handlers)
         if 'memory' in self._handler_set and 'memory' not in handlers:
-            handlers['memory'] = MemoryDataHandler()
-        if 'h5py' in self._handler_set and 'h5py' not in handlers:
-            if h5py_hdf_dir is None:
-                raise ValueError("h5py_hdf_dir should be specified "
-                                 "when initiating FeatureGenerator.")
-            handlers['h5py'] = H5pyDataHandler(h5py_hdf_dir)
-        if 'pandas_hdf' in self._handler_set and 'pandas_hdf' not in handlers:
-            if pandas_hdf_dir is None:
-                raise ValueError("pandas_hdf_dir should be specified "
-                                 "when initiating FeatureGenerator.")
-            handlers['pandas_hdf'] = PandasHDFDataHandler(pandas_hdf_dir)
-        if 'pickle' in self._handler_set and 'pickle' not in handlers:
-            if pickle_dir is None:
-                raise ValueError("pickle_dir should be specified "
-                                 "when initiating FeatureGenerator.")
-            handlers['pickle'] = PickleDataHandler(pickle_dir)
+            handlers['memory'] = MemoryDataHandler(max_bytes=memory_max_bytes,
+                                                   spill_dir=spill_dir)
+        # the file handlers built from the directories
+        file_handler_builders = [
+            ('h5py', 'h5py_hdf_dir', h5py_hdf_dir,
+             partial(H5pyDataHandler, layout=file_layout, mmap=h5py_mmap)),
+            ('pandas_hdf', 'pandas_hdf_dir', pandas_hdf_dir,
+             partial(PandasHDFDataHandler, layout=file_layout)),
+            ('pickle', 'pickle_dir', pickle_dir, partial(PickleDataHandler, layout=file_layout)),
+            ('npy', 'npy_dir', npy_dir, partial(NpyDataHandler, layout=file_layout)),
+            ('arrow', 'arrow_dir', arrow_dir, partial(ArrowDataHandler, layout=file_layout)),
+        ]
+        for handler_name, dir_arg_name, directory, build_handler in file_handler_builders:
+            if handler_name in self._handler_set and handler_name not in handlers:
+                if directory is None:
+                    raise ValueError("{} should be specified "
+                                     "when initiating FeatureGenerator.".format(dir_arg_name))
+                handlers[handler_name] = build_handler(directory)
+        if cache_bytes is not None:
+            handlers = add_handler_caches(handlers, cache_bytes)
         super(FeatureGenerator, self).__init__(handlers)
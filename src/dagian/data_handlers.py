@@ -1,10 +1,18 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 from abc import ABCMeta, abstractmethod
 from functools import partial
+import atexit
+import hashlib
+import os
+import shutil
+import struct
+import tempfile
+import threading
 import warnings
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
 
 from bistiming import SimpleTimer
+import h5py
 import h5sparse
 import numpy as np
 import pandas as pd
@@ -14,19 +22,42 @@ from six.moves import cPickle
 from tables import NaturalNameWarning
 from pathlib2 import Path
 
-from .data_wrappers import PandasHDFDataset
+from .data_wrappers import ArrowDataset, PandasHDFDataset, get_h5py_dataset_memmap
+from .data_wrappers.arrow import write_arrow_file
 from .data_definition import DataDefinition
+from .file_layouts import get_file_layout
+from .utils.locks import NoLock
+from .utils.lru_cache import LRUCache, get_nbytes
+from .validation import check_no_nan
 
 
 SPARSE_FORMAT_SET = set(['csr', 'csc'])
+_MISSING = object()
 
 
 class DataHandler(six.with_metaclass(ABCMeta, object)):
+    # the lock that serializes the I/O when the backend is not thread-safe
+    io_lock = NoLock()
+    # whether the written data can be read by other processes
+    persistent = False
 
     @abstractmethod
     def can_skip(self, data_definition):
         pass
 
+    def can_skip_many(self, data_definitions):
+        """Check ``can_skip()`` for multiple data definitions at once.
+
+        Parameters
+        ----------
+        data_definitions : Iterable[DataDefinition]
+
+        Returns
+        -------
+        can_skip_dict : Dict[DataDefinition, bool]
+        """
+        return {data_def: self.can_skip(data_def) for data_def in data_definitions}
+
     @abstractmethod
     def get(self, data_definition):
         pass
@@ -35,10 +66,39 @@ class DataHandler(six.with_metaclass(ABCMeta, object)):
     def write_data(self, data_definition, data, **kwargs):
         pass
 
-    def bundle(self, data, path, new_key):
-        """write the data to another HDF5 file with new key."""
+    def get_version(self, data_definition):
+        """Get a string that changes when the data is rewritten.
+
+        Returns None if the version is unknown, e.g., the data is not persistent.
+        """
+        return None
+
+    def get_cache_nbytes(self, data_definition, data):
+        """Get the size of the data returned by ``get()`` for ``CachedDataHandler``.
+
+        Returns None if the data should not be cached, e.g., a lazy dataset.
+        """
+        return get_nbytes(data)
+
+    def prepare_bundle_data(self, data):
+        """Load the data returned by ``get()`` for ``write_bundle_data()``.
+
+        When bundling in parallel, it is called in the worker threads without holding
+        ``io_lock``, so the data returned by ``get()`` should be safe to read concurrently.
+        """
+        if isinstance(data, (h5py.Dataset, h5sparse.Dataset)):
+            return data[()]
+        return data
+
+    def write_bundle_data(self, data, path, new_key):
+        """Write the data loaded by ``prepare_bundle_data()`` to another HDF5 file with new key.
+        """
         with h5sparse.File(path, 'a') as h5f:
             h5f.create_dataset(new_key, data=data)
+
+    def bundle(self, data, path, new_key):
+        """write the data to another HDF5 file with new key."""
+        self.write_bundle_data(self.prepare_bundle_data(data), path, new_key)
         self.close()
 
     def update_context(self, context, data_definition, **kwargs):
@@ -47,47 +107,250 @@ class DataHandler(six.with_metaclass(ABCMeta, object)):
     def is_return_data_expected(self, **kwargs):
         return True
 
+    def close_data(self, data_definition):
+        """Close the resources opened for a single data definition."""
+        pass
+
+    def release_data(self, data_definition):
+        """Free the data of a non-persistent handler that will not be used anymore."""
+        pass
+
+    def copy_without_data(self):
+        """Get the handler pickled to the worker processes instead of this one.
+
+        The non-persistent handlers return an empty handler, since the worker processes get
+        their data with each node.
+        """
+        return self
+
+    def limit_open_files(self, in_use=()):
+        """Close the least recently used read-only files beyond the limit of the handler.
+
+        The data returned by ``get()`` for the closed files can't be read anymore, so the
+        files of the data definitions in ``in_use`` (e.g., read by the running nodes) are kept
+        open and not counted.
+        """
+        pass
+
     def close(self):
         pass
 
 
+class FileDataHandler(DataHandler):
+    """The handler storing the data of each data definition in a file.
+
+    Parameters
+    ----------
+    directory : Union[str, Path]
+    layout : str
+        The file layout (see ``get_file_layout()``).
+    suffix : str
+    sidecar_suffixes : Sequence[str]
+    """
+    persistent = True
+
+    def __init__(self, directory, layout, suffix, sidecar_suffixes=()):
+        self.layout = get_file_layout(layout, directory, suffix, sidecar_suffixes)
+
+    def _get_path(self, data_definition):
+        return self.layout.get_path(data_definition)
+
+    def can_skip(self, data_definition):
+        return self.layout.exists(data_definition)
+
+    def can_skip_many(self, data_definitions):
+        return self.layout.exists_many(data_definitions)
+
+    def get_version(self, data_definition):
+        return self.layout.get_version(data_definition)
+
+
+# h5py only caches the chunks smaller than 1 MiB by default
+TARGET_CHUNK_BYTES = 2 ** 20
+
+
+def get_row_chunks(shape, dtype, target_bytes=TARGET_CHUNK_BYTES):
+    """Get a chunk shape spanning whole rows, which is efficient for reading row ranges.
+
+    As many rows as possible are put in a chunk of at most ``target_bytes``. If a single row is
+    larger than that, the last axis is also split.
+
+    Parameters
+    ----------
+    shape : Tuple[int, ...]
+    dtype : numpy.dtype
+    target_bytes : int
+
+    Returns
+    -------
+    chunks : Optional[Tuple[int, ...]]
+        None if the data can't be chunked (scalar or empty).
+    """
+    shape = tuple(shape)
+    if len(shape) == 0 or 0 in shape:
+        return None
+    row_bytes = np.dtype(dtype).itemsize * int(np.prod(shape[1:]))
+    if row_bytes <= target_bytes:
+        return (min(shape[0], max(1, target_bytes // row_bytes)),) + shape[1:]
+    # split the last axis of a single row
+    inner_bytes = row_bytes // shape[-1]
+    chunks = (1,) + shape[1:-1] + (max(1, target_bytes // inner_bytes),)
+    return tuple(min(chunk, dim) for chunk, dim in zip(chunks, shape))
+
+
+# the default number of the read-only files kept open by a file handler between the nodes
+MAX_OPEN_FILES = 64
+
+
+def get_read_only_file(file_dict, data_definition, open_file):
+    """Get an opened file in ``file_dict`` and mark it as the most recently used one."""
+    if data_definition in file_dict:
+        opened_file = file_dict.pop(data_definition)
+    else:
+        opened_file = open_file()
+    file_dict[data_definition] = opened_file
+    return opened_file
+
+
+def close_least_recently_used_files(file_dict, max_open_files, excluded_keys):
+    """Close the files in an ``OrderedDict`` from the oldest ones until at most
+    ``max_open_files`` of them (not counting ``excluded_keys``) are open."""
+    keys = [key for key in file_dict if key not in excluded_keys]
+    for key in keys[:max(0, len(keys) - max_open_files)]:
+        file_dict.pop(key).close()
+
+
 class H5pyDataHandlerArgs(
         namedtuple('H5pyDataHandlerArgs', ['allow_nan',
-                                           'create_dataset_context'])):
+                                           'create_dataset_context',
+                                           'chunks',
+                                           'compression',
+                                           'compression_opts',
+                                           'shuffle',
+                                           'dtype'])):
+    """The arguments of ``will_generate('h5py', ...)``.
+
+    Parameters
+    ----------
+    allow_nan : bool
+    create_dataset_context : Optional[str]
+        If not None, a function creating the dataset is passed to the generator method in
+        this keyword argument instead of returning the data.
+    chunks : Union[None, bool, str, Tuple[int, ...]]
+        The chunk shape. ``'auto'`` uses ``get_row_chunks()``, which is also used if
+        ``compression`` or ``shuffle`` is set without ``chunks``. ``True`` lets h5py guess.
+        If None and no filter is used, the data is stored contiguously.
+    compression : Optional[str]
+        ``'gzip'``, ``'lzf'`` or other filters supported by h5py.
+    compression_opts : Optional[int]
+        E.g., the level of gzip.
+    shuffle : bool
+        Whether to use the shuffle filter, which usually improves the compression ratio.
+    dtype : Optional[numpy.dtype]
+        Convert the data to this type when writing, e.g., ``'uint8'`` for low-cardinality
+        features.
+    """
     def __new__(
-            cls, allow_nan=False, create_dataset_context=None):
+            cls, allow_nan=False, create_dataset_context=None, chunks=None, compression=None,
+            compression_opts=None, shuffle=False, dtype=None):
         return super(H5pyDataHandlerArgs, cls).__new__(
-            cls, allow_nan, create_dataset_context)
+            cls, allow_nan, create_dataset_context, chunks, compression, compression_opts,
+            shuffle, dtype)
 
+    def get_dataset_kwargs(self, shape=None, dtype=None, is_sparse=False):
+        """Get the keyword arguments of ``create_dataset()``.
 
-class H5pyDataHandler(DataHandler):
+        Parameters
+        ----------
+        shape : Optional[Tuple[int, ...]]
+            The shape of the dense data, used for the auto chunking.
+        dtype : Optional[numpy.dtype]
+            The type of the data, used for the auto chunking if ``self.dtype`` is None.
+        is_sparse : bool
+            If True, the filters are applied to the 1-D arrays of the sparse matrix, so the
+            chunk shape is guessed by h5py.
+        """
+        kwargs = {}
+        if self.dtype is not None:
+            kwargs['dtype'] = self.dtype
+        if self.compression is not None:
+            kwargs['compression'] = self.compression
+            if self.compression_opts is not None:
+                kwargs['compression_opts'] = self.compression_opts
+        if self.shuffle:
+            kwargs['shuffle'] = True
+        chunks = self.chunks
+        if chunks is None and (self.compression is not None or self.shuffle):
+            chunks = 'auto'
+        if chunks == 'auto':
+            if is_sparse or shape is None:
+                chunks = True
+            else:
+                chunks = get_row_chunks(shape, self.dtype or dtype)
+        if chunks is not None:
+            kwargs['chunks'] = chunks
+        return kwargs
 
-    def __init__(self, hdf_dir):
-        self.hdf_dir = Path(hdf_dir)
-        self.hdf_dir.mkdir(parents=True, exist_ok=True)
-        self.h5f_dict = {}
 
-    def _get_hdf_path(self, data_definition):
-        return self.hdf_dir / (data_definition.to_json() + ".h5")
+class H5pyDataHandler(FileDataHandler):
+    io_lock = threading.RLock()
 
-    def can_skip(self, data_definition):
-        hdf_path = self._get_hdf_path(data_definition)
-        if hdf_path.exists():
-            return True
-        return False
+    def __init__(self, hdf_dir, layout='json', mmap=False, max_open_files=MAX_OPEN_FILES):
+        """
+        Parameters
+        ----------
+        mmap : bool
+            If True, ``get()`` returns a read-only ``numpy.memmap`` instead of the h5py dataset
+            for the contiguous and uncompressed dense data, so the processes reading the same
+            data share the page cache instead of copying it. Note that ``[()]`` of a memmap is
+            a read-only view instead of a copy.
+        max_open_files : int
+            The number of the read-only files kept open by ``limit_open_files()``.
+        """
+        self.hdf_dir = Path(hdf_dir)
+        super(H5pyDataHandler, self).__init__(self.hdf_dir, layout, ".h5")
+        self.mmap = mmap
+        self.max_open_files = max_open_files
+        # the files in the order of use
+        self.h5f_dict = OrderedDict()
+        self._writing_data_definitions = set()
+
+    def __getstate__(self):
+        # opened files can't be pickled
+        state = self.__dict__.copy()
+        state['h5f_dict'] = OrderedDict()
+        state['_writing_data_definitions'] = set()
+        return state
 
     def _get_read_only_h5py_file(self, data_definition):
-        if data_definition in self.h5f_dict:
-            return self.h5f_dict[data_definition]
-        h5f = h5sparse.File(self._get_hdf_path(data_definition), 'r')
-        self.h5f_dict[data_definition] = h5f
-        return h5f
+        return get_read_only_file(
+            self.h5f_dict, data_definition,
+            lambda: h5sparse.File(self._get_path(data_definition), 'r'))
+
+    def _get_dataset(self, data_definition):
+        dataset = self._get_read_only_h5py_file(data_definition)['data']
+        if self.mmap:
+            memmap = get_h5py_dataset_memmap(dataset)
+            if memmap is not None:
+                return memmap
+        return dataset
 
     def get(self, data_definition):
         if isinstance(data_definition, DataDefinition):
-            return self._get_read_only_h5py_file(data_definition)['data']
-        return {data_def: self._get_read_only_h5py_file(data_def)['data']
-                for data_def in data_definition}
+            return self._get_dataset(data_definition)
+        return {data_def: self._get_dataset(data_def) for data_def in data_definition}
+
+    def read_direct(self, data_definition, dest, source_sel=None, dest_sel=None):
+        """Read the dense data directly into the preallocated array ``dest``.
+
+        It works for chunked and compressed data without allocating an intermediate array.
+        See ``h5py.Dataset.read_direct()`` for the selections.
+        """
+        dataset = self._get_read_only_h5py_file(data_definition)['data']
+        if not isinstance(dataset, h5py.Dataset):
+            raise ValueError("read_direct() doesn't support the sparse data {}."
+                             .format(data_definition))
+        dataset.read_direct(dest, source_sel, dest_sel)
 
     def update_context(self, context, data_definition, **kwargs):
         args = H5pyDataHandlerArgs(**kwargs)
@@ -98,43 +361,63 @@ class H5pyDataHandler(DataHandler):
 
         # open h5
         assert data_definition not in self.h5f_dict
-        hdf_path = self._get_hdf_path(data_definition)
+        hdf_path = self.layout.prepare_path(data_definition)
         assert not hdf_path.exists()
         h5f = h5sparse.File(hdf_path, 'w')
         self.h5f_dict[data_definition] = h5f
+        self._writing_data_definitions.add(data_definition)
+        self.layout.register(data_definition)
+
+        functions[data_definition.key] = partial(self._create_dataset, h5f, args)
 
-        functions[data_definition.key] = partial(h5f.create_dataset, 'data')
+    @staticmethod
+    def _create_dataset(h5f, args, shape=None, dtype=None, data=None, **kwargs):
+        dataset_kwargs = args.get_dataset_kwargs(
+            shape=shape if shape is not None else getattr(data, 'shape', None),
+            dtype=dtype if dtype is not None else getattr(data, 'dtype', None),
+            is_sparse=ss.isspmatrix(data) or kwargs.get('sparse_format') is not None)
+        if dtype is not None:
+            dataset_kwargs['dtype'] = dtype
+        dataset_kwargs.update(kwargs)
+        return h5f.create_dataset('data', shape=shape, data=data, **dataset_kwargs)
 
     def write_data(self, data_definition, data, **kwargs):
         args = H5pyDataHandlerArgs(**kwargs)
-        hdf_path = self._get_hdf_path(data_definition)
+        hdf_path = self.layout.prepare_path(data_definition)
         if hdf_path.exists():
             raise NotImplementedError(
                 "Overwriting not supported. Please report an issue.")
         if not args.allow_nan:
-            # check nan
-            if ss.isspmatrix(data):
-                if np.isnan(data.data).any():
-                    raise ValueError("data {} have nan".format(data_definition))
-            elif np.isnan(data).any():
-                raise ValueError("data {} have nan".format(data_definition))
+            check_no_nan(data, data_definition)
 
         # write data
         with h5sparse.File(hdf_path, 'w') as h5f, \
                 SimpleTimer("[{}] Writing generated data {} to hdf5 file"
                             .format(type(self).__name__, data_definition),
                             end_in_new_line=False):
-            h5f.create_dataset('data', data=data)
+            self._create_dataset(h5f, args, data=data)
+        self.layout.register(data_definition)
 
     def is_return_data_expected(self, **kwargs):
         args = H5pyDataHandlerArgs(**kwargs)
         return args.create_dataset_context is None
 
+    def close_data(self, data_definition):
+        self._writing_data_definitions.discard(data_definition)
+        h5f = self.h5f_dict.pop(data_definition, None)
+        if h5f is not None:
+            h5f.close()
+
+    def limit_open_files(self, in_use=()):
+        close_least_recently_used_files(self.h5f_dict, self.max_open_files,
+                                        self._writing_data_definitions.union(in_use))
+
     def close(self):
         if self.h5f_dict:
             for data_definition, h5f in six.viewitems(self.h5f_dict):
                 h5f.close()
-            self.h5f_dict = {}
+            self.h5f_dict = OrderedDict()
+            self._writing_data_definitions = set()
 
 
 class PandasHDFDataHandlerArgs(
@@ -146,33 +429,36 @@ class PandasHDFDataHandlerArgs(
             cls, allow_nan, append_context, data_columns)
 
 
-class PandasHDFDataHandler(DataHandler):
+class PandasHDFDataHandler(FileDataHandler):
+    # PyTables is not thread-safe, so the lock is also used by PandasHDFDataset
+    io_lock = threading.RLock()
 
-    def __init__(self, hdf_dir):
+    def __init__(self, hdf_dir, layout='json', max_open_files=MAX_OPEN_FILES):
         self.hdf_dir = Path(hdf_dir)
-        self.hdf_dir.mkdir(parents=True, exist_ok=True)
-        self.hdf_store_dict = {}
-
-    def _get_hdf_path(self, data_definition):
-        return self.hdf_dir / (data_definition.to_json() + ".h5")
+        super(PandasHDFDataHandler, self).__init__(self.hdf_dir, layout, ".h5")
+        self.max_open_files = max_open_files
+        # the stores in the order of use
+        self.hdf_store_dict = OrderedDict()
+        self._writing_data_definitions = set()
 
-    def can_skip(self, data_definition):
-        hdf_path = self._get_hdf_path(data_definition)
-        if hdf_path.exists():
-            return True
-        return False
+    def __getstate__(self):
+        # opened files can't be pickled
+        state = self.__dict__.copy()
+        state['hdf_store_dict'] = OrderedDict()
+        state['_writing_data_definitions'] = set()
+        return state
 
     def _get_read_only_hdf_store(self, data_definition):
-        if data_definition in self.hdf_store_dict:
-            return self.hdf_store_dict[data_definition]
-        hdf_store = pd.HDFStore(self._get_hdf_path(data_definition), 'r')
-        self.hdf_store_dict[data_definition] = hdf_store
-        return hdf_store
+        return get_read_only_file(
+            self.hdf_store_dict, data_definition,
+            lambda: pd.HDFStore(self._get_path(data_definition), 'r'))
 
     def get(self, data_definition):
         if isinstance(data_definition, DataDefinition):
-            return PandasHDFDataset(self._get_read_only_hdf_store(data_definition), 'data')
-        return {data_def: PandasHDFDataset(self._get_read_only_hdf_store(data_def), 'data')
+            return PandasHDFDataset(
+                self._get_read_only_hdf_store(data_definition), 'data', lock=self.io_lock)
+        return {data_def: PandasHDFDataset(self._get_read_only_hdf_store(data_def), 'data',
+                                           lock=self.io_lock)
                 for data_def in data_definition}
 
     def update_context(self, context, data_definition, **kwargs):
@@ -184,33 +470,31 @@ class PandasHDFDataHandler(DataHandler):
 
         # open hdf store
         assert data_definition not in self.hdf_store_dict
-        hdf_path = self._get_hdf_path(data_definition)
+        hdf_path = self.layout.prepare_path(data_definition)
         assert not hdf_path.exists()
         hdf_store = pd.HDFStore(hdf_path, 'w')
         self.hdf_store_dict[data_definition] = hdf_store
+        self._writing_data_definitions.add(data_definition)
+        self.layout.register(data_definition)
 
-        functions[data_definition.key] = partial(hdf_store.append, 'data')
+        functions[data_definition.key] = partial(self._append, hdf_store)
+
+    def _append(self, hdf_store, data, **kwargs):
+        # the function in the context can be called in the worker threads
+        with self.io_lock:
+            hdf_store.append('data', data, **kwargs)
 
     def write_data(self, data_definition, data, **kwargs):
         args = PandasHDFDataHandlerArgs(**kwargs)
-        hdf_path = self._get_hdf_path(data_definition)
+        hdf_path = self.layout.prepare_path(data_definition)
         if hdf_path.exists():
             raise NotImplementedError(
                 "Overwriting not supported. Please report an issue.")
         if not args.allow_nan:
-            # check nan
-            is_null = False
-            if isinstance(data, pd.DataFrame):
-                if data.isnull().any().any():
-                    is_null = True
-            elif isinstance(data, pd.Series):
-                if data.isnull().any():
-                    is_null = True
-            else:
+            if not isinstance(data, (pd.DataFrame, pd.Series)):
                 raise ValueError("PandasHDFDataHandler doesn't support type {} (in key {})"
                                  .format(type(data), data_definition))
-            if is_null:
-                raise ValueError("data {} have nan".format(data_definition))
+            check_no_nan(data, data_definition)
 
         # write data
         with pd.HDFStore(hdf_path, 'w') as hdf_store, \
@@ -225,67 +509,595 @@ class PandasHDFDataHandler(DataHandler):
                 hdf_store.put('data', data)
             else:
                 hdf_store.put('data', data, format='table', data_columns=args.data_columns)
+        self.layout.register(data_definition)
 
-    def bundle(self, data, path, new_key):
-        """Write the data to another HDF5 file with new key."""
-        data.value.to_hdf(path, new_key)
-        self.close()
+    def prepare_bundle_data(self, data):
+        if isinstance(data, PandasHDFDataset):
+            return data.value
+        return data
+
+    def write_bundle_data(self, data, path, new_key):
+        # PyTables is not thread-safe
+        with self.io_lock:
+            data.to_hdf(path, new_key)
 
     def is_return_data_expected(self, **kwargs):
         args = PandasHDFDataHandlerArgs(**kwargs)
         return args.append_context is None
 
+    def close_data(self, data_definition):
+        self._writing_data_definitions.discard(data_definition)
+        hdf_store = self.hdf_store_dict.pop(data_definition, None)
+        if hdf_store is not None:
+            hdf_store.close()
+
+    def limit_open_files(self, in_use=()):
+        close_least_recently_used_files(self.hdf_store_dict, self.max_open_files,
+                                        self._writing_data_definitions.union(in_use))
+
     def close(self):
         if self.hdf_store_dict:
             for data_definition, hdf_store in six.viewitems(self.hdf_store_dict):
                 hdf_store.close()
-            self.hdf_store_dict = {}
+            self.hdf_store_dict = OrderedDict()
+            self._writing_data_definitions = set()
 
 
 class MemoryDataHandler(DataHandler):
+    """Keep the data in memory.
+
+    Parameters
+    ----------
+    max_bytes : Optional[int]
+        If not None, the least recently used data are spilled to ``spill_dir`` when the
+        total size of the data in memory exceeds it, and they are reloaded by ``get()`` on
+        demand. The plain dense arrays are spilled as ``.npy`` files, and the others (including
+        the subclasses of ``numpy.ndarray``) are pickled
+        with the highest protocol (5 since Python 3.8).
+        The data whose size can't be estimated (see ``utils.lru_cache.get_nbytes()``) are
+        never spilled.
+    spill_dir : Optional[Union[str, Path]]
+        Default to a temporary directory, which is removed by ``close()`` once no data are
+        spilled, or at exit.
+    """
 
-    def __init__(self):
-        self.data = {}
+    def __init__(self, max_bytes=None, spill_dir=None):
+        self.data = OrderedDict()
+        self.max_bytes = max_bytes
+        self.spill_dir = Path(spill_dir) if spill_dir is not None else None
+        self._owns_spill_dir = False
+        self.n_bytes = 0
+        self.n_spills = 0
+        self.n_reloads = 0
+        self._nbytes = {}
+        self._spilled_paths = {}
+        self._lock = threading.RLock()
+
+    def __getstate__(self):
+        # locks can't be pickled
+        state = self.__dict__.copy()
+        del state['_lock']
+        # only the original handler removes the temporary directory
+        state['_owns_spill_dir'] = False
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
 
     def can_skip(self, data_definition):
+        return data_definition in self.data or data_definition in self._spilled_paths
+
+    def copy_without_data(self):
+        return MemoryDataHandler()
+
+    def _get_spill_path(self, data_definition, suffix):
+        if self.spill_dir is None:
+            self.spill_dir = Path(tempfile.mkdtemp(prefix="dagian_spill_"))
+            self._owns_spill_dir = True
+            # the spilled data may be kept until exit
+            atexit.register(shutil.rmtree, str(self.spill_dir), True)
+        self.spill_dir.mkdir(parents=True, exist_ok=True)
+        data_hash = hashlib.sha1(data_definition.to_json().encode('utf-8')).hexdigest()
+        return self.spill_dir / (data_hash + suffix)
+
+    def _spill(self, data_definition):
+        data = self.data.pop(data_definition)
+        self.n_bytes -= self._nbytes.pop(data_definition)
+        # the subclasses (e.g., masked arrays) can't be restored from .npy files
+        if type(data) is np.ndarray and not data.dtype.hasobject:
+            path = self._get_spill_path(data_definition, '.npy')
+            np.save(str(path), data)
+        else:
+            path = self._get_spill_path(data_definition, '.pkl')
+            with path.open('wb') as fp:
+                cPickle.dump(data, fp, protocol=cPickle.HIGHEST_PROTOCOL)
+        self._spilled_paths[data_definition] = path
+        self.n_spills += 1
+
+    def _reload(self, data_definition):
+        path = self._spilled_paths.pop(data_definition)
+        if path.suffix == '.npy':
+            data = np.load(str(path))
+        else:
+            with path.open('rb') as fp:
+                data = cPickle.load(fp)
+        path.unlink()
+        self.n_reloads += 1
+        return data
+
+    def _put(self, data_definition, data):
+        self._remove(data_definition)
+        self.data[data_definition] = data
+        if self.max_bytes is None:
+            return
+        nbytes = get_nbytes(data) or 0
+        self._nbytes[data_definition] = nbytes
+        self.n_bytes += nbytes
+        # spill the least recently used data except the current one
+        for data_def in list(self.data):
+            if self.n_bytes <= self.max_bytes:
+                break
+            if data_def != data_definition and self._nbytes[data_def] > 0:
+                self._spill(data_def)
+
+    def _remove(self, data_definition):
         if data_definition in self.data:
-            return True
-        return False
+            del self.data[data_definition]
+            self.n_bytes -= self._nbytes.pop(data_definition, 0)
+        path = self._spilled_paths.pop(data_definition, None)
+        if path is not None:
+            path.unlink()
+
+    def _get_one(self, data_definition):
+        with self._lock:
+            if data_definition in self._spilled_paths:
+                data = self._reload(data_definition)
+                self._put(data_definition, data)
+                return data
+            data = self.data[data_definition]
+            if self.max_bytes is not None:
+                # mark it as the most recently used one
+                del self.data[data_definition]
+                self.data[data_definition] = data
+            return data
 
     def get(self, data_definition):
         if isinstance(data_definition, DataDefinition):
-            return self.data[data_definition]
-        return {k: self.data[k] for k in data_definition}
+            return self._get_one(data_definition)
+        return {k: self._get_one(k) for k in data_definition}
 
     def write_data(self, data_definition, data):
-        self.data[data_definition] = data
+        with self._lock:
+            self._put(data_definition, data)
 
+    def release_data(self, data_definition):
+        with self._lock:
+            self._remove(data_definition)
 
-class PickleDataHandler(DataHandler):
+    def close(self):
+        # the data are kept in memory, so only the empty temporary directory is removed
+        with self._lock:
+            if self._owns_spill_dir and not self._spilled_paths:
+                shutil.rmtree(str(self.spill_dir), ignore_errors=True)
+                self.spill_dir = None
+                self._owns_spill_dir = False
 
-    def __init__(self, pickle_dir):
-        self.pickle_dir = Path(pickle_dir)
-        self.pickle_dir.mkdir(parents=True, exist_ok=True)
 
-    def can_skip(self, data_definition):
-        data_path = self.pickle_dir / (data_definition.to_json() + ".pkl")
-        if data_path.exists():
+# the suffix of the file storing the out-of-band buffers next to the pickle file
+PICKLE_BUFFERS_SUFFIX = '.buffers'
+# the out-of-band buffers are aligned for the vectorized operations
+PICKLE_BUFFER_ALIGNMENT = 64
+_BUFFER_INDEX_POSITION = struct.Struct('<Q')
+
+
+def get_pickle_buffers_path(pickle_path):
+    return pickle_path.with_name(pickle_path.name + PICKLE_BUFFERS_SUFFIX)
+
+
+def dump_pickle(data, pickle_path, min_out_of_band_bytes=None):
+    """Pickle the data, storing the buffers (e.g., of numpy arrays) not smaller than
+    ``min_out_of_band_bytes`` in a separate file without copying them into the pickle.
+
+    The out-of-band buffers require pickle protocol 5 (Python 3.8+). They are aligned in the
+    buffer file, followed by the pickled offsets and lengths of the buffers and the position
+    of them. The pickle file is renamed into place after the buffer file is written.
+    """
+    buffers_path = get_pickle_buffers_path(pickle_path)
+    if buffers_path.exists():
+        buffers_path.unlink()
+    if min_out_of_band_bytes is None or cPickle.HIGHEST_PROTOCOL < 5:
+        with pickle_path.open('wb') as fp:
+            cPickle.dump(data, fp, protocol=cPickle.HIGHEST_PROTOCOL)
+        return
+
+    buffers = []
+
+    def buffer_callback(buffer):
+        if buffer.raw().nbytes < min_out_of_band_bytes:
+            # serialized in-band
             return True
+        buffers.append(buffer)
         return False
 
+    temp_pickle_path = pickle_path.with_name(pickle_path.name + '.tmp')
+    with temp_pickle_path.open('wb') as fp:
+        cPickle.dump(data, fp, protocol=5, buffer_callback=buffer_callback)
+    if buffers:
+        buffer_index = []
+        with buffers_path.open('wb') as fp:
+            for buffer in buffers:
+                raw = buffer.raw()
+                fp.write(b'\0' * (-fp.tell() % PICKLE_BUFFER_ALIGNMENT))
+                buffer_index.append((fp.tell(), raw.nbytes))
+                fp.write(raw)
+            index_position = fp.tell()
+            cPickle.dump(buffer_index, fp, protocol=cPickle.HIGHEST_PROTOCOL)
+            fp.write(_BUFFER_INDEX_POSITION.pack(index_position))
+    os.replace(str(temp_pickle_path), str(pickle_path))
+
+
+def load_pickle(pickle_path):
+    """Load the data pickled by ``dump_pickle()``.
+
+    The out-of-band buffers are memory-mapped copy-on-write instead of being read, so the
+    numpy arrays in the data are loaded in constant time. They can still be modified in place
+    without changing the file, and the modified pages are copied into memory.
+    """
+    buffers_path = get_pickle_buffers_path(pickle_path)
+    buffers = None
+    if buffers_path.exists():
+        buffers_memmap = np.memmap(str(buffers_path), dtype=np.uint8, mode='c')
+        index_position, = _BUFFER_INDEX_POSITION.unpack(
+            buffers_memmap[-_BUFFER_INDEX_POSITION.size:].tobytes())
+        buffer_index = cPickle.loads(
+            buffers_memmap[index_position: -_BUFFER_INDEX_POSITION.size].tobytes())
+        buffers = [buffers_memmap[offset: offset + length] for offset, length in buffer_index]
+    with pickle_path.open('rb') as fp:
+        if buffers is None:
+            return cPickle.load(fp)
+        return cPickle.load(fp, buffers=buffers)
+
+
+class PickleDataHandler(FileDataHandler):
+    """Store the data in pickle files.
+
+    Parameters
+    ----------
+    min_out_of_band_bytes : Optional[int]
+        If not None, the buffers (e.g., of numpy arrays) not smaller than it are stored in a
+        ``.buffers`` file next to the pickle file, and they are memory-mapped when loading
+        (see ``load_pickle()``). It requires Python 3.8+, and the older versions of dagian
+        can't read the data pickled with the buffers. Default to None, which writes a single
+        pickle file.
+    """
+
+    def __init__(self, pickle_dir, layout='json', min_out_of_band_bytes=None):
+        self.pickle_dir = Path(pickle_dir)
+        super(PickleDataHandler, self).__init__(self.pickle_dir, layout, ".pkl",
+                                                sidecar_suffixes=(PICKLE_BUFFERS_SUFFIX,))
+        self.min_out_of_band_bytes = min_out_of_band_bytes
+
+    def get_cache_nbytes(self, data_definition, data):
+        nbytes = get_nbytes(data)
+        if nbytes is None:
+            # the size of the pickle file is close to the size of most objects
+            nbytes = self._get_path(data_definition).stat().st_size
+        return nbytes
+
     def get(self, data_definition):
         if isinstance(data_definition, DataDefinition):
-            with (self.pickle_dir / (data_definition.to_json() + ".pkl")).open('rb') as fp:
-                return cPickle.load(fp)
-        data = {}
-        for data_def in data_definition:
-            with (self.pickle_dir / (data_def.to_json() + ".pkl")).open('rb') as fp:
-                data[data_def] = cPickle.load(fp)
-        return data
+            return load_pickle(self._get_path(data_definition))
+        return {data_def: load_pickle(self._get_path(data_def))
+                for data_def in data_definition}
 
     def write_data(self, data_definition, data):
-        pickle_path = self.pickle_dir / (data_definition.to_json() + ".pkl")
+        pickle_path = self.layout.prepare_path(data_definition)
         with SimpleTimer("Writing generated data %s to pickle file" % data_definition,
-                         end_in_new_line=False), \
-                pickle_path.open('wb') as fp:
-            cPickle.dump(data, fp, protocol=cPickle.HIGHEST_PROTOCOL)
+                         end_in_new_line=False):
+            dump_pickle(data, pickle_path, self.min_out_of_band_bytes)
+        self.layout.register(data_definition)
+
+
+class NpyDataHandlerArgs(
+        namedtuple('NpyDataHandlerArgs', ['allow_nan', 'create_dataset_context'])):
+    """The arguments of ``will_generate('npy', ...)``.
+
+    Parameters
+    ----------
+    allow_nan : bool
+    create_dataset_context : Optional[str]
+        If not None, a function ``create_dataset(shape, dtype='float64')`` is passed to the
+        generator method in this keyword argument instead of returning the data. It returns
+        a writable memmap of the ``.npy`` file, which is filled in place.
+    """
+    def __new__(cls, allow_nan=False, create_dataset_context=None):
+        return super(NpyDataHandlerArgs, cls).__new__(cls, allow_nan, create_dataset_context)
+
+
+class NpyDataHandler(FileDataHandler):
+    """Store the dense arrays in ``.npy`` files, which are memory-mapped when reading.
+
+    ``get()`` returns a read-only ``numpy.memmap``, so the data are neither locked nor
+    copied, and the processes reading the same data share the page cache.
+    """
+
+    def __init__(self, npy_dir, layout='json'):
+        self.npy_dir = Path(npy_dir)
+        super(NpyDataHandler, self).__init__(self.npy_dir, layout, ".npy")
+        self.memmap_dict = {}
+
+    def __getstate__(self):
+        # the memmaps being written are not shipped
+        state = self.__dict__.copy()
+        state['memmap_dict'] = {}
+        return state
+
+    def get(self, data_definition):
+        if isinstance(data_definition, DataDefinition):
+            return np.load(str(self._get_path(data_definition)), mmap_mode='r')
+        return {data_def: np.load(str(self._get_path(data_def)), mmap_mode='r')
+                for data_def in data_definition}
+
+    def update_context(self, context, data_definition, **kwargs):
+        args = NpyDataHandlerArgs(**kwargs)
+        if args.create_dataset_context is None:
+            return
+        functions = context.setdefault(args.create_dataset_context, {})
+        assert data_definition.key not in functions
+        npy_path = self.layout.prepare_path(data_definition)
+        assert not npy_path.exists()
+        functions[data_definition.key] = partial(self._create_memmap, data_definition, npy_path)
+
+    def _create_memmap(self, data_definition, npy_path, shape, dtype='float64'):
+        assert data_definition not in self.memmap_dict
+        memmap = np.lib.format.open_memmap(str(npy_path), mode='w+', dtype=dtype, shape=shape)
+        self.memmap_dict[data_definition] = memmap
+        self.layout.register(data_definition)
+        return memmap
+
+    def write_data(self, data_definition, data, **kwargs):
+        args = NpyDataHandlerArgs(**kwargs)
+        npy_path = self.layout.prepare_path(data_definition)
+        if npy_path.exists():
+            raise NotImplementedError(
+                "Overwriting not supported. Please report an issue.")
+        if ss.isspmatrix(data) or isinstance(data, (pd.DataFrame, pd.Series)):
+            raise ValueError("NpyDataHandler doesn't support type {} (in key {})"
+                             .format(type(data), data_definition))
+        data = np.asanyarray(data)
+        if data.dtype.hasobject:
+            raise ValueError("NpyDataHandler doesn't support the object arrays (in key {})"
+                             .format(data_definition))
+        if not args.allow_nan:
+            check_no_nan(data, data_definition)
+
+        with SimpleTimer("[{}] Writing generated data {} to npy file"
+                         .format(type(self).__name__, data_definition),
+                         end_in_new_line=False):
+            np.save(str(npy_path), data)
+        self.layout.register(data_definition)
+
+    def is_return_data_expected(self, **kwargs):
+        args = NpyDataHandlerArgs(**kwargs)
+        return args.create_dataset_context is None
+
+    def close_data(self, data_definition):
+        memmap = self.memmap_dict.pop(data_definition, None)
+        if memmap is not None:
+            memmap.flush()
+
+    def close(self):
+        for memmap in six.viewvalues(self.memmap_dict):
+            memmap.flush()
+        self.memmap_dict = {}
+
+
+class ArrowDataHandlerArgs(namedtuple('ArrowDataHandlerArgs', ['allow_nan', 'batch_size'])):
+    """The arguments of ``will_generate('arrow', ...)``.
+
+    Parameters
+    ----------
+    allow_nan : bool
+    batch_size : int
+        The number of rows in each record batch of the file.
+    """
+    def __new__(cls, allow_nan=False, batch_size=2 ** 16):
+        return super(ArrowDataHandlerArgs, cls).__new__(cls, allow_nan, batch_size)
+
+
+class ArrowDataHandler(FileDataHandler):
+    """Store the DataFrames and Series in Arrow IPC files, which requires pyarrow.
+
+    ``get()`` returns an ``ArrowDataset`` reading the memory-mapped file, which supports
+    ``select(columns=..., start=..., stop=...)`` like ``PandasHDFDataset``, so only the
+    selected columns and rows are converted into pandas. The datasets are kept open until
+    ``close_data()``, and at most ``max_open_files`` of them by ``limit_open_files()``.
+    """
+
+    def __init__(self, arrow_dir, layout='json', max_open_files=MAX_OPEN_FILES):
+        self.arrow_dir = Path(arrow_dir)
+        super(ArrowDataHandler, self).__init__(self.arrow_dir, layout, ".arrow")
+        self.max_open_files = max_open_files
+        # the datasets in the order of use
+        self.dataset_dict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # opened files and locks can't be pickled
+        state = self.__dict__.copy()
+        state['dataset_dict'] = OrderedDict()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _get_dataset(self, data_definition):
+        with self._lock:
+            return get_read_only_file(
+                self.dataset_dict, data_definition,
+                lambda: ArrowDataset(self._get_path(data_definition)))
+
+    def get(self, data_definition):
+        if isinstance(data_definition, DataDefinition):
+            return self._get_dataset(data_definition)
+        return {data_def: self._get_dataset(data_def) for data_def in data_definition}
+
+    def write_data(self, data_definition, data, **kwargs):
+        args = ArrowDataHandlerArgs(**kwargs)
+        arrow_path = self.layout.prepare_path(data_definition)
+        if arrow_path.exists():
+            raise NotImplementedError(
+                "Overwriting not supported. Please report an issue.")
+        if not isinstance(data, (pd.DataFrame, pd.Series)):
+            raise ValueError("ArrowDataHandler doesn't support type {} (in key {})"
+                             .format(type(data), data_definition))
+        if not args.allow_nan:
+            check_no_nan(data, data_definition)
+
+        with SimpleTimer("[{}] Writing generated data {} to arrow file"
+                         .format(type(self).__name__, data_definition),
+                         end_in_new_line=False):
+            write_arrow_file(data, arrow_path, args.batch_size)
+        self.layout.register(data_definition)
+
+    def prepare_bundle_data(self, data):
+        if isinstance(data, ArrowDataset):
+            return data.value
+        return data
+
+    def write_bundle_data(self, data, path, new_key):
+        # the reader threads may be using PyTables
+        with PandasHDFDataHandler.io_lock:
+            data.to_hdf(path, new_key)
+
+    def close_data(self, data_definition):
+        with self._lock:
+            dataset = self.dataset_dict.pop(data_definition, None)
+        if dataset is not None:
+            dataset.close()
+
+    def limit_open_files(self, in_use=()):
+        with self._lock:
+            close_least_recently_used_files(self.dataset_dict, self.max_open_files,
+                                            set(in_use))
+
+    def close(self):
+        with self._lock:
+            dataset_dict, self.dataset_dict = self.dataset_dict, OrderedDict()
+        for dataset in six.viewvalues(dataset_dict):
+            dataset.close()
+
+
+class CachedDataHandler(DataHandler):
+    """Keep the data loaded by another handler in an LRU cache.
+
+    ``get()`` returns the cached object if the data definition has been loaded, so the data
+    consumed by many nodes (e.g., a pickled object) are decoded only once. Only the data whose
+    size is given by ``handler.get_cache_nbytes()`` are cached, so the lazy datasets (e.g.,
+    h5py) are always read from the handler. The cached data are shared by the consumers, so
+    they should not be modified in place. The cache entry is invalidated when the data
+    definition is written again.
+
+    Parameters
+    ----------
+    handler : DataHandler
+        The handler loading and writing the data.
+    max_bytes : int
+        The budget of the total size of the cached data.
+    """
+
+    def __init__(self, handler, max_bytes):
+        self.handler = handler
+        self.io_lock = handler.io_lock
+        self.persistent = handler.persistent
+        self.cache = LRUCache(max_bytes)
+
+    def __getstate__(self):
+        # locks can't be pickled, and the cached data are not shipped
+        state = self.__dict__.copy()
+        del state['io_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.io_lock = self.handler.io_lock
+
+    def __getattr__(self, name):
+        # e.g., the layout of the file handlers, but not the special methods like pickling
+        if name == 'handler' or (name.startswith('__') and name.endswith('__')):
+            raise AttributeError(name)
+        return getattr(self.handler, name)
+
+    def copy_without_data(self):
+        handler = self.handler.copy_without_data()
+        if handler is self.handler:
+            return self
+        return CachedDataHandler(handler, self.cache.max_bytes)
+
+    @property
+    def hits(self):
+        return self.cache.hits
+
+    @property
+    def misses(self):
+        return self.cache.misses
+
+    def can_skip(self, data_definition):
+        return self.handler.can_skip(data_definition)
+
+    def can_skip_many(self, data_definitions):
+        return self.handler.can_skip_many(data_definitions)
+
+    def _get_one(self, data_definition):
+        data = self.cache.get(data_definition, _MISSING)
+        if data is _MISSING:
+            data = self.handler.get(data_definition)
+            nbytes = self.handler.get_cache_nbytes(data_definition, data)
+            if nbytes is not None:
+                self.cache.put(data_definition, data, nbytes)
+        return data
+
+    def get(self, data_definition):
+        if isinstance(data_definition, DataDefinition):
+            return self._get_one(data_definition)
+        return {data_def: self._get_one(data_def) for data_def in data_definition}
+
+    def write_data(self, data_definition, data, **kwargs):
+        self.cache.pop(data_definition)
+        self.handler.write_data(data_definition, data, **kwargs)
+
+    def get_version(self, data_definition):
+        return self.handler.get_version(data_definition)
+
+    def get_cache_nbytes(self, data_definition, data):
+        return self.handler.get_cache_nbytes(data_definition, data)
+
+    def prepare_bundle_data(self, data):
+        return self.handler.prepare_bundle_data(data)
+
+    def write_bundle_data(self, data, path, new_key):
+        self.handler.write_bundle_data(data, path, new_key)
+
+    def update_context(self, context, data_definition, **kwargs):
+        # the data may be written through the context
+        self.cache.pop(data_definition)
+        self.handler.update_context(context, data_definition, **kwargs)
+
+    def is_return_data_expected(self, **kwargs):
+        return self.handler.is_return_data_expected(**kwargs)
+
+    def close_data(self, data_definition):
+        self.handler.close_data(data_definition)
+
+    def limit_open_files(self, in_use=()):
+        self.handler.limit_open_files(in_use)
+
+    def release_data(self, data_definition):
+        self.cache.pop(data_definition)
+        self.handler.release_data(data_definition)
+
+    def close(self):
+        self.handler.close()
@@ -1 +1,3 @@
 from .pandas_hdf import PandasHDFDataset  # noqa: F401
+from .h5py_memmap import get_h5py_dataset_memmap  # noqa: F401
+from .arrow import ArrowDataset  # noqa: F401
@@ -0,0 +1,177 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import OrderedDict
+import json
+
+import six
+
+
+# the schema metadata marking the tables written from a Series
+SERIES_NAME_METADATA_KEY = b'dagian_series_name'
+
+
+def import_pyarrow():
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise ImportError("pyarrow is required to read or write the Arrow IPC files.")
+    return pa
+
+
+def write_arrow_file(data, path, batch_size=2 ** 16, preserve_index=True):
+    """Write a DataFrame or a Series as an Arrow IPC file in record batches.
+
+    Parameters
+    ----------
+    data : Union[pandas.DataFrame, pandas.Series]
+    path : Union[str, Path]
+    batch_size : int
+        The number of rows in each record batch.
+    preserve_index : bool
+        If True, the index is stored as columns, so it is kept when reading a range of rows.
+        Otherwise, the index is dropped (e.g., in the bundles).
+    """
+    pa = import_pyarrow()
+    metadata = {}
+    if not hasattr(data, 'columns'):
+        metadata[SERIES_NAME_METADATA_KEY] = json.dumps(data.name).encode('utf-8')
+        data = data.to_frame(name='data' if data.name is None else data.name)
+    # the types of the object columns are inferred from all the rows
+    table = pa.Table.from_pandas(data, preserve_index=preserve_index)
+    metadata.update(table.schema.metadata or {})
+    table = table.replace_schema_metadata(metadata)
+    with pa.OSFile(str(path), 'wb') as sink:
+        writer = pa.RecordBatchFileWriter(sink, table.schema)
+        try:
+            writer.write_table(table, max_chunksize=batch_size)
+        finally:
+            writer.close()
+
+
+def write_arrow_batches(batches, path, preserve_index=True):
+    """Write the DataFrames as the record batches of an Arrow IPC file.
+
+    Only a batch is converted at a time, and the schema is inferred from the first batch.
+
+    Parameters
+    ----------
+    batches : Iterable[pandas.DataFrame]
+        At least one batch with the same columns.
+    path : Union[str, Path]
+    preserve_index : bool
+    """
+    pa = import_pyarrow()
+    with pa.OSFile(str(path), 'wb') as sink:
+        writer = None
+        schema = None
+        try:
+            for batch in batches:
+                record_batch = pa.RecordBatch.from_pandas(batch, schema=schema,
+                                                          preserve_index=preserve_index)
+                if writer is None:
+                    schema = record_batch.schema
+                    writer = pa.RecordBatchFileWriter(sink, schema)
+                writer.write_batch(record_batch)
+        finally:
+            if writer is not None:
+                writer.close()
+
+
+class ArrowDataset(object):
+    """``PandasHDFDataset``-like wrapper for an Arrow IPC file.
+
+    The file is memory-mapped, and only the selected columns and rows are converted into
+    pandas.
+
+    Parameters
+    ----------
+    path : Union[str, Path]
+    """
+
+    def __init__(self, path):
+        pa = import_pyarrow()
+        self.path = str(path)
+        self._source = pa.memory_map(self.path, 'r')
+        self._table = pa.RecordBatchFileReader(self._source).read_all()
+        pandas_metadata = self._table.schema.pandas_metadata or {}
+        self._index_columns = [column for column in pandas_metadata.get('index_columns', [])
+                               if isinstance(column, six.string_types)]
+        self._data_columns = [name for name in self._table.schema.names
+                              if name not in self._index_columns]
+        schema_metadata = self._table.schema.metadata or {}
+        self._is_series = SERIES_NAME_METADATA_KEY in schema_metadata
+        if self._is_series:
+            self._series_name = json.loads(
+                schema_metadata[SERIES_NAME_METADATA_KEY].decode('utf-8'))
+            self.shape = (self._table.num_rows,)
+            self._column_fields = OrderedDict()
+        else:
+            self.shape = (self._table.num_rows, len(self._data_columns))
+            # the original column labels (e.g., integers) restored by pandas
+            labels = self._table.slice(0, 0).to_pandas().columns
+            self._column_fields = OrderedDict(zip(labels, self._data_columns))
+
+    def close(self):
+        self._table = None
+        self._source.close()
+
+    @property
+    def columns(self):
+        """The column labels of the DataFrame as in ``[()]``, or an empty list for a Series."""
+        return list(self._column_fields)
+
+    @property
+    def value(self):
+        return self.select()
+
+    @property
+    def dtype(self):
+        return self.select(start=0, stop=1).values.dtype
+
+    def _to_pandas(self, table):
+        data = table.to_pandas()
+        if self._is_series:
+            data = data.iloc[:, 0].rename(self._series_name)
+        return data
+
+    def _slice(self, start, stop):
+        start, stop, _ = slice(start, stop).indices(self._table.num_rows)
+        return self._table.slice(start, max(0, stop - start))
+
+    def select(self, columns=None, start=None, stop=None):
+        """Read some columns in a range of rows.
+
+        Parameters
+        ----------
+        columns : Optional[Sequence]
+            The column labels in ``columns``. If None, read all the columns.
+        start : Optional[int]
+        stop : Optional[int]
+
+        Returns
+        -------
+        data : Union[pandas.DataFrame, pandas.Series]
+        """
+        table = self._slice(start, stop)
+        if columns is not None:
+            pa = import_pyarrow()
+            for column in columns:
+                if column not in self._column_fields:
+                    raise KeyError("column {!r} is not in {}".format(column, self.path))
+            names = [self._column_fields[column] for column in columns] + self._index_columns
+            table = pa.Table.from_arrays(
+                [table.column(name) for name in names], names=names
+            ).replace_schema_metadata(table.schema.metadata)
+        return self._to_pandas(table)
+
+    def select_column(self, column, start=None, stop=None):
+        return self.select([column], start=start, stop=stop)[column]
+
+    def __getitem__(self, key):
+        if key == ():
+            return self.value
+        if isinstance(key, six.integer_types):
+            return self.select(start=key, stop=key + 1)
+        elif isinstance(key, slice):
+            if key.step is None:
+                return self.select(start=key.start, stop=key.stop)
+        raise NotImplementedError("Key {} is not supported".format(key))
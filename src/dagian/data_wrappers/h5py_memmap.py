@@ -0,0 +1,28 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+
+import h5py
+import numpy as np
+
+
+def get_h5py_dataset_memmap(dataset):
+    """Memory-map a dense h5py dataset without copying it.
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+
+    Returns
+    -------
+    memmap : Optional[numpy.memmap]
+        A read-only memmap over the data in the HDF5 file. None if the dataset can't be
+        memory-mapped, e.g., it is chunked, compressed, not allocated or has object dtype.
+    """
+    if not isinstance(dataset, h5py.Dataset):
+        return None
+    if dataset.chunks is not None or dataset.dtype.hasobject:
+        return None
+    offset = dataset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(dataset.file.filename, mode='r', dtype=dataset.dtype,
+                     shape=dataset.shape, offset=offset)
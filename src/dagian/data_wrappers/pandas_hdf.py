@@ -1,5 +1,7 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 
+from ..utils.locks import NoLock
+
 
 def get_shape_from_pandas_hdf_storer(storer):
     # TODO: when the data has MultiIndex column and the format is 'fixed', the
@@ -22,38 +24,55 @@ def get_shape_from_pandas_hdf_storer(storer):
 
 
 class PandasHDFDataset(object):
-    """h5py Dataset-like wrapper for pandas HDFStore."""
+    """h5py Dataset-like wrapper for pandas HDFStore.
+
+    Parameters
+    ----------
+    hdf_store : pandas.HDFStore
+    key : str
+    lock : Optional[lock]
+        The lock acquired when accessing ``hdf_store``. PyTables is not thread-safe, so the
+        lock is required if the store is shared between threads.
+    """
 
-    def __init__(self, hdf_store, key):
+    def __init__(self, hdf_store, key, lock=None):
+        if lock is None:
+            lock = NoLock()
         self._hdf_store = hdf_store
-        self._storer = hdf_store.get_storer(key)
+        self._lock = lock
+        with self._lock:
+            self._storer = hdf_store.get_storer(key)
+            self.shape = get_shape_from_pandas_hdf_storer(self._storer)
         self.key = key
-        self.shape = get_shape_from_pandas_hdf_storer(self._storer)
 
     @property
     def value(self):
-        return self._hdf_store[self.key]
+        with self._lock:
+            return self._hdf_store[self.key]
 
     @property
     def dtype(self):
-        return self._hdf_store.select(self.key, start=0, stop=1).values.dtype
+        with self._lock:
+            return self._hdf_store.select(self.key, start=0, stop=1).values.dtype
 
     def select(self, *arg, **kwargs):
-        return self._hdf_store.select(self.key, *arg, **kwargs)
+        with self._lock:
+            return self._hdf_store.select(self.key, *arg, **kwargs)
 
     def select_column(self, *arg, **kwargs):
-        return self._hdf_store.select_column(self.key, *arg, **kwargs)
+        with self._lock:
+            return self._hdf_store.select_column(self.key, *arg, **kwargs)
 
     def select_as_coordinates(self, *arg, **kwargs):
-        return self._hdf_store.select_as_coordinates(self.key, *arg, **kwargs)
+        with self._lock:
+            return self._hdf_store.select_as_coordinates(self.key, *arg, **kwargs)
 
     def __getitem__(self, key):
         if key == ():
-            return self._hdf_store[self.key]
+            return self.value
         if isinstance(key, int):
-            return self._hdf_store.select(self.key, start=key, stop=key + 1)
+            return self.select(start=key, stop=key + 1)
         elif isinstance(key, slice):
             if key.step is None:
-                return self._hdf_store.select(self.key,
-                                              start=key.start, stop=key.stop)
+                return self.select(start=key.start, stop=key.stop)
         raise NotImplementedError("Key {} is not supported".format(key))
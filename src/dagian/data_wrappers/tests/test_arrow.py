@@ -0,0 +1,62 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from os.path import join
+from tempfile import mkdtemp
+import unittest
+from shutil import rmtree
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dagian.data_wrappers.arrow import ArrowDataset, write_arrow_file
+
+pytest.importorskip('pyarrow')
+
+
+class ArrowDatasetTest(unittest.TestCase):
+    def setUp(self):
+        self.test_output_dir = mkdtemp(prefix="dagian_test_output_")
+        self.df = pd.DataFrame({'a': np.arange(10), 'b': np.ones(10), 'c': list('abcdefghij')},
+                               index=np.arange(10) * 2)
+
+    def tearDown(self):
+        rmtree(self.test_output_dir)
+
+    def test_select(self):
+        path = join(self.test_output_dir, 'df.arrow')
+        write_arrow_file(self.df, path, batch_size=3)
+        dataset = ArrowDataset(path)
+        self.assertEqual(dataset.shape, (10, 3))
+        self.assertEqual(dataset.columns, ['a', 'b', 'c'])
+        pd.testing.assert_frame_equal(dataset[()], self.df)
+        pd.testing.assert_frame_equal(dataset[2:5], self.df.iloc[2:5])
+        pd.testing.assert_frame_equal(dataset.select(columns=['c', 'a'], start=8),
+                                      self.df[['c', 'a']].iloc[8:])
+        pd.testing.assert_series_equal(dataset.select_column('b', stop=2),
+                                       self.df['b'].iloc[:2])
+        with self.assertRaises(KeyError):
+            dataset.select(columns=['d'])
+        dataset.close()
+
+    def test_column_labels(self):
+        path = join(self.test_output_dir, 'df.arrow')
+        df = pd.DataFrame(np.arange(6).reshape(3, 2))
+        write_arrow_file(df, path)
+        dataset = ArrowDataset(path)
+        self.assertEqual(dataset.columns, list(dataset[()].columns))
+        self.assertEqual(dataset.columns, [0, 1])
+        pd.testing.assert_frame_equal(dataset.select(columns=[1]), df[[1]])
+        with self.assertRaises(KeyError):
+            dataset.select(columns=['1'])
+        dataset.close()
+
+    def test_series(self):
+        path = join(self.test_output_dir, 'series.arrow')
+        series = pd.Series(np.arange(4.0))
+        write_arrow_file(series, path)
+        dataset = ArrowDataset(path)
+        self.assertEqual(dataset.shape, (4,))
+        pd.testing.assert_series_equal(dataset.value, series)
+        pd.testing.assert_series_equal(dataset[1:3], series.iloc[1:3])
+        self.assertEqual(dataset.columns, [])
+        dataset.close()
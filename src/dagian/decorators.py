@@ -1,6 +1,7 @@
 from __future__ import print_function, division, absolute_import, unicode_literals
 import re
 
+import six
 from past.builtins import basestring
 
 from .data_definition import RequirementDefinition, Argument
@@ -35,11 +36,14 @@ def require(*args, **kwargs):
     return require_decorator
 
 
-def will_generate(data_handler, output_keys, **handler_kwargs):
+def will_generate(data_handler, output_keys, resources=None, **handler_kwargs):
     """
     Parameters
     ----------
     output_keys: Union[List[str], str]
+    resources: Optional[Mapping[str, float]]
+        The resources (e.g., ``{'memory_gb': 32, 'threads': 8}``) used by the function. When
+        generating concurrently, a node is started only when its resources fit the budgets.
     """
     if isinstance(output_keys, basestring):
         output_keys = (output_keys,)
@@ -48,6 +52,12 @@ def will_generate(data_handler, output_keys, **handler_kwargs):
         # pylint: disable=protected-access
         if not hasattr(func, '_dagian_output_configs'):
             func._dagian_output_configs = []
+        if not hasattr(func, '_dagian_resources'):
+            func._dagian_resources = {}
+        if resources is not None:
+            for name, amount in six.viewitems(resources):
+                func._dagian_resources[name] = max(
+                    amount, func._dagian_resources.get(name, amount))
         for output_key in output_keys:
             matched = DATA_KEY_PATTERN.match(output_key)
             if matched is None:
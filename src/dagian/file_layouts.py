@@ -0,0 +1,261 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from abc import ABCMeta, abstractmethod
+import hashlib
+import io
+import json
+import os
+import threading
+
+import six
+from pathlib2 import Path
+
+from .data_definition import DataDefinition
+
+
+# checking fewer data definitions than this number doesn't scan the whole directory
+BULK_EXISTS_THRESHOLD = 16
+
+
+class FileLayout(six.with_metaclass(ABCMeta, object)):
+    """Decide where the file of each data definition is stored.
+
+    Parameters
+    ----------
+    directory : Union[str, Path]
+        The root directory of the files.
+    suffix : str
+        The file name suffix, e.g., ``'.h5'``.
+    sidecar_suffixes : Sequence[str]
+        The suffixes appended to the file name of the other files stored with the data file,
+        which are moved together when migrating.
+    """
+
+    def __init__(self, directory, suffix, sidecar_suffixes=()):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.suffix = suffix
+        self.sidecar_suffixes = tuple(sidecar_suffixes)
+
+    @abstractmethod
+    def get_path(self, data_definition):
+        pass
+
+    def prepare_path(self, data_definition):
+        """Get the path for writing the data, creating the parent directories if needed."""
+        return self.get_path(data_definition)
+
+    def register(self, data_definition):
+        """Record that the file of ``data_definition`` has been written."""
+        pass
+
+    def exists(self, data_definition):
+        return self.get_path(data_definition).exists()
+
+    def remove(self, data_definition):
+        """Remove the file of ``data_definition`` and its sidecars, so it will be regenerated."""
+        path = self.get_path(data_definition)
+        for removed_path in [path] + [path.with_name(path.name + sidecar_suffix)
+                                      for sidecar_suffix in self.sidecar_suffixes]:
+            if removed_path.exists():
+                removed_path.unlink()
+
+    def get_version(self, data_definition):
+        """Get a string that changes when the file is rewritten, or None if it doesn't exist."""
+        try:
+            stat = os.stat(str(self.get_path(data_definition)))
+        except OSError:
+            return None
+        return "{}-{}".format(getattr(stat, 'st_mtime_ns', repr(stat.st_mtime)), stat.st_size)
+
+    def exists_many(self, data_definitions):
+        """Check ``exists()`` for multiple data definitions.
+
+        Returns
+        -------
+        exists_dict : Dict[DataDefinition, bool]
+        """
+        return {data_def: self.exists(data_def) for data_def in data_definitions}
+
+
+class JSONFileLayout(FileLayout):
+    """Use the JSON of the data definition as the file name in a flat directory."""
+
+    def get_path(self, data_definition):
+        return self.directory / (data_definition.to_json() + self.suffix)
+
+    def exists_many(self, data_definitions):
+        """Check the existence using a single directory scan."""
+        data_definitions = list(data_definitions)
+        if len(data_definitions) < BULK_EXISTS_THRESHOLD:
+            return super(JSONFileLayout, self).exists_many(data_definitions)
+        file_names = set(os.listdir(str(self.directory)))
+        return {data_def: self.get_path(data_def).name in file_names
+                for data_def in data_definitions}
+
+
+# the length of the hex digest of SHA-1
+HASH_LENGTH = 40
+
+
+def get_data_definition_hash(data_definition):
+    return hashlib.sha1(data_definition.to_json().encode('utf-8')).hexdigest()
+
+
+class HashedFileLayout(FileLayout):
+    """Use the hash of the data definition as the file name in prefix subdirectories.
+
+    The file of a data definition with hash ``abcdef...`` is stored as
+    ``ab/cd/abcdef...<suffix>``, so the file names are short and the directories stay small.
+    The mapping from the hashes to the data definitions is appended to ``manifest.tsv``,
+    which is also used to check the existence of many data definitions at once without
+    touching the files. Use ``remove()`` to delete the files, which records the removal in the
+    manifest, or call ``sync_manifest()`` after deleting the files by hand.
+    """
+    manifest_name = 'manifest.tsv'
+
+    def __init__(self, directory, suffix, sidecar_suffixes=()):
+        super(HashedFileLayout, self).__init__(directory, suffix, sidecar_suffixes)
+        self.manifest_path = self.directory / self.manifest_name
+        self._manifest_lock = threading.Lock()
+
+    def __getstate__(self):
+        # locks can't be pickled
+        state = self.__dict__.copy()
+        del state['_manifest_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._manifest_lock = threading.Lock()
+
+    def _get_path_from_hash(self, data_hash):
+        return self.directory / data_hash[:2] / data_hash[2:4] / (data_hash + self.suffix)
+
+    def get_path(self, data_definition):
+        return self._get_path_from_hash(get_data_definition_hash(data_definition))
+
+    def prepare_path(self, data_definition):
+        path = self.get_path(data_definition)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return path
+
+    def _append_manifest_line(self, data_hash, data_definition_json):
+        line = "{}\t{}\n".format(data_hash, data_definition_json).encode('utf-8')
+        with self._manifest_lock, io.open(str(self.manifest_path), 'ab+') as fp:
+            fp.seek(0, os.SEEK_END)
+            if fp.tell() > 0:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b'\n':
+                    # end the line torn by a killed process
+                    line = b'\n' + line
+            fp.write(line)
+
+    def register(self, data_definition):
+        self._append_manifest_line(get_data_definition_hash(data_definition),
+                                   data_definition.to_json())
+
+    def remove(self, data_definition):
+        super(HashedFileLayout, self).remove(data_definition)
+        # an empty data definition marks the removal
+        self._append_manifest_line(get_data_definition_hash(data_definition), "")
+
+    def read_manifest(self):
+        """Read the manifest.
+
+        Returns
+        -------
+        manifest : Dict[str, str]
+            The mapping from the hashes to the JSON of the data definitions.
+        """
+        manifest = {}
+        if not self.manifest_path.exists():
+            return manifest
+        with io.open(str(self.manifest_path), encoding='utf-8') as fp:
+            for line in fp:
+                fields = line.rstrip('\n').split('\t', 1)
+                if len(fields) != 2 or len(fields[0]) != HASH_LENGTH:
+                    # e.g., the line torn by a killed process
+                    continue
+                data_hash, data_definition_json = fields
+                if data_definition_json:
+                    manifest[data_hash] = data_definition_json
+                else:
+                    manifest.pop(data_hash, None)
+        return manifest
+
+    def sync_manifest(self):
+        """Rewrite the manifest with only the existing files, e.g., after deleting files by hand.
+
+        Returns
+        -------
+        n_removed : int
+            The number of the removed data definitions.
+        """
+        manifest = self.read_manifest()
+        lines = ["{}\t{}\n".format(data_hash, data_definition_json)
+                 for data_hash, data_definition_json in sorted(six.viewitems(manifest))
+                 if self._get_path_from_hash(data_hash).exists()]
+        temp_manifest_path = self.manifest_path.with_name(self.manifest_name + '.tmp')
+        with self._manifest_lock:
+            with io.open(str(temp_manifest_path), 'w', encoding='utf-8') as fp:
+                fp.writelines(lines)
+            # os.replace() is not available in Python 2
+            getattr(os, 'replace', os.rename)(str(temp_manifest_path), str(self.manifest_path))
+        return len(manifest) - len(lines)
+
+    def exists_many(self, data_definitions):
+        """Check the existence using the manifest instead of the file system."""
+        data_definitions = list(data_definitions)
+        if len(data_definitions) < BULK_EXISTS_THRESHOLD:
+            return super(HashedFileLayout, self).exists_many(data_definitions)
+        manifest = self.read_manifest()
+        return {data_def: get_data_definition_hash(data_def) in manifest
+                for data_def in data_definitions}
+
+    def migrate_from_json_layout(self):
+        """Move the files written with ``JSONFileLayout`` in the directory into this layout.
+
+        Returns
+        -------
+        n_migrated : int
+            The number of migrated files.
+        """
+        n_migrated = 0
+        for path in list(self.directory.iterdir()):
+            if not path.is_file() or not path.name.endswith(self.suffix):
+                continue
+            try:
+                raw_data_definition = json.loads(path.name[:-len(self.suffix)])
+            except ValueError:
+                continue
+            data_definition = DataDefinition(raw_data_definition['key'],
+                                             raw_data_definition['args'])
+            new_path = self.prepare_path(data_definition)
+            for sidecar_suffix in self.sidecar_suffixes:
+                sidecar_path = path.with_name(path.name + sidecar_suffix)
+                if sidecar_path.exists():
+                    sidecar_path.rename(new_path.with_name(new_path.name + sidecar_suffix))
+            path.rename(new_path)
+            self.register(data_definition)
+            n_migrated += 1
+        return n_migrated
+
+
+FILE_LAYOUT_CLASSES = {
+    'json': JSONFileLayout,
+    'hashed': HashedFileLayout,
+}
+
+
+def get_file_layout(layout, directory, suffix, sidecar_suffixes=()):
+    """Build a file layout.
+
+    Parameters
+    ----------
+    layout : str
+        ``'json'`` or ``'hashed'``.
+    """
+    if layout not in FILE_LAYOUT_CLASSES:
+        raise ValueError("layout should be one of {}, but got {!r}."
+                         .format(sorted(FILE_LAYOUT_CLASSES), layout))
+    return FILE_LAYOUT_CLASSES[layout](directory, suffix, sidecar_suffixes)
@@ -0,0 +1,413 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import Counter
+import multiprocessing
+import sys
+from concurrent.futures import (
+    Future,
+    ThreadPoolExecutor,
+    ProcessPoolExecutor,
+    wait,
+    FIRST_COMPLETED,
+)
+import uuid
+
+import six
+import networkx as nx
+
+from .data_handlers import DataHandler
+
+
+EXECUTORS = ('thread', 'process')
+
+# the data generators rebuilt in the worker process
+_subprocess_data_generators = {}
+# ProcessPoolExecutor supports initializer since Python 3.7
+POOL_INITIALIZER_SUPPORTED = sys.version_info >= (3, 7)
+
+
+def _init_subprocess(generator_id, generator_class, init_args, init_kwargs):
+    _subprocess_data_generators.clear()
+    _subprocess_data_generators[generator_id] = generator_class(*init_args, **init_kwargs)
+
+
+def _generate_one_in_subprocess(generator_id, generator_init, dag, data_definitions, func_name,
+                                output_configs, shipped_data):
+    # pylint: disable=protected-access
+    if generator_id not in _subprocess_data_generators:
+        # without the initializer of the executor, the constructor arguments are shipped with
+        # each node
+        _init_subprocess(generator_id, *generator_init)
+    data_generator = _subprocess_data_generators[generator_id]
+    # the read-only files are kept open for the following nodes in this worker
+    data_generator._generate_one(dag, data_definitions, func_name, output_configs,
+                                 close_all=False, shipped_data=shipped_data)
+    data_generator.limit_open_files()
+
+
+def _get_subprocess_init_arg(value):
+    """Replace the handlers in a constructor argument with ``copy_without_data()``."""
+    if isinstance(value, DataHandler):
+        return value.copy_without_data()
+    if isinstance(value, dict):
+        return {key: _get_subprocess_init_arg(item) for key, item in six.viewitems(value)}
+    return value
+
+
+def get_remaining_path_lengths(dag, nodes):
+    """Get the number of nodes on the longest path from each node to the root.
+
+    Parameters
+    ----------
+    dag : networkx.DiGraph
+    nodes : Sequence
+        The nodes that need to be generated, in topological order. Other nodes are not counted.
+
+    Returns
+    -------
+    path_lengths : Dict[object, int]
+    """
+    path_lengths = {}
+    for node in reversed(nodes):
+        path_lengths[node] = 1 + max(
+            [path_lengths[succ] for succ in dag.succ[node] if succ in path_lengths] or [0])
+    return path_lengths
+
+
+def get_upstream_dag(dag, node):
+    """Get the minimal DAG that contains a node and the data definitions it requires."""
+    upstream_dag = nx.DiGraph()
+    upstream_dag.add_node(node)
+    for pred, edge_attrs in six.viewitems(dag.pred[node]):
+        upstream_dag.add_node(pred, output_configs=dag.nodes[pred]['output_configs'])
+        upstream_dag.add_edge(pred, node, data_definitions=edge_attrs['data_definitions'])
+    return upstream_dag
+
+
+class DataReleaser(object):
+    """Release the resources of the data as soon as all the nodes consuming them finish.
+
+    The consumers of a data definition are the non-skipped nodes having it on their in-edges
+    in the involved DAG. When the last consumer finishes, the files opened for the data are
+    closed by ``close_data()`` of its handler. If ``release_memory`` is True, the
+    non-persistent data (e.g., ``memory``) generated in this run are also released by
+    ``release_data()``, except the requested data (on the in-edges of the root node) and the
+    data in ``keep``. The non-persistent outputs without any consumer (e.g., the other outputs
+    of a multi-output node) are released right after they are generated.
+
+    Parameters
+    ----------
+    data_generator : DataGenerator
+    involved_dag : networkx.DiGraph
+        The DAG built by ``DataGenerator.build_involved_dag()``.
+    generation_order : Sequence
+        The topological order of the nodes in ``involved_dag`` (without the root node).
+    release_memory : bool
+    keep : Iterable[DataDefinition]
+    """
+
+    def __init__(self, data_generator, involved_dag, generation_order, release_memory=False,
+                 keep=()):
+        self.data_generator = data_generator
+        keep = set(keep)
+        nodes = [node for node in generation_order if not involved_dag.nodes[node]['skipped']]
+        generation_set = set(generation_order)
+        # the handler names of all the data in the DAG
+        self._handler_names = {}
+        for node in generation_order:
+            output_configs = involved_dag.nodes[node]['output_configs']
+            for succ, edge_attrs in six.viewitems(involved_dag.succ[node]):
+                for data_definition in edge_attrs['data_definitions']:
+                    self._handler_names[data_definition] = (
+                        output_configs[data_definition.key]['handler'])
+                if succ not in generation_set:
+                    # the root node
+                    keep.update(edge_attrs['data_definitions'])
+
+        # the non-persistent outputs of each node to be released
+        self._released_outputs = {}
+        for node in nodes:
+            outputs = []
+            if release_memory:
+                for key, config in six.viewitems(involved_dag.nodes[node]['output_configs']):
+                    data_definition = node.replace(key=key)
+                    if (data_definition not in keep
+                            and not self._get_handler(config['handler']).persistent):
+                        outputs.append(data_definition)
+                        self._handler_names[data_definition] = config['handler']
+            self._released_outputs[node] = outputs
+        self._releasable_data = set(data_definition
+                                    for outputs in six.viewvalues(self._released_outputs)
+                                    for data_definition in outputs)
+
+        # the data consumed by each node
+        self._consumed_data = {}
+        self._n_consumers = Counter()
+        for node in nodes:
+            consumed_data = set()
+            for edge_attrs in six.viewvalues(involved_dag.pred[node]):
+                consumed_data.update(edge_attrs['data_definitions'])
+            self._consumed_data[node] = consumed_data
+            self._n_consumers.update(consumed_data)
+
+    def _get_handler(self, handler_name):
+        return self.data_generator._handlers[handler_name]  # pylint: disable=protected-access
+
+    def _release(self, data_definition):
+        handler = self._get_handler(self._handler_names[data_definition])
+        with handler.io_lock:
+            handler.close_data(data_definition)
+            if data_definition in self._releasable_data:
+                self._releasable_data.remove(data_definition)
+                handler.release_data(data_definition)
+
+    def finish(self, node):
+        """Release the data whose consumers have all finished after generating a node."""
+        for data_definition in self._released_outputs[node]:
+            if self._n_consumers[data_definition] == 0:
+                self._release(data_definition)
+        for data_definition in self._consumed_data[node]:
+            self._n_consumers[data_definition] -= 1
+            if self._n_consumers[data_definition] == 0:
+                self._release(data_definition)
+
+
+class ConcurrentScheduler(object):
+    """Dispatch the non-skipped nodes of an involved DAG as soon as their predecessors finish.
+
+    Parameters
+    ----------
+    data_generator : DataGenerator
+        The generator whose nodes will be generated.
+    involved_dag : networkx.DiGraph
+        The DAG built by ``DataGenerator.build_involved_dag()``.
+    generation_order : Sequence
+        The topological order of the nodes in ``involved_dag`` (without the root node).
+    executor : str
+        The type of the executor, ``'thread'`` or ``'process'``. With ``'process'``, the nodes
+        writing to non-persistent handlers are generated in the main thread of this process,
+        so no lock is held by other threads when the worker processes are forked.
+    max_workers : Optional[int]
+        The maximum number of nodes generated at the same time. If None, use the number of
+        CPUs for ``'process'`` and ``min(32, n_cpus + 4)`` for ``'thread'``.
+    resources : Optional[Mapping[str, float]]
+        The resource budgets (e.g., ``{'memory_gb': 64, 'threads': 40}``). A node is started
+        only if the resources it declares in ``will_generate()`` fit the remaining budgets, or
+        if no other node is running. The resources without budgets are not limited.
+    data_releaser : Optional[DataReleaser]
+        If not None, it is notified when each node finishes.
+
+    Among the ready nodes, the ones on the longest remaining path to the root are started
+    first. After each node finishes, the read-only files beyond the limits of the handlers are
+    closed (see ``DataGenerator.limit_open_files()``) except the ones read by the running
+    nodes, and each worker process limits its own files after each node.
+
+    The nodes whose generator methods are coroutine functions are run on an event loop in a
+    background thread, and they are not counted in ``max_workers``. Their handler I/O is run in
+    the threads of the event loop, which may hold the locks, so with ``'process'`` the worker
+    processes are started by a fork server (see ``multiprocessing``) instead of forking this
+    process if there are such nodes.
+    """
+
+    def __init__(self, data_generator, involved_dag, generation_order, executor='thread',
+                 max_workers=None, resources=None, data_releaser=None):
+        if executor not in EXECUTORS:
+            raise ValueError("executor should be one of {}, but got {!r}."
+                             .format(EXECUTORS, executor))
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count()
+            if executor == 'thread':
+                max_workers = min(32, max_workers + 4)
+        self.data_generator = data_generator
+        self.involved_dag = involved_dag
+        self.executor = executor
+        self.max_workers = max_workers
+        self.resources = dict(resources) if resources is not None else {}
+        self.data_releaser = data_releaser
+
+        # count the unfinished predecessors of each node that needs to be generated
+        nodes = [node for node in generation_order
+                 if not involved_dag.nodes[node]['skipped']]
+        self._n_waiting_preds = {
+            node: sum(1 for pred in involved_dag.pred[node]
+                      if not involved_dag.nodes[pred]['skipped'])
+            for node in nodes
+        }
+        remaining_path_lengths = get_remaining_path_lengths(involved_dag, nodes)
+        self._priority_keys = {node: (-remaining_path_lengths[node], i)
+                               for i, node in enumerate(nodes)}
+        self._has_coroutines = any(self._is_coroutine(node) for node in nodes)
+        self._used_resources = Counter()
+        self._generator_id = uuid.uuid4().hex
+        self._thread_pool = None
+        self._process_pool = None
+        self._generator_init = None
+        self._event_loop_thread = None
+
+    def _get_handler(self, handler_name):
+        return self.data_generator._handlers[handler_name]  # pylint: disable=protected-access
+
+    def _is_pinned(self, node):
+        """Whether the node should be generated in this process."""
+        output_configs = self.involved_dag.nodes[node]['output_configs']
+        return any(not self._get_handler(config['handler']).persistent
+                   for config in six.viewvalues(output_configs))
+
+    def _get_shipped_data(self, node):
+        """Load the upstream data that can't be read by the worker processes."""
+        shipped_data = {}
+        for pred, edge_attrs in six.viewitems(self.involved_dag.pred[node]):
+            output_configs = self.involved_dag.nodes[pred]['output_configs']
+            for pred_def in edge_attrs['data_definitions']:
+                handler = self._get_handler(output_configs[pred_def.key]['handler'])
+                if not handler.persistent:
+                    with handler.io_lock:
+                        shipped_data[pred_def] = handler.get(pred_def)
+        return shipped_data
+
+    def _generate_pinned(self, node):
+        # pylint: disable=protected-access
+        node_attrs = self.involved_dag.nodes[node]
+        future = Future()
+        try:
+            self.data_generator._generate_one(
+                self.involved_dag, node, node_attrs['func_name'], node_attrs['output_configs'],
+                close_all=False)
+        except Exception as e:  # pylint: disable=broad-except
+            future.set_exception(e)
+        else:
+            future.set_result(None)
+        return future
+
+    def _is_coroutine(self, node):
+        return self.involved_dag.nodes[node].get('is_coroutine', False)
+
+    def _submit_coroutine(self, node):
+        from .coroutines import EventLoopThread, generate_one_async
+        if self._event_loop_thread is None:
+            if self.executor == 'process' and not POOL_INITIALIZER_SUPPORTED:
+                # the workers are forked when the first node is submitted before Python 3.7,
+                # so fork them before starting the threads of the event loop
+                self._start_process_pool()
+                self._process_pool.submit(int).result()
+            self._event_loop_thread = EventLoopThread()
+        node_attrs = self.involved_dag.nodes[node]
+        return self._event_loop_thread.submit(generate_one_async(
+            self.data_generator, self.involved_dag, node, node_attrs['func_name'],
+            node_attrs['output_configs']))
+
+    def _submit(self, node):
+        # pylint: disable=protected-access
+        node_attrs = self.involved_dag.nodes[node]
+        if self._is_coroutine(node):
+            return self._submit_coroutine(node)
+        if self.executor == 'thread':
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(max_workers=self.max_workers)
+            return self._thread_pool.submit(
+                self.data_generator._generate_one,
+                self.involved_dag, node, node_attrs['func_name'], node_attrs['output_configs'],
+                close_all=False)
+
+        if self._is_pinned(node):
+            return self._generate_pinned(node)
+        if self._process_pool is None:
+            self._start_process_pool()
+        return self._process_pool.submit(
+            _generate_one_in_subprocess, self._generator_id, self._generator_init,
+            get_upstream_dag(self.involved_dag, node), node, node_attrs['func_name'],
+            node_attrs['output_configs'], self._get_shipped_data(node))
+
+    def _start_process_pool(self):
+        # pylint: disable=protected-access
+        generator_init = (
+            type(self.data_generator),
+            tuple(_get_subprocess_init_arg(arg) for arg in self.data_generator._init_args),
+            _get_subprocess_init_arg(self.data_generator._init_kwargs))
+        if POOL_INITIALIZER_SUPPORTED:
+            pool_kwargs = {}
+            if self._has_coroutines and multiprocessing.get_start_method() == 'fork':
+                # don't fork the threads of the event loop
+                pool_kwargs['mp_context'] = multiprocessing.get_context('forkserver')
+            # the constructor arguments are shipped once to each worker
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_init_subprocess,
+                initargs=(self._generator_id,) + generator_init, **pool_kwargs)
+        else:
+            self._process_pool = ProcessPoolExecutor(max_workers=self.max_workers)
+            self._generator_init = generator_init
+
+    def _get_required_resources(self, node):
+        return self.involved_dag.nodes[node].get('resources', {})
+
+    def _fit_resources(self, node):
+        required_resources = self._get_required_resources(node)
+        return all(self._used_resources[name] + amount <= self.resources[name]
+                   for name, amount in six.viewitems(required_resources)
+                   if name in self.resources)
+
+    def _finish(self, node, ready_nodes):
+        self._used_resources.subtract(self._get_required_resources(node))
+        if self.data_releaser is not None:
+            self.data_releaser.finish(node)
+        for succ in self.involved_dag.succ[node]:
+            if succ not in self._n_waiting_preds:
+                # the root node
+                continue
+            self._n_waiting_preds[succ] -= 1
+            if self._n_waiting_preds[succ] == 0:
+                ready_nodes.append(succ)
+
+    def _limit_open_files(self, running_nodes):
+        """Limit the open files of this process, except the ones read by the running nodes."""
+        in_use = set()
+        for node in running_nodes:
+            for edge_attrs in six.viewvalues(self.involved_dag.pred[node]):
+                in_use.update(edge_attrs['data_definitions'])
+        self.data_generator.limit_open_files(in_use)
+
+    def _shutdown(self):
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                pool.shutdown(wait=True)
+        self._thread_pool = None
+        self._process_pool = None
+        if self._event_loop_thread is not None:
+            self._event_loop_thread.stop()
+            self._event_loop_thread = None
+
+    def _start_ready_nodes(self, ready_nodes, running_futures):
+        ready_nodes.sort(key=self._priority_keys.__getitem__)
+        n_workers = sum(1 for node in six.viewvalues(running_futures)
+                        if not self._is_coroutine(node))
+        for node in list(ready_nodes):
+            is_coroutine = self._is_coroutine(node)
+            if not is_coroutine and n_workers >= self.max_workers:
+                continue
+            if running_futures and not self._fit_resources(node):
+                continue
+            if not is_coroutine:
+                n_workers += 1
+            ready_nodes.remove(node)
+            self._used_resources.update(self._get_required_resources(node))
+            running_futures[self._submit(node)] = node
+
+    def run(self):
+        ready_nodes = [node for node, n_preds in six.viewitems(self._n_waiting_preds)
+                       if n_preds == 0]
+        running_futures = {}
+        try:
+            while ready_nodes or running_futures:
+                self._start_ready_nodes(ready_nodes, running_futures)
+                done_futures, _ = wait(running_futures, return_when=FIRST_COMPLETED)
+                for future in done_futures:
+                    node = running_futures.pop(future)
+                    future.result()
+                    self._finish(node, ready_nodes)
+                self._limit_open_files(six.viewvalues(running_futures))
+        except BaseException:
+            # don't start the queued nodes, but wait for the running ones
+            for future in running_futures:
+                future.cancel()
+            raise
+        finally:
+            self._shutdown()
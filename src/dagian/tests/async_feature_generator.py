@@ -0,0 +1,36 @@
+import asyncio
+
+import dagian
+from dagian.decorators import require, will_generate
+
+
+class AsyncFeatureGenerator(dagian.FeatureGenerator):
+
+    @will_generate('memory', 'query_1')
+    async def gen_query_1(self, context):
+        await asyncio.sleep(0.3)
+        return {'query_1': 1}
+
+    @will_generate('memory', 'query_2')
+    async def gen_query_2(self, context):
+        await asyncio.sleep(0.3)
+        return {'query_2': 2}
+
+    @will_generate('pickle', 'query_3')
+    async def gen_query_3(self, context):
+        await asyncio.sleep(0.3)
+        return {'query_3': 3}
+
+    @require('query_1')
+    @require('query_2')
+    @require('query_3')
+    @will_generate('memory', 'query_sum')
+    def gen_query_sum(self, context):
+        upstream_data = context['upstream_data']
+        return {'query_sum': (upstream_data['query_1'] + upstream_data['query_2']
+                              + upstream_data['query_3'])}
+
+    @require('query_3')
+    @will_generate('pickle', 'query_3_squared')
+    def gen_query_3_squared(self, context):
+        return {'query_3_squared': context['upstream_data']['query_3'] ** 2}
@@ -0,0 +1,73 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from os.path import join
+from tempfile import mkdtemp
+from shutil import rmtree
+import unittest
+
+import h5py
+import h5sparse
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from dagian import BundleReader
+
+
+N_ROWS = 1000
+
+
+class BundleReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.test_output_dir = mkdtemp(prefix="dagian_test_output_")
+        self.bundle_path = join(self.test_output_dir, 'bundle.h5')
+        self.features = np.arange(N_ROWS * 3, dtype=np.float32).reshape(N_ROWS, 3)
+        self.label = np.arange(N_ROWS) % 2
+        with h5sparse.File(self.bundle_path, 'w') as h5f:
+            h5f.create_dataset('features', data=self.features, chunks=(64, 3))
+            h5f.create_dataset('label', data=self.label)
+            h5f.create_dataset('others/sparse', data=sp.csr_matrix(self.features[:, :1] + 1))
+        pd.DataFrame({'a': self.label}).to_hdf(self.bundle_path, 'others/table')
+
+    def tearDown(self):
+        rmtree(self.test_output_dir)
+
+    def test_get(self):
+        with BundleReader(self.bundle_path) as reader:
+            self.assertEqual(reader.structure, {
+                'features': (N_ROWS, 3),
+                'label': (N_ROWS,),
+                'others': {'sparse': (N_ROWS, 1), 'table': None},
+            })
+            self.assertIsInstance(reader['label'], np.memmap)
+            self.assertIsInstance(reader['features'], h5py.Dataset)
+            self.assertIsInstance(reader['others/sparse'], h5sparse.Dataset)
+            pd.testing.assert_frame_equal(reader['others/table'],
+                                          pd.DataFrame({'a': self.label}))
+
+    def test_iter_batches(self):
+        with BundleReader(self.bundle_path) as reader:
+            batches = list(reader.iter_batches('features', 300))
+            self.assertEqual([len(batch) for batch in batches], [300, 300, 300, 100])
+            np.testing.assert_array_equal(np.concatenate(batches), self.features)
+            self.assertEqual(len(list(reader.iter_batches('label', 300, drop_last=True))), 3)
+
+            batches = list(reader.iter_batches(['features', 'label', 'others/sparse'], 64,
+                                               shuffle=True, shuffle_buffer_size=256,
+                                               random_state=0))
+        features = np.concatenate([batch['features'] for batch in batches])
+        row_ids = features[:, 0] // 3
+        self.assertFalse((np.diff(row_ids) > 0).all())
+        np.testing.assert_array_equal(np.sort(row_ids), np.arange(N_ROWS))
+        np.testing.assert_array_equal(np.concatenate([batch['label'] for batch in batches]),
+                                      self.label[row_ids.astype(int)])
+        sparse_features = sp.vstack([batch['others/sparse'] for batch in batches]).toarray()
+        np.testing.assert_array_equal(sparse_features[:, 0], features[:, 0] + 1)
+
+    def test_unchunked_sparse_block_rows(self):
+        with BundleReader(self.bundle_path) as reader:
+            sparse_dataset = reader['others/sparse']
+            self.assertIsNone(sparse_dataset.h5py_group['indptr'].chunks)
+            self.assertEqual(reader._get_block_rows([sparse_dataset]), N_ROWS)
+            batches = list(reader.iter_batches('others/sparse', 300))
+        self.assertEqual([batch.shape[0] for batch in batches], [300, 300, 300, 100])
+        np.testing.assert_array_equal(sp.vstack(batches).toarray(), self.features[:, :1] + 1)
@@ -0,0 +1,319 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from os.path import join
+from tempfile import mkdtemp
+from shutil import rmtree
+import unittest
+
+import os
+import time
+
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as sp
+
+import dagian
+from dagian import BundleReader
+from dagian.bundling import get_bundle_data_definitions, take_rows
+from dagian.data_definition import DataDefinition
+from dagian.decorators import require, will_generate
+
+
+N_ROWS = 10
+
+
+class TensorFeatureGenerator(dagian.FeatureGenerator):
+
+    @will_generate('memory', 'image')
+    def gen_image(self, context):
+        return {'image': np.arange(N_ROWS * 4 * 3 * 2, dtype=np.uint8).reshape(N_ROWS, 4, 3, 2)}
+
+    @will_generate('h5py', 'mask')
+    def gen_mask(self, context):
+        return {'mask': np.arange(N_ROWS * 4 * 3).reshape(N_ROWS, 4, 3, 1) % 2 == 0}
+
+    @will_generate('pandas_hdf', 'table')
+    def gen_table(self, context):
+        return {'table': pd.DataFrame({'a': np.arange(N_ROWS), 'b': np.ones(N_ROWS)})}
+
+    @will_generate('h5py', 'sparse')
+    def gen_sparse(self, context):
+        return {'sparse': sp.csr_matrix(np.eye(N_ROWS, 5))}
+
+    @require('mask')
+    @will_generate('h5py', 'scaled_mask')
+    def gen_scaled_mask(self, context, scale=2):
+        return {'scaled_mask': context['upstream_data']['mask'][()] * scale}
+
+    @will_generate('memory', 'names')
+    def gen_names(self, context):
+        return {'names': pd.DataFrame({'name': ['user_%d' % i for i in range(N_ROWS)]})}
+
+    @will_generate('memory', 'user_id')
+    def gen_user_id(self, context):
+        return {'user_id': np.arange(N_ROWS, dtype=np.int64) + 2 ** 40}
+
+    @will_generate('memory', 'is_active')
+    def gen_is_active(self, context):
+        return {'is_active': np.arange(N_ROWS) % 3 == 0}
+
+    @will_generate('memory', 'active_order')
+    def gen_active_order(self, context):
+        return {'active_order': np.array([2, 0, 3, 1])}
+
+
+class BundleTest(unittest.TestCase):
+    def setUp(self):
+        self.test_output_dir = mkdtemp(prefix="dagian_test_output_")
+        self.data_generator = TensorFeatureGenerator(
+            h5py_hdf_dir=join(self.test_output_dir, 'h5py'),
+            pandas_hdf_dir=join(self.test_output_dir, 'pandas'))
+        self.bundle_path = join(self.test_output_dir, 'bundle.h5')
+
+    def tearDown(self):
+        self.data_generator.close()
+        rmtree(self.test_output_dir)
+
+    def bundle(self, structure, **kwargs):
+        self.data_generator.generate(get_bundle_data_definitions(
+            structure, kwargs.get('structure_config') or {}))
+        self.data_generator.bundle(structure, self.bundle_path, **kwargs)
+
+    def test_concat_dtype(self):
+        structure = {'ids': ['user_id', 'is_active'], 'flags': ['is_active', 'is_active']}
+        self.bundle(structure, buffer_size=48, structure_config={
+            'ids': {'concat': True, 'dtype': 'promote'},
+            'flags': {'concat': True, 'dtype': 'uint8'},
+        })
+        with h5py.File(self.bundle_path, 'r') as h5f:
+            self.assertEqual(h5f['ids'].dtype, np.int64)
+            np.testing.assert_array_equal(h5f['ids'][:, 0], np.arange(N_ROWS) + 2 ** 40)
+            np.testing.assert_array_equal(h5f['ids'][:, 1], np.arange(N_ROWS) % 3 == 0)
+            self.assertEqual(h5f['flags'].dtype, np.uint8)
+
+    def test_concat_tensor(self):
+        structure = {'images': ['image', 'mask']}
+        self.bundle(structure, buffer_size=200, structure_config={
+            'images': {'concat': True, 'dtype': 'promote'}})
+        image = self.data_generator.get(DataDefinition('image'))
+        with h5py.File(self.bundle_path, 'r') as h5f:
+            self.assertEqual(h5f['images'].shape, (N_ROWS, 4, 3, 3))
+            self.assertEqual(h5f['images'].dtype, np.uint8)
+            np.testing.assert_array_equal(h5f['images'][..., :2], image)
+            np.testing.assert_array_equal(h5f['images'][..., 2:],
+                                          self.data_generator.get(DataDefinition('mask'))[()])
+
+    def test_row_selector(self):
+        structure = {'active': {'images': ['image', 'mask'], 'sparse': ['sparse', 'user_id'],
+                                'table': 'table'},
+                     'all': {'user_id': 'user_id'}}
+        structure_config = {
+            'active': {'row_selector': 'is_active', 'row_permutation': 'active_order',
+                       'images': {'concat': True, 'dtype': 'promote'},
+                       'sparse': {'concat': True, 'sparse': True}}}
+        self.bundle(structure, buffer_size=100, structure_config=structure_config)
+        rows = np.array([6, 0, 9, 3])
+        bundle_dir = join(self.test_output_dir, 'bundle_npy')
+        self.data_generator.bundle(structure, bundle_dir, buffer_size=100,
+                                   structure_config=structure_config, bundle_format='npy')
+        np.testing.assert_array_equal(np.load(join(bundle_dir, 'active', 'images.npy'))[..., :2],
+                                      self.data_generator.get(DataDefinition('image'))[rows])
+        np.testing.assert_array_equal(
+            sp.load_npz(join(bundle_dir, 'active', 'sparse.npz')).toarray()[:, :5],
+            np.eye(N_ROWS, 5)[rows])
+        self.assertFalse([name for name in os.listdir(self.test_output_dir)
+                          if name.startswith('.dagian_')])
+        image = self.data_generator.get(DataDefinition('image'))
+        with h5py.File(self.bundle_path, 'r') as h5f:
+            np.testing.assert_array_equal(h5f['active/images'][..., :2], image[rows])
+            self.assertEqual(h5f['all/user_id'].shape, (N_ROWS,))
+        with BundleReader(self.bundle_path) as reader:
+            np.testing.assert_array_equal(
+                reader['active/sparse'][()].toarray()[:, :5], np.eye(N_ROWS, 5)[rows])
+            np.testing.assert_array_equal(reader['active/table']['a'], rows)
+
+    def test_take_rows(self):
+        data = np.arange(N_ROWS * 2).reshape(N_ROWS, 2)
+        row_indices = np.array([7, 1, 8, 2, 2])
+        for max_span in (1, 3, N_ROWS):
+            np.testing.assert_array_equal(take_rows(data, row_indices, max_span),
+                                          data[row_indices])
+            np.testing.assert_array_equal(
+                take_rows(sp.csr_matrix(data), row_indices, max_span).toarray(),
+                data[row_indices])
+            np.testing.assert_array_equal(
+                take_rows(pd.DataFrame(data), row_indices, max_span).values, data[row_indices])
+
+    def test_incremental_bundle(self):
+        written_dset_names = []
+        write_bundle_entry = self.data_generator._write_bundle_entry
+
+        def record_write_bundle_entry(entry, *args):
+            written_dset_names.append(entry.dset_name)
+            write_bundle_entry(entry, *args)
+
+        self.data_generator._write_bundle_entry = record_write_bundle_entry
+        structure = {'mask': 'mask', 'table': 'table', 'ids': ['user_id', 'is_active'],
+                     'images': ['image', 'mask'], 'scaled_mask': 'scaled_mask'}
+        structure_config = {'ids': {'concat': True}}
+        self.bundle(structure, structure_config=structure_config)
+        self.assertEqual(sorted(written_dset_names),
+                         ['/ids', '/images/image', '/images/mask', '/mask', '/scaled_mask',
+                          '/table'])
+
+        # the data in memory are always rewritten
+        del written_dset_names[:]
+        self.bundle(structure, structure_config=structure_config)
+        self.assertEqual(sorted(written_dset_names), ['/ids', '/images/image'])
+
+        # rewrite the mask and remove table
+        mask_path = self.data_generator.get_handler('mask').layout.get_path(
+            DataDefinition('mask'))
+        self.data_generator.close()
+        os.remove(str(mask_path))
+        del written_dset_names[:]
+        del structure['table']
+        self.bundle(structure, structure_config=structure_config)
+        self.assertEqual(sorted(written_dset_names),
+                         ['/ids', '/images/image', '/images/mask', '/mask'])
+        with h5py.File(self.bundle_path, 'r') as h5f:
+            self.assertEqual(set(h5f), {'mask', 'ids', 'images', 'scaled_mask'})
+            self.assertEqual(h5f['ids'].shape, (N_ROWS, 2))
+
+    def test_parallel_bundle(self):
+        structure = {'mask': 'mask', 'table': 'table', 'others': ['user_id', 'is_active'],
+                     'images': ['image', 'mask']}
+        structure_config = {'images': {'concat': True}}
+        self.bundle(structure, structure_config=structure_config)
+        parallel_bundle_path = join(self.test_output_dir, 'parallel.h5')
+        self.data_generator.bundle(structure, parallel_bundle_path,
+                                   structure_config=structure_config, n_readers=3)
+
+        with h5py.File(self.bundle_path, 'r') as h5f, \
+                h5py.File(parallel_bundle_path, 'r') as parallel_h5f:
+            for dset_name in ('mask', 'others/user_id', 'others/is_active', 'images'):
+                np.testing.assert_array_equal(parallel_h5f[dset_name][()], h5f[dset_name][()])
+        pd.testing.assert_frame_equal(pd.read_hdf(parallel_bundle_path, 'table'),
+                                      self.data_generator.get(DataDefinition('table'))[()])
+
+    def test_parallel_bundle_overlaps_reads_and_writes(self):
+        handler = self.data_generator.get_handler('mask')
+        read_intervals = []
+        write_intervals = []
+
+        def record_interval(function, intervals):
+            def recorded_function(*args):
+                start = time.time()
+                time.sleep(0.1)
+                result = function(*args)
+                intervals.append((start, time.time()))
+                return result
+            return recorded_function
+
+        handler.prepare_bundle_data = record_interval(handler.prepare_bundle_data,
+                                                      read_intervals)
+        handler.write_bundle_data = record_interval(handler.write_bundle_data, write_intervals)
+        # the same data in several entries are only closed after the last one
+        structure = {'a': 'mask', 'b': 'scaled_mask', 'c': 'sparse', 'd': 'mask'}
+        self.bundle(structure, n_readers=2)
+
+        self.assertEqual(len(read_intervals), 4)
+        self.assertEqual(len(write_intervals), 4)
+        self.assertTrue(any(read_start < write_end and write_start < read_end
+                            for read_start, read_end in read_intervals
+                            for write_start, write_end in write_intervals))
+        with h5py.File(self.bundle_path, 'r') as h5f:
+            np.testing.assert_array_equal(h5f['d'][()], h5f['a'][()])
+            np.testing.assert_array_equal(h5f['b'][()], h5f['a'][()] * 2)
+
+    def check_directory_bundle(self, bundle_format):
+        structure = {'mask': 'mask', 'table': 'table', 'others': ['user_id', 'sparse'],
+                     'images': ['image', 'mask'], 'all_sparse': ['sparse', 'is_active']}
+        structure_config = {'images': {'concat': True},
+                            'all_sparse': {'concat': True, 'sparse': True}}
+        self.bundle(structure, structure_config=structure_config)
+        bundle_dir = join(self.test_output_dir, 'bundle_' + bundle_format)
+        self.data_generator.bundle(structure, bundle_dir, buffer_size=100,
+                                   structure_config=structure_config,
+                                   bundle_format=bundle_format)
+
+        with h5py.File(self.bundle_path, 'r') as h5f:
+            for dset_name in ('mask', 'others/user_id', 'images'):
+                data = np.load(join(bundle_dir, dset_name + '.npy'), mmap_mode='r')
+                self.assertIsInstance(data, np.memmap)
+                np.testing.assert_array_equal(data, h5f[dset_name][()])
+        with BundleReader(self.bundle_path) as reader:
+            for dset_name in ('others/sparse', 'all_sparse'):
+                np.testing.assert_array_equal(
+                    sp.load_npz(join(bundle_dir, dset_name + '.npz')).toarray(),
+                    reader[dset_name][()].toarray())
+        table = self.data_generator.get(DataDefinition('table'))[()]
+        return bundle_dir, table
+
+    def test_npy_bundle(self):
+        bundle_dir, table = self.check_directory_bundle('npy')
+        records = np.load(join(bundle_dir, 'table.npy'), mmap_mode='r')
+        pd.testing.assert_frame_equal(pd.DataFrame.from_records(records), table)
+
+        # only the data in memory are rewritten
+        mask_mtime = os.stat(join(bundle_dir, 'mask.npy')).st_mtime
+        self.data_generator.bundle({'mask': 'mask', 'others': ['user_id']}, bundle_dir,
+                                   bundle_format='npy')
+        self.assertEqual(os.stat(join(bundle_dir, 'mask.npy')).st_mtime, mask_mtime)
+        self.assertFalse(os.path.exists(join(bundle_dir, 'table.npy')))
+        self.assertTrue(os.path.exists(join(bundle_dir, 'others', 'user_id.npy')))
+
+    def test_directory_bundle_reads_tables_in_batches(self):
+        handler = self.data_generator.get_handler('table')
+        get = handler.get
+        selected_ranges = []
+
+        def get_recorded_dataset(data_definition):
+            dataset = get(data_definition)
+            select = dataset.select
+
+            def recorded_select(*args, **kwargs):
+                selected_ranges.append((kwargs.get('start'), kwargs.get('stop')))
+                return select(*args, **kwargs)
+            dataset.select = recorded_select
+            return dataset
+
+        handler.get = get_recorded_dataset
+        self.bundle({'table': 'table'})
+        bundle_dir = join(self.test_output_dir, 'bundle_npy')
+        self.data_generator.bundle({'table': 'table'}, bundle_dir, buffer_size=48,
+                                   bundle_format='npy')
+        # the first row estimates the batch size, and each batch has 3 rows of 16 bytes
+        self.assertEqual(selected_ranges, [(0, 1), (0, 3), (3, 6), (6, 9), (9, 12)])
+        records = np.load(join(bundle_dir, 'table.npy'), mmap_mode='r')
+        pd.testing.assert_frame_equal(pd.DataFrame.from_records(records),
+                                      self.data_generator.get(DataDefinition('table'))[()])
+
+    def test_npy_bundle_object_columns(self):
+        self.data_generator.generate([DataDefinition('names')])
+        bundle_dir = join(self.test_output_dir, 'bundle_npy')
+        with self.assertRaises(ValueError):
+            self.data_generator.bundle({'names': 'names'}, bundle_dir, bundle_format='npy')
+
+    def test_arrow_bundle(self):
+        pa = pytest.importorskip('pyarrow')
+        bundle_dir, table = self.check_directory_bundle('arrow')
+        reader = pa.ipc.open_file(pa.memory_map(join(bundle_dir, 'table.arrow')))
+        self.assertGreater(reader.num_record_batches, 1)
+        pd.testing.assert_frame_equal(reader.read_pandas(), table)
+
+        # the object columns are written as Arrow strings
+        self.data_generator.generate([DataDefinition('names')])
+        self.data_generator.bundle({'names': 'names'}, bundle_dir, buffer_size=16,
+                                   bundle_format='arrow')
+        reader = pa.ipc.open_file(pa.memory_map(join(bundle_dir, 'names.arrow')))
+        self.assertGreater(reader.num_record_batches, 1)
+        pd.testing.assert_frame_equal(reader.read_pandas(),
+                                      self.data_generator.get(DataDefinition('names')))
+
+        # changing the format rewrites the DataFrames
+        self.data_generator.bundle({'table': 'table'}, bundle_dir, bundle_format='npy')
+        self.assertFalse(os.path.exists(join(bundle_dir, 'table.arrow')))
+        records = np.load(join(bundle_dir, 'table.npy'))
+        pd.testing.assert_frame_equal(pd.DataFrame.from_records(records), table)
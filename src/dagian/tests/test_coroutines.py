@@ -0,0 +1,44 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from tempfile import mkdtemp
+from shutil import rmtree
+import time
+
+import pytest
+import six
+
+from dagian.data_definition import DataDefinition
+
+if six.PY2:
+    pytest.skip("async def is not supported in Python 2", allow_module_level=True)
+
+from dagian.tests.async_feature_generator import AsyncFeatureGenerator  # noqa: E402
+
+
+@pytest.mark.parametrize('executor', [None, 'thread'])
+def test_generate_coroutines_concurrently(executor):
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    data_generator = AsyncFeatureGenerator(pickle_dir=test_output_dir)
+    start_time = time.time()
+    data_generator.generate([DataDefinition('query_sum')], executor=executor)
+    assert time.time() - start_time < 0.8
+    assert data_generator.get(DataDefinition('query_sum')) == 6
+    rmtree(test_output_dir)
+
+
+def test_generate_coroutines_with_process_executor():
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    data_generator = AsyncFeatureGenerator(pickle_dir=test_output_dir)
+    start_time = time.time()
+    data_generator.generate([DataDefinition('query_sum')], executor='process')
+    assert time.time() - start_time < 0.8
+    assert data_generator.get(DataDefinition('query_sum')) == 6
+
+    rmtree(test_output_dir)
+
+    # the worker processes don't inherit the threads of the event loop
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    data_generator = AsyncFeatureGenerator(pickle_dir=test_output_dir)
+    data_generator.generate([DataDefinition('query_sum'), DataDefinition('query_3_squared')],
+                            executor='process')
+    assert data_generator.get(DataDefinition('query_3_squared')) == 9
+    rmtree(test_output_dir)
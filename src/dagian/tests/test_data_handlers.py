@@ -0,0 +1,364 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from os.path import join
+import os
+import pickle
+from tempfile import mkdtemp
+from shutil import rmtree
+import unittest
+
+import h5py
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.sparse as ss
+from pathlib2 import Path
+
+from dagian.data_definition import DataDefinition
+from dagian.data_handlers import (
+    ArrowDataHandler,
+    CachedDataHandler,
+    H5pyDataHandler,
+    MemoryDataHandler,
+    NpyDataHandler,
+    PickleDataHandler,
+    get_row_chunks,
+)
+
+
+class FileDataHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.test_output_dir = mkdtemp(prefix="dagian_test_output_")
+
+    def tearDown(self):
+        rmtree(self.test_output_dir)
+
+    def check_can_skip_many(self, handler):
+        data_definitions = [DataDefinition('feature', {'i': i}) for i in range(40)]
+        for data_definition in data_definitions[::3]:
+            handler.write_data(data_definition, np.arange(3))
+        expected = {data_def: i % 3 == 0 for i, data_def in enumerate(data_definitions)}
+        self.assertDictEqual(handler.can_skip_many(data_definitions), expected)
+        self.assertDictEqual(handler.can_skip_many(data_definitions[:2]),
+                             {data_definitions[0]: True, data_definitions[1]: False})
+
+        # removing a file forces the regeneration
+        handler.layout.remove(data_definitions[3])
+        expected[data_definitions[3]] = False
+        self.assertDictEqual(handler.can_skip_many(data_definitions), expected)
+        self.assertFalse(handler.can_skip(data_definitions[3]))
+
+    def test_h5py_can_skip_many(self):
+        self.check_can_skip_many(H5pyDataHandler(self.test_output_dir))
+        self.check_can_skip_many(H5pyDataHandler(join(self.test_output_dir, 'hashed'),
+                                                 layout='hashed'))
+
+    def test_pickle_can_skip_many(self):
+        self.check_can_skip_many(PickleDataHandler(self.test_output_dir))
+        self.check_can_skip_many(PickleDataHandler(join(self.test_output_dir, 'hashed'),
+                                                   layout='hashed'))
+
+    def test_cached_handler(self):
+        handler = CachedDataHandler(PickleDataHandler(self.test_output_dir), max_bytes=2500)
+        data_definitions = [DataDefinition('feature', {'i': i}) for i in range(3)]
+        for i, data_definition in enumerate(data_definitions):
+            handler.write_data(data_definition, {'values': np.arange(100) + i})
+        data = handler.get(data_definitions[0])
+        self.assertIs(handler.get(data_definitions[0]), data)
+        self.assertEqual((handler.hits, handler.misses), (1, 1))
+
+        # the least recently used data is evicted
+        handler.get(data_definitions[1:])
+        handler.get(data_definitions[1])
+        self.assertEqual((handler.hits, handler.misses), (2, 3))
+        self.assertNotIn(data_definitions[0], handler.cache)
+
+        # rewriting invalidates the cache
+        handler.layout.get_path(data_definitions[1]).unlink()
+        handler.write_data(data_definitions[1], 'new')
+        self.assertEqual(handler.get(data_definitions[1]), 'new')
+
+        # the lazy datasets are not cached
+        h5py_handler = CachedDataHandler(H5pyDataHandler(self.test_output_dir), max_bytes=2000)
+        h5py_handler.write_data(DataDefinition('dense'), np.arange(3))
+        h5py_handler.get(DataDefinition('dense'))
+        self.assertEqual(len(h5py_handler.cache), 0)
+
+        # the handler is pickled without the cached data and the opened files
+        handler.get(data_definitions[2])
+        for cached_handler in (handler, h5py_handler):
+            unpickled_handler = pickle.loads(pickle.dumps(cached_handler))
+            self.assertIsInstance(unpickled_handler.handler, type(cached_handler.handler))
+            self.assertIs(unpickled_handler.io_lock, cached_handler.io_lock)
+            self.assertEqual(len(unpickled_handler.cache), 0)
+        np.testing.assert_array_equal(unpickled_handler.get(DataDefinition('dense'))[()],
+                                      np.arange(3))
+        unpickled_handler.close()
+        h5py_handler.close()
+
+    def test_limit_open_files(self):
+        handler = H5pyDataHandler(self.test_output_dir, max_open_files=2)
+        data_definitions = [DataDefinition('feature', {'i': i}) for i in range(3)]
+        for data_definition in data_definitions:
+            handler.write_data(data_definition, np.arange(3))
+            handler.get(data_definition)
+        handler.get(data_definitions[0])
+        context = {}
+        handler.update_context(context, DataDefinition('context'),
+                               create_dataset_context='create_dataset')
+        handler.limit_open_files()
+        # the file being written is not counted
+        self.assertEqual(list(handler.h5f_dict),
+                         [data_definitions[2], data_definitions[0], DataDefinition('context')])
+        handler.close()
+
+    def test_pickle_out_of_band_buffers(self):
+        data_definition = DataDefinition('split', {'i': 0})
+        data = {'train': np.arange(1000), 'test': np.arange(3), 'name': 'split'}
+        # the buffers are pickled in-band by default
+        handler = PickleDataHandler(join(self.test_output_dir, 'in_band'))
+        handler.write_data(data_definition, data)
+        pickle_path = handler.layout.get_path(data_definition)
+        self.assertFalse(pickle_path.with_name(pickle_path.name + '.buffers').exists())
+        with pickle_path.open('rb') as fp:
+            np.testing.assert_array_equal(pickle.load(fp)['train'], data['train'])
+
+        handler = PickleDataHandler(self.test_output_dir, layout='hashed',
+                                    min_out_of_band_bytes=1024)
+        handler.write_data(data_definition, data)
+        pickle_path = handler.layout.get_path(data_definition)
+        buffers_path = pickle_path.with_name(pickle_path.name + '.buffers')
+        self.assertEqual(buffers_path.exists(), pickle.HIGHEST_PROTOCOL >= 5)
+
+        # the sidecar files are moved when migrating
+        if buffers_path.exists():
+            json_handler = PickleDataHandler(join(self.test_output_dir, 'json'))
+            json_path = json_handler.layout.get_path(data_definition)
+            pickle_path.rename(json_path)
+            buffers_path.rename(json_path.with_name(json_path.name + '.buffers'))
+            handler = PickleDataHandler(join(self.test_output_dir, 'json'), layout='hashed')
+            self.assertEqual(handler.layout.migrate_from_json_layout(), 1)
+
+        loaded_data = handler.get(data_definition)
+        np.testing.assert_array_equal(loaded_data['train'], data['train'])
+        np.testing.assert_array_equal(loaded_data['test'], data['test'])
+        self.assertEqual(loaded_data['name'], 'split')
+
+        # the memory-mapped arrays are copy-on-write
+        loaded_data['train'] += 1
+        loaded_data['test'] += 1
+        np.testing.assert_array_equal(handler.get(data_definition)['train'], data['train'])
+        df = pd.DataFrame({'a': np.arange(1000.0)})
+        handler.write_data(DataDefinition('df'), df)
+        loaded_df = handler.get(DataDefinition('df'))
+        loaded_df.loc[0, 'a'] = -1.0
+        self.assertEqual(loaded_df['a'][0], -1.0)
+        pd.testing.assert_frame_equal(handler.get(DataDefinition('df')), df)
+
+    def test_npy_can_skip_many(self):
+        self.check_can_skip_many(NpyDataHandler(self.test_output_dir))
+
+    def test_npy(self):
+        handler = NpyDataHandler(self.test_output_dir)
+        data = np.arange(12, dtype=np.float32).reshape(3, 4)
+        handler.write_data(DataDefinition('dense'), data)
+        memmap = handler.get(DataDefinition('dense'))
+        self.assertIsInstance(memmap, np.memmap)
+        self.assertFalse(memmap.flags.writeable)
+        np.testing.assert_array_equal(memmap, data)
+        with self.assertRaises(ValueError):
+            handler.write_data(DataDefinition('nan'), np.array([np.nan]))
+        with self.assertRaises(ValueError):
+            handler.write_data(DataDefinition('sparse'), ss.csr_matrix(data))
+
+        # fill a preallocated memmap in place
+        context = {}
+        handler.update_context(context, DataDefinition('context'),
+                               create_dataset_context='create_dataset')
+        self.assertFalse(handler.is_return_data_expected(create_dataset_context='create_dataset'))
+        dataset = context['create_dataset']['context'](shape=(3, 4), dtype=np.float32)
+        dataset[:2] = data[:2]
+        dataset[2:] = data[2:]
+        handler.close_data(DataDefinition('context'))
+        np.testing.assert_array_equal(handler.get(DataDefinition('context')), data)
+
+    def test_arrow(self):
+        pytest.importorskip('pyarrow')
+        handler = ArrowDataHandler(self.test_output_dir, layout='hashed')
+        df = pd.DataFrame({'a': np.arange(5), 'b': np.arange(5) * 0.5})
+        handler.write_data(DataDefinition('table'), df, batch_size=2)
+        self.assertTrue(handler.can_skip(DataDefinition('table')))
+        dataset = handler.get(DataDefinition('table'))
+        pd.testing.assert_frame_equal(dataset.select(columns=['b'], start=1, stop=3),
+                                      df[['b']].iloc[1:3])
+        pd.testing.assert_frame_equal(handler.prepare_bundle_data(dataset), df)
+        with self.assertRaises(ValueError):
+            handler.write_data(DataDefinition('nan'), pd.DataFrame({'a': [np.nan]}))
+
+        # the datasets are kept open until close_data()
+        self.assertIs(handler.get(DataDefinition('table')), dataset)
+        handler.close_data(DataDefinition('table'))
+        self.assertEqual(len(handler.dataset_dict), 0)
+        self.assertIsNot(handler.get(DataDefinition('table')), dataset)
+        handler.close()
+
+    def test_h5py_mmap(self):
+        handler = H5pyDataHandler(self.test_output_dir, mmap=True)
+        data = np.arange(12, dtype=np.float32).reshape(3, 4)
+        handler.write_data(DataDefinition('dense'), data)
+        memmap = handler.get(DataDefinition('dense'))
+        self.assertIsInstance(memmap, np.memmap)
+        self.assertFalse(memmap.flags.writeable)
+        np.testing.assert_array_equal(memmap, data)
+
+        # chunked data can't be memory-mapped, but can be read into a buffer
+        context = {}
+        handler.update_context(context, DataDefinition('chunked'),
+                               create_dataset_context='create_dataset')
+        context['create_dataset']['chunked'](data=data, chunks=(1, 4))
+        handler.close()
+        self.assertNotIsInstance(handler.get(DataDefinition('chunked')), np.memmap)
+        buffer = np.zeros((2, 4), dtype=np.float32)
+        handler.read_direct(DataDefinition('chunked'), buffer, np.s_[1:3])
+        np.testing.assert_array_equal(buffer, data[1:3])
+        handler.close()
+
+    def test_h5py_chunks_and_compression(self):
+        handler = H5pyDataHandler(self.test_output_dir)
+        data = np.tile(np.arange(8), (1000, 1))
+        handler.write_data(DataDefinition('dense'), data,
+                           compression='gzip', shuffle=True, dtype='uint8')
+        handler.write_data(DataDefinition('sparse'), ss.csr_matrix(data), compression='lzf')
+        context = {}
+        handler.update_context(context, DataDefinition('context'),
+                               create_dataset_context='create_dataset', chunks='auto')
+        context['create_dataset']['context'](shape=(300000, 4), dtype=np.float64)
+        handler.close()
+
+        with h5py.File(str(handler.layout.get_path(DataDefinition('dense'))), 'r') as h5f:
+            self.assertEqual(h5f['data'].compression, 'gzip')
+            self.assertTrue(h5f['data'].shuffle)
+            self.assertEqual(h5f['data'].dtype, np.uint8)
+            self.assertEqual(h5f['data'].chunks, (1000, 8))
+            np.testing.assert_array_equal(h5f['data'][()], data)
+        with h5py.File(str(handler.layout.get_path(DataDefinition('sparse'))), 'r') as h5f:
+            self.assertEqual(h5f['data/indices'].compression, 'lzf')
+        with h5py.File(str(handler.layout.get_path(DataDefinition('context'))), 'r') as h5f:
+            self.assertIsNone(h5f['data'].compression)
+            self.assertEqual(h5f['data'].chunks, (32768, 4))
+        np.testing.assert_array_equal(handler.get(DataDefinition('sparse'))[()].toarray(), data)
+        handler.close()
+
+    def test_get_row_chunks(self):
+        self.assertEqual(get_row_chunks((10 ** 6, 100), np.float64), (1310, 100))
+        self.assertEqual(get_row_chunks((10, 100), np.float64), (10, 100))
+        self.assertEqual(get_row_chunks((2, 3, 2 ** 20), np.float32), (1, 3, 87381))
+        self.assertIsNone(get_row_chunks((0, 100), np.float64))
+        self.assertIsNone(get_row_chunks((), np.float64))
+
+    def test_hashed_layout(self):
+        data_definition = DataDefinition('feature', {'values': list(range(200))})
+        handler = PickleDataHandler(self.test_output_dir, layout='hashed')
+        handler.write_data(data_definition, 'data')
+        path = handler.layout.get_path(data_definition)
+        self.assertLess(len(path.name), 255)
+        self.assertEqual(path.parent.parent.parent, Path(self.test_output_dir))
+        self.assertEqual(list(handler.layout.read_manifest().values()),
+                         [data_definition.to_json()])
+        self.assertEqual(handler.get(data_definition), 'data')
+
+        # the torn lines are skipped, and the files deleted by hand are synced
+        with open(str(handler.layout.manifest_path), 'a') as fp:
+            fp.write('0123')
+        data_definitions = [DataDefinition('feature', {'i': i}) for i in range(20)]
+        for data_def in data_definitions:
+            handler.write_data(data_def, 'data')
+        handler.layout.get_path(data_definitions[0]).unlink()
+        self.assertTrue(handler.can_skip_many(data_definitions)[data_definitions[0]])
+        self.assertEqual(handler.layout.sync_manifest(), 1)
+        can_skip_dict = handler.can_skip_many(data_definitions)
+        self.assertFalse(can_skip_dict[data_definitions[0]])
+        self.assertTrue(all(can_skip_dict[data_def] for data_def in data_definitions[1:]))
+        self.assertEqual(len(handler.layout.read_manifest()), 20)
+
+    def test_migrate_from_json_layout(self):
+        data_definitions = [DataDefinition('feature', {'i': i, 'name': 'a'}) for i in range(3)]
+        json_handler = PickleDataHandler(self.test_output_dir)
+        for i, data_definition in enumerate(data_definitions):
+            json_handler.write_data(data_definition, i)
+
+        handler = PickleDataHandler(self.test_output_dir, layout='hashed')
+        self.assertEqual(handler.layout.migrate_from_json_layout(), 3)
+        for i, data_definition in enumerate(data_definitions):
+            self.assertFalse(json_handler.can_skip(data_definition))
+            self.assertTrue(handler.can_skip(data_definition))
+            self.assertEqual(handler.get(data_definition), i)
+
+
+class MemoryDataHandlerTest(unittest.TestCase):
+    def setUp(self):
+        self.test_output_dir = mkdtemp(prefix="dagian_test_output_")
+
+    def tearDown(self):
+        rmtree(self.test_output_dir)
+
+    def test_spill(self):
+        handler = MemoryDataHandler(max_bytes=2000, spill_dir=self.test_output_dir)
+        data_definitions = [DataDefinition('feature', {'i': i}) for i in range(3)]
+        handler.write_data(data_definitions[0], np.arange(100))
+        handler.write_data(data_definitions[1], {'values': np.arange(100)})
+        handler.get(data_definitions[0])
+        handler.write_data(data_definitions[2], np.arange(100))
+        self.assertEqual(handler.n_spills, 1)
+        self.assertNotIn(data_definitions[1], handler.data)
+        self.assertTrue(handler.can_skip(data_definitions[1]))
+        self.assertLessEqual(handler.n_bytes, 2000)
+
+        # reload the spilled data and spill the least recently used one
+        np.testing.assert_array_equal(handler.get(data_definitions[1])['values'],
+                                      np.arange(100))
+        self.assertEqual((handler.n_spills, handler.n_reloads), (2, 1))
+        np.testing.assert_array_equal(handler.get(data_definitions[0]), np.arange(100))
+        self.assertEqual(handler.n_reloads, 2)
+
+        for data_definition in data_definitions:
+            handler.release_data(data_definition)
+        self.assertEqual(handler.n_bytes, 0)
+        self.assertEqual(os.listdir(self.test_output_dir), [])
+        # the given directory is kept
+        handler.close()
+        self.assertTrue(os.path.isdir(self.test_output_dir))
+
+    def test_spill_to_temporary_directory(self):
+        handler = MemoryDataHandler(max_bytes=1000)
+        data_definitions = [DataDefinition('feature', {'i': i}) for i in range(2)]
+        for data_definition in data_definitions:
+            handler.write_data(data_definition, np.arange(100))
+        spill_dir = str(handler.spill_dir)
+        self.assertEqual(len(os.listdir(spill_dir)), 1)
+
+        # the spilled data are still available after closing
+        handler.close()
+        np.testing.assert_array_equal(handler.get(data_definitions[0]), np.arange(100))
+        self.assertTrue(os.path.isdir(spill_dir))
+
+        for data_definition in data_definitions:
+            handler.release_data(data_definition)
+        handler.close()
+        self.assertFalse(os.path.exists(spill_dir))
+        self.assertIsNone(handler.spill_dir)
+
+    def test_spill_ndarray_subclasses(self):
+        handler = MemoryDataHandler(max_bytes=1000, spill_dir=self.test_output_dir)
+        masked_array = np.ma.masked_array(np.arange(100), mask=np.arange(100) % 2 == 0)
+        matrix = np.matrix(np.arange(100).reshape(10, 10))
+        handler.write_data(DataDefinition('masked'), masked_array)
+        handler.write_data(DataDefinition('matrix'), matrix)
+        handler.write_data(DataDefinition('other'), np.arange(100))
+        self.assertEqual(handler.n_spills, 2)
+
+        reloaded_masked_array = handler.get(DataDefinition('masked'))
+        self.assertIsInstance(reloaded_masked_array, np.ma.MaskedArray)
+        np.testing.assert_array_equal(reloaded_masked_array.mask, masked_array.mask)
+        reloaded_matrix = handler.get(DataDefinition('matrix'))
+        self.assertIsInstance(reloaded_matrix, np.matrix)
+        np.testing.assert_array_equal(reloaded_matrix, matrix)
@@ -4,11 +4,15 @@ from tempfile import mkdtemp
 from shutil import rmtree
 
 import h5py
+import h5sparse
+import numpy as np
+import pytest
+from dagian.bundling import get_data_definitions_from_structure
+from dagian.tools.config import get_data_generator_from_config
 from dagian.tools.dagian_runner import dagian_run_with_configs
 
 
-def test_generate_lifetime_features():
-    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+def get_lifetime_configs(test_output_dir):
     h5py_hdf_dir = join(test_output_dir, "h5py")
     pandas_hdf_dir = join(test_output_dir, "pandas")
     pickle_dir = join(test_output_dir, "pickle")
@@ -90,10 +94,11 @@ def test_generate_lifetime_features():
             }
         }
     }
+    return global_config, bundle_config
 
-    dagian_run_with_configs(global_config, bundle_config)
 
-    data_bundle_hdf_path = join(data_bundles_dir, bundle_config['name'] + '.h5')
+def check_lifetime_bundle(global_config, bundle_config):
+    data_bundle_hdf_path = join(global_config['data_bundles_dir'], bundle_config['name'] + '.h5')
     with h5py.File(data_bundle_hdf_path, "r") as data_bundle_h5f:
         assert set(data_bundle_h5f) == {'features', 'test_filters', 'label', 'test_dict'}
         assert set(data_bundle_h5f['test_filters']) == {'is_in_test_set'}
@@ -101,5 +106,77 @@ def test_generate_lifetime_features():
         assert (set(data_bundle_h5f['test_dict/comparison'])
                 == set(bundle_config['structure']['test_dict']['comparison']))
         assert data_bundle_h5f['features'].shape == (6, 20)
+        # the rows are written in blocks of whole chunks
+        assert data_bundle_h5f['features'].chunks == (6, 20)
+
+
+@pytest.mark.parametrize('executor', [None, 'thread', 'process'])
+def test_generate_lifetime_features(executor):
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    global_config, bundle_config = get_lifetime_configs(test_output_dir)
+    dagian_run_with_configs(global_config, bundle_config, executor=executor)
+    check_lifetime_bundle(global_config, bundle_config)
+    rmtree(test_output_dir)
+
+
+def test_generate_lifetime_features_hashed_layout():
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    global_config, bundle_config = get_lifetime_configs(test_output_dir)
+    global_config['generator_kwargs']['file_layout'] = 'hashed'
+    dagian_run_with_configs(global_config, bundle_config)
+    check_lifetime_bundle(global_config, bundle_config)
+    rmtree(test_output_dir)
+
+
+def test_generate_lifetime_features_with_cache():
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    global_config, bundle_config = get_lifetime_configs(test_output_dir)
+    global_config['generator_kwargs']['cache_bytes'] = 2 ** 20
+    dagian_run_with_configs(global_config, bundle_config)
+    check_lifetime_bundle(global_config, bundle_config)
+    rmtree(test_output_dir)
+
+
+def test_generate_lifetime_features_release_memory():
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    global_config, bundle_config = get_lifetime_configs(test_output_dir)
+    dagian_run_with_configs(global_config, bundle_config, release_memory=True)
+    check_lifetime_bundle(global_config, bundle_config)
+    rmtree(test_output_dir)
+
+
+def test_bundle_with_readers():
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    global_config, bundle_config = get_lifetime_configs(test_output_dir)
+    dagian_run_with_configs(global_config, bundle_config, bundle_readers=3)
+    check_lifetime_bundle(global_config, bundle_config)
+
+    # compare with the serial filling using small batches
+    data_generator = get_data_generator_from_config(global_config)
+    data_generator.generate(get_data_definitions_from_structure(bundle_config['structure']))
+    serial_bundle_path = join(test_output_dir, 'serial.h5')
+    data_generator.bundle(bundle_config['structure'], serial_bundle_path, buffer_size=64,
+                          structure_config=bundle_config['structure_config'])
+    data_bundle_hdf_path = join(global_config['data_bundles_dir'], bundle_config['name'] + '.h5')
+    with h5py.File(data_bundle_hdf_path, 'r') as h5f, h5py.File(serial_bundle_path, 'r') as h5f2:
+        np.testing.assert_array_equal(h5f['features'][()], h5f2['features'][()])
+    rmtree(test_output_dir)
+
+
+def test_bundle_sparse_concat():
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    global_config, bundle_config = get_lifetime_configs(test_output_dir)
+    dagian_run_with_configs(global_config, bundle_config)
 
+    data_generator = get_data_generator_from_config(global_config)
+    data_generator.generate(get_data_definitions_from_structure(bundle_config['structure']))
+    sparse_bundle_path = join(test_output_dir, 'sparse.h5')
+    data_generator.bundle(bundle_config['structure'], sparse_bundle_path, buffer_size=256,
+                          structure_config={'features': {'concat': True, 'sparse': 'auto'}})
+    data_bundle_hdf_path = join(global_config['data_bundles_dir'], bundle_config['name'] + '.h5')
+    with h5py.File(data_bundle_hdf_path, 'r') as h5f, \
+            h5sparse.File(sparse_bundle_path, 'r') as sparse_h5f:
+        sparse_features = sparse_h5f['features'][()]
+        assert sparse_features.format == 'csr'
+        np.testing.assert_array_equal(sparse_features.toarray(), h5f['features'][()])
     rmtree(test_output_dir)
@@ -0,0 +1,166 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from tempfile import mkdtemp
+from shutil import rmtree
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import dagian
+from dagian.data_definition import DataDefinition
+from dagian.data_handlers import (
+    CachedDataHandler,
+    H5pyDataHandler,
+    MemoryDataHandler,
+    PickleDataHandler,
+)
+from dagian.decorators import require, will_generate
+from dagian.scheduling import _get_subprocess_init_arg
+
+
+class ResourceFeatureGenerator(dagian.FeatureGenerator):
+
+    def __init__(self):
+        super(ResourceFeatureGenerator, self).__init__()
+        self.lock = threading.Lock()
+        self.memory_gb = 0
+        self.max_memory_gb = 0
+        self.started_keys = []
+
+    def _run(self, key, memory_gb=0):
+        with self.lock:
+            self.started_keys.append(key)
+            self.memory_gb += memory_gb
+            self.max_memory_gb = max(self.max_memory_gb, self.memory_gb)
+        time.sleep(0.05)
+        with self.lock:
+            self.memory_gb -= memory_gb
+        return {key: key}
+
+    @will_generate('memory', 'short', resources={'memory_gb': 30})
+    def gen_short(self, context):
+        return self._run('short', memory_gb=30)
+
+    @will_generate('memory', 'chain_1', resources={'memory_gb': 30})
+    def gen_chain_1(self, context):
+        return self._run('chain_1', memory_gb=30)
+
+    @require('chain_1')
+    @will_generate('memory', 'chain_2')
+    def gen_chain_2(self, context):
+        return self._run('chain_2')
+
+    @require('chain_2')
+    @will_generate('memory', 'chain_3', resources={'threads': 8})
+    def gen_chain_3(self, context):
+        return self._run('chain_3')
+
+
+def test_resource_budgets():
+    data_generator = ResourceFeatureGenerator()
+    data_definitions = [DataDefinition('short'), DataDefinition('chain_3')]
+    data_generator.generate(data_definitions, executor='thread', max_workers=4,
+                            resources={'memory_gb': 40})
+    assert data_generator.max_memory_gb == 30
+    assert data_generator.get(DataDefinition('chain_3')) == 'chain_3'
+
+    data_generator = ResourceFeatureGenerator()
+    data_generator.generate(data_definitions, executor='thread', max_workers=4,
+                            resources={'memory_gb': 60})
+    assert data_generator.max_memory_gb == 60
+
+
+def test_critical_path_first():
+    data_generator = ResourceFeatureGenerator()
+    data_generator.generate([DataDefinition('short'), DataDefinition('chain_3')],
+                            executor='thread', max_workers=1)
+    assert data_generator.started_keys == ['chain_1', 'chain_2', 'chain_3', 'short']
+
+
+@pytest.mark.parametrize('executor', [None, 'thread'])
+def test_release_memory(executor):
+    data_generator = ResourceFeatureGenerator()
+    memory_data = data_generator.get_handler('chain_1').data
+    data_generator.generate([DataDefinition('chain_3')], executor=executor,
+                            release_memory=True)
+    assert set(memory_data) == {DataDefinition('chain_3')}
+
+    data_generator = ResourceFeatureGenerator()
+    memory_data = data_generator.get_handler('chain_1').data
+    data_generator.generate([DataDefinition('chain_3')], executor=executor,
+                            release_memory=True, pinned=[DataDefinition('chain_1')])
+    assert set(memory_data) == {DataDefinition('chain_1'), DataDefinition('chain_3')}
+
+
+class OpenFilesFeatureGenerator(dagian.FeatureGenerator):
+
+    def __init__(self, h5py_hdf_dir):
+        super(OpenFilesFeatureGenerator, self).__init__(handlers={
+            'h5py': H5pyDataHandler(h5py_hdf_dir, max_open_files=1)})
+        self.n_open_files = []
+
+    @will_generate('h5py', ['base_1', 'base_2', 'base_3'])
+    def gen_base(self, context):
+        return {'base_1': np.ones(3), 'base_2': np.ones(3), 'base_3': np.ones(3)}
+
+    def _sum_base(self, key, context):
+        self.n_open_files.append(len(self.get_handler('base_1').h5f_dict))
+        return {key: context['upstream_data'][key.replace('sum', 'base')][()].sum()}
+
+    @require('base_1')
+    @will_generate('memory', 'sum_1')
+    def gen_sum_1(self, context):
+        return self._sum_base('sum_1', context)
+
+    @require('base_2')
+    @will_generate('memory', 'sum_2')
+    def gen_sum_2(self, context):
+        return self._sum_base('sum_2', context)
+
+    @require('base_3')
+    @will_generate('memory', 'sum_3')
+    def gen_sum_3(self, context):
+        return self._sum_base('sum_3', context)
+
+    @require('base_1')
+    @require('base_2')
+    @require('base_3')
+    @require('sum_1')
+    @require('sum_2')
+    @require('sum_3')
+    @will_generate('memory', 'total')
+    def gen_total(self, context):
+        upstream_data = context['upstream_data']
+        return {'total': sum(upstream_data['base_%d' % i][()].sum()
+                             + upstream_data['sum_%d' % i] for i in range(1, 4))}
+
+
+def test_limit_open_files_with_thread_executor():
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    data_generator = OpenFilesFeatureGenerator(test_output_dir)
+    data_generator.generate([DataDefinition('total')], executor='thread', max_workers=1)
+    # the files of base_1 and base_2 are still required by total, but at most one of them is
+    # kept open besides the file read by the running node
+    assert len(data_generator.n_open_files) == 3
+    assert max(data_generator.n_open_files) <= 2
+    assert data_generator.get(DataDefinition('total')) == 18
+    data_generator.close()
+    rmtree(test_output_dir)
+
+
+def test_subprocess_init_args_without_memory_data():
+    test_output_dir = mkdtemp(prefix="dagian_test_output_")
+    memory_handler = MemoryDataHandler()
+    memory_handler.write_data(DataDefinition('short'), 'short')
+    pickle_handler = PickleDataHandler(test_output_dir)
+    handlers = _get_subprocess_init_arg({
+        'memory': memory_handler,
+        'cached_memory': CachedDataHandler(memory_handler, 100),
+        'pickle': pickle_handler,
+    })
+    assert handlers['memory'].data == {}
+    assert handlers['cached_memory'].handler.data == {}
+    assert handlers['pickle'] is pickle_handler
+    assert memory_handler.can_skip(DataDefinition('short'))
+    rmtree(test_output_dir)
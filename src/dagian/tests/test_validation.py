@@ -0,0 +1,44 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+import unittest
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ss
+import six
+
+from dagian.validation import NaNLocation, find_nan, check_no_nan
+
+
+class FindNaNTest(unittest.TestCase):
+    def test_dense(self):
+        data = np.zeros((100, 5))
+        self.assertIsNone(find_nan(data, chunk_size=50))
+        data[37, 3] = np.nan
+        data[38, 1] = np.nan
+        self.assertEqual(find_nan(data, chunk_size=50), NaNLocation(3, 37, 39))
+        self.assertEqual(find_nan(data[:, 3], chunk_size=50), NaNLocation(None, 37, 38))
+        self.assertIsNone(find_nan(np.arange(10), chunk_size=3))
+
+        # inf - inf in the sum isn't NaN in the data
+        self.assertIsNone(find_nan(np.array([np.inf, -np.inf, 1.]), chunk_size=2))
+
+    def test_sparse(self):
+        data = ss.random(100, 20, density=0.2, format='csr', random_state=0)
+        self.assertIsNone(find_nan(data, chunk_size=16))
+        data = data.tolil()
+        data[42, 7] = np.nan
+        for sparse_format in ('csr', 'csc', 'coo', 'lil'):
+            self.assertEqual(find_nan(data.asformat(sparse_format), chunk_size=16),
+                             NaNLocation(7, 42, 43))
+
+    def test_pandas(self):
+        df = pd.DataFrame({'a': np.arange(10), 'b': np.ones(10), 'c': ['x'] * 10})
+        self.assertIsNone(find_nan(df, chunk_size=4))
+        df.loc[5, 'b'] = np.nan
+        self.assertEqual(find_nan(df, chunk_size=4), NaNLocation('b', 5, 6))
+        df.loc[5, 'b'] = 1.
+        df.loc[8, 'c'] = None
+        self.assertEqual(find_nan(df['c'], chunk_size=4), NaNLocation('c', 8, 9))
+        with six.assertRaisesRegex(self, ValueError,
+                                   "data df have nan in column 'c' at rows 8:9"):
+            check_no_nan(df, 'df')
@@ -11,11 +11,14 @@ from pathlib2 import Path
 from dotenv import load_dotenv, find_dotenv
 
 from .config import get_data_generator_from_config
-from ..bundling import get_data_definitions_from_structure
+from ..bundle_formats import BUNDLE_FORMATS
+from ..bundling import get_bundle_data_definitions
 
 
 def dagian_run_with_configs(global_config, bundle_config, dag_output_path=None,
-                            no_bundle=False):
+                            no_bundle=False, executor=None, max_workers=None, resources=None,
+                            bundle_readers=0, rebundle=False, bundle_format='hdf5',
+                            release_memory=False):
     """Generate feature with configurations.
 
     global_config (Mapping): global configuration
@@ -26,22 +29,49 @@ def dagian_run_with_configs(global_config, bundle_config, dag_output_path=None,
     bundle_config (Mapping): bundle configuration
         name: string
         structure: Mapping
+
+    executor (Optional[str]): the executor used to generate the nodes concurrently
+
+    max_workers (Optional[int]): the maximum number of nodes generated concurrently
+
+    resources (Optional[Mapping]): the resource budgets when generating concurrently
+
+    bundle_readers (int): the number of threads reading the data for the concatenated datasets
+
+    rebundle (bool): rewrite the whole bundle instead of only the outdated datasets
+
+    bundle_format (str): 'hdf5' for a single file, or 'npy' or 'arrow' for a directory
+
+    release_memory (bool): free the in-memory intermediate data once their consumers finish
     """
     if not isinstance(global_config, Mapping):
         raise ValueError("global_config should be a Mapping object.")
     if not isinstance(bundle_config, Mapping):
         raise ValueError("bundle_config should be a Mapping object.")
     data_generator = get_data_generator_from_config(global_config)
-    data_definitions = get_data_definitions_from_structure(bundle_config['structure'])
-    data_generator.generate(data_definitions, dag_output_path)
+    # the row selectors in the structure config are also generated
+    data_definitions = get_bundle_data_definitions(bundle_config['structure'],
+                                                   bundle_config.get('structure_config') or {})
+    data_generator.generate(data_definitions, dag_output_path,
+                            executor=executor, max_workers=max_workers, resources=resources,
+                            release_memory=release_memory)
 
     if not no_bundle:
         data_bundles_dir = Path(global_config['data_bundles_dir']).expanduser()
         data_bundles_dir.mkdir(parents=True, exist_ok=True)
-        bundle_path = data_bundles_dir / (bundle_config['name'] + '.h5')
+        if bundle_format == 'hdf5':
+            bundle_path = data_bundles_dir / (bundle_config['name'] + '.h5')
+        else:
+            bundle_path = data_bundles_dir / bundle_config['name']
         data_generator.bundle(
             bundle_config['structure'], data_bundle_hdf_path=bundle_path,
-            structure_config=bundle_config['structure_config'])
+            structure_config=bundle_config['structure_config'], n_readers=bundle_readers,
+            incremental=not rebundle, bundle_format=bundle_format)
+
+
+def parse_resource(resource_str):
+    name, amount = resource_str.split('=', 1)
+    return name, float(amount)
 
 
 def dagian_run(argv=sys.argv[1:]):
@@ -61,6 +91,26 @@ def dagian_run(argv=sys.argv[1:]):
                         help=".env file path to define environment variables")
     parser.add_argument('--no-bundle', action='store_true',
                         help="not generate the data bundle")
+    parser.add_argument('--executor', choices=['thread', 'process'], default=None,
+                        help="generate the independent nodes concurrently")
+    parser.add_argument('-j', '--max-workers', type=int, default=None,
+                        help="the maximum number of nodes generated concurrently")
+    parser.add_argument('-r', '--resource', type=parse_resource, action='append', default=[],
+                        metavar='NAME=AMOUNT',
+                        help="the budget of a resource declared in will_generate() when "
+                             "generating concurrently (can be used multiple times)")
+    parser.add_argument('--bundle-readers', type=int, default=0,
+                        help="the number of threads reading the data for the concatenated "
+                             "datasets while the bundle is written")
+    parser.add_argument('--rebundle', action='store_true',
+                        help="rewrite the whole bundle instead of only the outdated datasets")
+    parser.add_argument('--format', dest='bundle_format', choices=BUNDLE_FORMATS,
+                        default='hdf5',
+                        help="write the bundle as an HDF5 file, or as a directory of .npy "
+                             "files with the DataFrames in .npy or Arrow IPC files")
+    parser.add_argument('--release-memory', action='store_true',
+                        help="free the in-memory intermediate data as soon as all the nodes "
+                             "consuming them finish")
     args = parser.parse_args(argv)
     load_dotenv(args.env_file_path)
     with open(args.global_config) as fp:
@@ -68,4 +118,9 @@ def dagian_run(argv=sys.argv[1:]):
     with open(args.bundle_config) as fp:
         bundle_config = yaml.safe_load(fp)
     bundle_config.setdefault('name', Path(args.bundle_config).stem)
-    dagian_run_with_configs(global_config, bundle_config, args.dag_output_path, args.no_bundle)
+    dagian_run_with_configs(global_config, bundle_config, args.dag_output_path, args.no_bundle,
+                            executor=args.executor, max_workers=args.max_workers,
+                            resources=dict(args.resource) or None,
+                            bundle_readers=args.bundle_readers, rebundle=args.rebundle,
+                            bundle_format=args.bundle_format,
+                            release_memory=args.release_memory)
@@ -49,6 +49,12 @@ class FrozenDict(Mapping):
         self._hash = h
         return h
 
+    def __getstate__(self):
+        # the cached hash is not valid in another process
+        state = self.__dict__.copy()
+        state.pop('_hash', None)
+        return state
+
     def keys(self):
         return six.viewkeys(self._dict)
 
@@ -0,0 +1,145 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import OrderedDict
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ss
+import six
+
+
+def get_nbytes(obj):
+    """Estimate the memory used by an in-memory object.
+
+    Returns None for the objects whose size can't be estimated, e.g., lazy datasets backed by
+    files. The containers are summed recursively.
+    """
+    if isinstance(obj, np.memmap) or (isinstance(obj, np.ndarray)
+                                      and isinstance(obj.base, np.memmap)):
+        # the pages are owned by the OS
+        return None
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.hasobject:
+            return None
+        return obj.nbytes
+    if ss.issparse(obj):
+        if obj.format in ('csr', 'csc', 'bsr'):
+            return obj.data.nbytes + obj.indices.nbytes + obj.indptr.nbytes
+        if obj.format == 'coo':
+            return obj.data.nbytes + obj.row.nbytes + obj.col.nbytes
+        return None
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return int(obj.memory_usage(deep=True, index=True).sum()
+                   if isinstance(obj, pd.DataFrame) else obj.memory_usage(deep=True))
+    if isinstance(obj, (six.binary_type, six.text_type, float, bool) + six.integer_types) \
+            or obj is None:
+        return sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        values = list(obj)
+    elif isinstance(obj, dict):
+        values = list(six.viewkeys(obj)) + list(six.viewvalues(obj))
+    else:
+        return None
+    nbytes = sys.getsizeof(obj)
+    for value in values:
+        value_nbytes = get_nbytes(value)
+        if value_nbytes is None:
+            return None
+        nbytes += value_nbytes
+    return nbytes
+
+
+class LRUCache(object):
+    """A thread-safe cache that evicts the least recently used items beyond a byte budget.
+
+    Parameters
+    ----------
+    max_bytes : int
+        The budget of the total size of the cached items. An item larger than the budget is
+        not cached.
+    get_size : Callable[[object], Optional[int]]
+        Get the size of an item. The items of size None are not cached.
+    """
+
+    def __init__(self, max_bytes, get_size=get_nbytes):
+        self.max_bytes = max_bytes
+        self.get_size = get_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # locks can't be pickled, and the cached items are not shipped
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['_items'] = OrderedDict()
+        state['n_bytes'] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get(self, key, default=None):
+        """Get an item and mark it as the most recently used one."""
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return default
+            self.hits += 1
+            # OrderedDict.move_to_end() is not available in Python 2
+            item = self._items.pop(key)
+            self._items[key] = item
+            return item[0]
+
+    def put(self, key, value, size=None):
+        """Cache an item, evicting the least recently used ones if needed.
+
+        Parameters
+        ----------
+        size : Optional[int]
+            The size of the item. Default to ``get_size(value)``.
+
+        Returns
+        -------
+        cached : bool
+            False if the item is not cached because its size is unknown or over the budget.
+        """
+        if size is None:
+            size = self.get_size(value)
+        with self._lock:
+            self._pop(key)
+            if size is None or size > self.max_bytes:
+                return False
+            self._items[key] = (value, size)
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.n_bytes -= evicted_size
+            return True
+
+    def _pop(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.n_bytes -= item[1]
+        return item
+
+    def pop(self, key, default=None):
+        """Remove an item from the cache."""
+        with self._lock:
+            item = self._pop(key)
+        return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.n_bytes = 0
@@ -0,0 +1,47 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def iter_prefetched(function, args_list, n_workers, max_pending=None):
+    """Call a function on each element of ``args_list`` in worker threads, and yield the results
+    in order.
+
+    At most ``max_pending`` calls are submitted but not yet consumed, so a slow consumer makes
+    the workers wait instead of accumulating the results in memory.
+
+    Parameters
+    ----------
+    function : Callable
+    args_list : Iterable[tuple]
+        The positional arguments of each call.
+    n_workers : int
+        The number of worker threads. If 0, the function is called in the consuming thread.
+    max_pending : Optional[int]
+        Default to ``2 * n_workers``.
+    """
+    if n_workers <= 0:
+        for args in args_list:
+            yield function(*args)
+        return
+    if max_pending is None:
+        max_pending = 2 * n_workers
+    args_iter = iter(args_list)
+    pending_futures = deque()
+    executor = ThreadPoolExecutor(max_workers=n_workers)
+    try:
+        for args in args_iter:
+            pending_futures.append(executor.submit(function, *args))
+            if len(pending_futures) >= max_pending:
+                break
+        while pending_futures:
+            result = pending_futures.popleft().result()
+            for args in args_iter:
+                pending_futures.append(executor.submit(function, *args))
+                break
+            yield result
+    finally:
+        # the consumer may stop early
+        for future in pending_futures:
+            future.cancel()
+        executor.shutdown(wait=True)
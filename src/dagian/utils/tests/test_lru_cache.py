@@ -0,0 +1,42 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+import pickle
+import unittest
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ss
+
+from dagian.utils.lru_cache import LRUCache, get_nbytes
+
+
+class LRUCacheTest(unittest.TestCase):
+    def test_eviction(self):
+        cache = LRUCache(max_bytes=3, get_size=len)
+        cache.put('a', 'x')
+        cache.put('b', 'yy')
+        self.assertEqual(cache.get('a'), 'x')
+        cache.put('c', 'z')
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.n_bytes, 2)
+        self.assertFalse(cache.put('d', 'long'))
+        self.assertIsNone(cache.get('d'))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        self.assertEqual(cache.pop('a'), 'x')
+        self.assertEqual(cache.n_bytes, 1)
+
+    def test_pickle(self):
+        cache = LRUCache(max_bytes=10, get_size=len)
+        cache.put('a', 'x')
+        cache = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(len(cache), 0)
+        self.assertTrue(cache.put('a', 'x'))
+
+    def test_get_nbytes(self):
+        array = np.zeros(10)
+        self.assertEqual(get_nbytes(array), 80)
+        self.assertEqual(get_nbytes(ss.csr_matrix(np.eye(3))),
+                         3 * 8 + 3 * 4 + 4 * 4)
+        self.assertGreater(get_nbytes(pd.DataFrame({'a': array})), 80)
+        self.assertGreater(get_nbytes({'a': (array, 1)}), 80)
+        self.assertIsNone(get_nbytes(object()))
+        self.assertIsNone(get_nbytes([array, object()]))
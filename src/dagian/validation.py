@@ -0,0 +1,144 @@
+from __future__ import print_function, division, absolute_import, unicode_literals
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as ss
+import six
+
+
+# the number of elements checked at once, which bounds the size of the temporary masks
+NAN_CHECK_CHUNK_SIZE = 2 ** 16
+
+
+class NaNLocation(namedtuple('NaNLocation', ['column', 'row_start', 'row_stop'])):
+    """The location of the first NaN found.
+
+    ``column`` is the column label of a DataFrame, the name of a Series, the column index of a
+    2-d array (a tuple for higher dimensions), or None for a 1-d array. The rows from
+    ``row_start`` to ``row_stop`` (exclusive) cover the NaNs found in the checked chunk.
+    """
+
+
+def can_have_nan(dtype):
+    return np.dtype(dtype).kind in 'fc'
+
+
+def _iter_row_chunks(n_rows, row_size, chunk_size):
+    n_chunk_rows = max(1, chunk_size // max(1, row_size))
+    for start in range(0, n_rows, n_chunk_rows):
+        yield start, min(start + n_chunk_rows, n_rows)
+
+
+def _sum_is_nan(array):
+    with np.errstate(invalid='ignore', over='ignore'):
+        return np.isnan(array.sum())
+
+
+def _find_null_in_series(series, chunk_size):
+    """Find the missing values of the non-numeric Series (e.g., None, NaT)."""
+    values = series.values
+    for start, stop in _iter_row_chunks(len(values), 1, chunk_size):
+        null_rows = np.flatnonzero(pd.isnull(values[start:stop]))
+        if len(null_rows) > 0:
+            return NaNLocation(series.name, start + int(null_rows[0]),
+                               start + int(null_rows[-1]) + 1)
+    return None
+
+
+def _find_nan_in_array(array, chunk_size):
+    if array.ndim == 0:
+        return NaNLocation(None, 0, 1) if np.isnan(array) else None
+    row_size = int(np.prod(array.shape[1:]))
+    for start, stop in _iter_row_chunks(array.shape[0], row_size, chunk_size):
+        chunk = array[start:stop]
+        # the sum is NaN if the chunk has NaN (or both inf and -inf), and it needs no mask
+        if not _sum_is_nan(chunk):
+            continue
+        nan_mask = np.isnan(chunk)
+        nan_rows = np.flatnonzero(nan_mask.reshape(len(chunk), -1).any(axis=1))
+        if len(nan_rows) == 0:
+            continue
+        if array.ndim == 1:
+            column = None
+        else:
+            column_index = np.argwhere(nan_mask[nan_rows[0]])[0]
+            column = int(column_index[0]) if array.ndim == 2 else tuple(column_index.tolist())
+        return NaNLocation(column, start + int(nan_rows[0]), start + int(nan_rows[-1]) + 1)
+    return None
+
+
+def _find_nan_in_sparse(matrix, chunk_size):
+    if matrix.format not in ('csr', 'csc', 'coo'):
+        matrix = matrix.tocsr()
+    values = matrix.data
+    for start, stop in _iter_row_chunks(len(values), 1, chunk_size):
+        if not _sum_is_nan(values[start:stop]):
+            continue
+        nan_indices = start + np.flatnonzero(np.isnan(values[start:stop]))
+        if len(nan_indices) == 0:
+            continue
+        if matrix.format == 'coo':
+            rows = matrix.row[nan_indices]
+            column = matrix.col[nan_indices[0]]
+        else:
+            major_indices = np.searchsorted(matrix.indptr, nan_indices, side='right') - 1
+            minor_indices = matrix.indices[nan_indices]
+            if matrix.format == 'csr':
+                rows, columns = major_indices, minor_indices
+            else:
+                rows, columns = minor_indices, major_indices
+            column = columns[0]
+        return NaNLocation(int(column), int(rows.min()), int(rows.max()) + 1)
+    return None
+
+
+def find_nan(data, chunk_size=NAN_CHECK_CHUNK_SIZE):
+    """Find NaN chunk by chunk without building a boolean mask of the whole data.
+
+    The data types that can't hold NaN (e.g., integers) are not checked, and the check stops
+    at the first chunk having NaN. For the non-numeric columns of pandas data, the missing
+    values (e.g., None, NaT) are also found.
+
+    Parameters
+    ----------
+    data : Union[numpy.ndarray, scipy.sparse.spmatrix, pandas.DataFrame, pandas.Series]
+    chunk_size : int
+        The number of elements checked at once.
+
+    Returns
+    -------
+    location : Optional[NaNLocation]
+        None if there is no NaN.
+    """
+    if ss.isspmatrix(data):
+        if not can_have_nan(data.dtype):
+            return None
+        return _find_nan_in_sparse(data, chunk_size)
+    if isinstance(data, pd.DataFrame):
+        for column, series in six.iteritems(data):
+            location = find_nan(series, chunk_size)
+            if location is not None:
+                return location._replace(column=column)
+        return None
+    if isinstance(data, pd.Series):
+        if data.dtype.kind in 'biu':
+            return None
+        if data.dtype.kind not in 'fc':
+            return _find_null_in_series(data, chunk_size)
+        location = _find_nan_in_array(data.values, chunk_size)
+        if location is not None:
+            location = location._replace(column=data.name)
+        return location
+    data = np.asarray(data)
+    if not can_have_nan(data.dtype):
+        return None
+    return _find_nan_in_array(data, chunk_size)
+
+
+def check_no_nan(data, data_definition, chunk_size=NAN_CHECK_CHUNK_SIZE):
+    """Raise ``ValueError`` if ``find_nan()`` finds NaN in the data."""
+    location = find_nan(data, chunk_size)
+    if location is not None:
+        raise ValueError("data {} have nan in column {!r} at rows {}:{}".format(
+            data_definition, location.column, location.row_start, location.row_stop))